@@ -16,6 +16,7 @@ from Bio import SeqIO
 from itertools import repeat
 from multiprocessing import Pool
 from collections import defaultdict
+from assemble.runner import runCommand
 
 class Abyss:
     def __init__(self, abyss_path, read1, read2, outdir, klen, threads ):
@@ -28,6 +29,7 @@ class Abyss:
         self.klen = klen
         self.log = '{0}/abyss.log'.format(self.outdir)
         self.runtime = '{0}/abyss_runtime.log'.format(self.outdir)
+        self.metrics = '{0}/stage_metrics.jsonl'.format(os.path.abspath(outdir))
         self.result = '{0}/sample-contigs.fa'.format(self.outdir)
         if not os.path.exists(self.outdir):
             os.mkdir(self.outdir)
@@ -46,17 +48,13 @@ class Abyss:
         abyss_param = 'k={0}'.format(self.klen)
         aoutpath = 'name={0}/sample'.format(self.outdir)
         inpath = 'in=\'{0} {1}\''.format(self.read1, self.read2)
-        acmd = [self.abyss_path, aoutpath, inpath, abyss_param]
+        acmd = [self.abyss_path, aoutpath, inpath, abyss_param, 'j={0}'.format(self.threads)]
         logger.write('Running AbySS with the following command\n')
         logger.write('{0}\n'.format(' '.join(acmd)))
 
 
         #Running abyss
-        arun = subprocess.Popen(' '.join(acmd), stdout=runlogger,
-            stderr=runlogger, shell=True)
-        
-        #Capture stdout and stderr
-        alog = arun.communicate()
+        arun = runCommand(' '.join(acmd), 'abyss', runlogger, self.metrics, shell=True)
         elapsed = timeit.default_timer() - start
         runlogger.flush()
         runlogger.close()
@@ -1,23 +1,273 @@
 import os
 import sys
 import pysam
+import array
+import numpy as np
+from multiprocessing import Pool
+from collections import namedtuple
+from collections import OrderedDict
+from assemble.fasta import IndexedFasta
 
+#Reads that do not contribute to depth or pair metrics
+SKIP_FLAGS = 0x4 | 0x100 | 0x200 | 0x400 | 0x800
+#Coverage breadth is reported at each of these depths
+BREADTH_DEPTHS = (1, 10)
+#Block coordinates buffered per contig before folding into the depth array
+FLUSH_BLOCKS = 1048576
 
 
 def readFasta(fasta):
-    fasta_handle = open(fasta)
-    fasta_content = fasta_handle.read().split('>')[1:]
-    fastaid = 1
+    fasta_index = IndexedFasta(fasta)
     Fasta = namedtuple('Fasta',['header','seq','fid','length'])
-    for lines in fasta_content:
-        header = lines.split('\n')[0].split(' ')[0]
-        sequence = ''.join(lines.split('\n')[1:]).upper()
-        length = len(sequence)
+    for fastaid, header in enumerate(fasta_index.names, 1):
+        sequence = fasta_index.fetch(header).upper()
+        length = int(fasta_index.lengths[fastaid - 1])
         record = Fasta(header, sequence, fastaid, length)
-        fastaid += 1
         yield record
+    fasta_index.close()
 
-def bamMetric(assembly, alignment):
-    samfile = pysam.AlignmentFile(alignment,'rb')
-    fasta = readFasta(assembly)
-    
+def foldBlocks(diff, starts, ends):
+    '''Add aligned block starts and ends to a depth difference array'''
+    size = len(diff)
+    diff += np.bincount(np.frombuffer(starts, dtype=np.int32), minlength=size)[:size].astype(np.int32)
+    diff -= np.bincount(np.frombuffer(ends, dtype=np.int32), minlength=size)[:size].astype(np.int32)
+    return(array.array('i'), array.array('i'))
+
+def contigCoverage(samfile, contig, length, minmapq=0, maxinsert=100000):
+    '''Scan the alignments of one contig; return metrics and insert size counts'''
+    diff = np.zeros(length + 1, dtype=np.int32)
+    starts = array.array('i')
+    ends = array.array('i')
+    inserts = array.array('i')
+    reads = paired = proper = 0
+    readbases = clipped = aligned = edits = 0
+    for read in samfile.fetch(contig):
+        if read.flag & SKIP_FLAGS or read.mapping_quality < minmapq:
+            continue
+        reads += 1
+        for start, end in read.get_blocks():
+            starts.append(start)
+            ends.append(end)
+        if len(starts) >= FLUSH_BLOCKS:
+            starts, ends = foldBlocks(diff, starts, ends)
+        for operation, oplength in read.cigartuples:
+            if operation == 4:
+                clipped += oplength
+        readbases += read.infer_query_length()
+        aligned += read.query_alignment_length
+        if read.has_tag('NM'):
+            edits += read.get_tag('NM')
+        if read.is_paired:
+            paired += 1
+            if read.is_proper_pair:
+                proper += 1
+                #Count each template once, from the leftmost mate
+                if read.template_length > 0:
+                    inserts.append(min(read.template_length, maxinsert))
+    foldBlocks(diff, starts, ends)
+    depth = np.cumsum(diff[:-1], dtype=np.int32)
+    metrics = OrderedDict()
+    metrics['Contig'] = contig
+    metrics['Length'] = length
+    metrics['Reads'] = reads
+    metrics['MeanDepth'] = float(depth.mean()) if length else 0.0
+    metrics['MedianDepth'] = float(np.median(depth)) if length else 0.0
+    for mindepth in BREADTH_DEPTHS:
+        covered = int(np.count_nonzero(depth >= mindepth))
+        metrics['Breadth{0}x'.format(mindepth)] = covered / float(length) if length else 0.0
+    metrics['ProperPairRate'] = proper / float(paired) if paired else 0.0
+    metrics['SoftClipRate'] = clipped / float(readbases) if readbases else 0.0
+    metrics['MismatchRate'] = edits / float(aligned) if aligned else 0.0
+    insertcounts = np.bincount(np.frombuffer(inserts, dtype=np.int32), minlength=maxinsert + 1)
+    return(metrics, insertcounts)
+
+def coverageWorker(args):
+    '''Compute contig metrics for a group of contigs in a worker process'''
+    alignment, contigs, minmapq, maxinsert = args
+    samfile = pysam.AlignmentFile(alignment, 'rb')
+    results = list()
+    inserts = np.zeros(maxinsert + 1, dtype=np.int64)
+    for contig, length in contigs:
+        metrics, insertcounts = contigCoverage(samfile, contig, length, minmapq, maxinsert)
+        results.append(metrics)
+        inserts += insertcounts
+    samfile.close()
+    return(results, inserts)
+
+def contigGroups(names, lengths, ngroups):
+    '''Split contigs into about ngroups groups of similar total length, keeping file order'''
+    bounds = np.cumsum(lengths)
+    total = bounds[-1] if len(bounds) else 0
+    groupids = (bounds - 1) * ngroups // max(total, 1)
+    groups = OrderedDict()
+    for name, length, groupid in zip(names, lengths, groupids):
+        groups.setdefault(int(groupid), list()).append((name, int(length)))
+    return(list(groups.values()))
+
+def bamMetric(assembly, alignment, processes=1, minmapq=0, maxinsert=100000):
+    '''Per contig coverage metrics and the insert size distribution of a sorted, indexed bam
+
+    Contigs are split into groups of similar total length and scanned through the
+    bam index in a process pool; depth is kept as an int32 array per contig.
+    '''
+    fasta_index = IndexedFasta(assembly)
+    names = list(fasta_index.names)
+    lengths = fasta_index.lengths.copy()
+    fasta_index.close()
+    samfile = pysam.AlignmentFile(alignment, 'rb')
+    if not samfile.has_index():
+        samfile.close()
+        raise ValueError('Alignment file is not indexed : {0}'.format(alignment))
+    samfile.close()
+    groups = contigGroups(names, lengths, processes * 4)
+    args = [(alignment, group, minmapq, maxinsert) for group in groups]
+    if processes > 1 and len(args) > 1:
+        pool = Pool(processes)
+        results = pool.map(coverageWorker, args, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        results = [coverageWorker(arg) for arg in args]
+    metrics = list()
+    inserts = np.zeros(maxinsert + 1, dtype=np.int64)
+    for group_metrics, group_inserts in results:
+        metrics.extend(group_metrics)
+        inserts += group_inserts
+    return(metrics, inserts)
+
+def writeBamMetric(metrics, inserts, prefix):
+    '''Write contig coverage and insert size tables'''
+    outfile = open('{0}_coverage.tsv'.format(prefix), 'w')
+    if metrics:
+        outfile.write('{0}\n'.format('\t'.join(metrics[0].keys())))
+    for contig in metrics:
+        values = ['{0:.4f}'.format(value) if isinstance(value, float) else str(value)
+            for value in contig.values()]
+        outfile.write('{0}\n'.format('\t'.join(values)))
+    outfile.close()
+    outfile = open('{0}_inserts.tsv'.format(prefix), 'w')
+    outfile.write('InsertSize\tPairs\n')
+    for insert in np.flatnonzero(inserts):
+        outfile.write('{0}\t{1}\n'.format(insert, inserts[insert]))
+    outfile.close()
+    return
+
+def windowSignals(samfile, contig, length, window=1000, minmapq=20, minclip=20):
+    '''Per window mean depth and discordant, chimeric and clipped read counts for one contig'''
+    nwindows = max(1, -(-length // window))
+    diff = np.zeros(length + 1, dtype=np.int32)
+    starts = array.array('i')
+    ends = array.array('i')
+    discordant = array.array('i')
+    chimeric = array.array('i')
+    clipped = array.array('i')
+    for read in samfile.fetch(contig):
+        if read.flag & SKIP_FLAGS or read.mapping_quality < minmapq:
+            continue
+        for start, end in read.get_blocks():
+            starts.append(start)
+            ends.append(end)
+        if len(starts) >= FLUSH_BLOCKS:
+            starts, ends = foldBlocks(diff, starts, ends)
+        if read.is_paired and not read.mate_is_unmapped and not read.is_proper_pair:
+            if read.next_reference_id != read.reference_id:
+                chimeric.append(read.reference_start)
+            else:
+                discordant.append(read.reference_start)
+        #Clipped reads are counted where the clip meets the reference
+        cigar = read.cigartuples
+        if cigar[0][0] == 4 and cigar[0][1] >= minclip:
+            clipped.append(read.reference_start)
+        if cigar[-1][0] == 4 and cigar[-1][1] >= minclip:
+            clipped.append(min(read.reference_end, length - 1))
+    foldBlocks(diff, starts, ends)
+    depth = np.cumsum(diff[:-1], dtype=np.int32)
+    bounds = np.arange(0, length, window)
+    signals = OrderedDict()
+    signals['depth'] = np.add.reduceat(depth, bounds, dtype=np.int64) / np.diff(np.append(bounds, length)).astype(np.float64)
+    for name, positions in (('discordant', discordant), ('chimeric', chimeric),
+        ('clipped', clipped)):
+        positions = np.frombuffer(positions, dtype=np.int32) // window
+        signals[name] = np.bincount(positions, minlength=nwindows)[:nwindows]
+    return(signals)
+
+def flagWindows(signals, lowdepth=0.2, pairfrac=0.2, clipfrac=0.2, minreads=5):
+    '''Return a boolean array for each misassembly signal over the windows of a contig'''
+    depth = signals['depth']
+    flags = OrderedDict()
+    #Contig ends lose coverage from reads hanging off the edge; judge them only on pairs and clips
+    inner = np.zeros(len(depth), dtype=bool)
+    inner[1:-1] = True
+    median = np.median(depth[inner]) if inner.any() else 0.0
+    flags['low_coverage'] = inner & (depth < lowdepth * median)
+    #Breakpoints are point events, so pair and clip counts are compared with the local depth
+    badpairs = signals['discordant'] + signals['chimeric']
+    flags['discordant_pairs'] = (badpairs >= minreads) & (badpairs > pairfrac * depth)
+    flags['clipped_reads'] = (signals['clipped'] >= minreads) & (signals['clipped'] > clipfrac * depth)
+    return(flags)
+
+def windowRegions(contig, flags, length, window):
+    '''Merge adjacent flagged windows into (contig, start, end, signals, windows) regions'''
+    names = list(flags.keys())
+    matrix = np.vstack([flags[name] for name in names])
+    flagged = matrix.any(axis=0)
+    edges = np.diff(np.concatenate(([0], flagged.astype(np.int8), [0])))
+    regions = list()
+    for first, last in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)):
+        support = [name for row, name in zip(matrix[:, first:last], names) if row.any()]
+        regions.append((contig, int(first * window), int(min(last * window, length)),
+            ','.join(support), int(last - first)))
+    return(regions)
+
+def breakpointWorker(args):
+    '''Scan a group of contigs for misassembly signals in a worker process'''
+    alignment, contigs, window, minmapq, thresholds = args
+    samfile = pysam.AlignmentFile(alignment, 'rb')
+    regions = list()
+    for contig, length in contigs:
+        if length == 0:
+            continue
+        signals = windowSignals(samfile, contig, length, window, minmapq)
+        regions.extend(windowRegions(contig, flagWindows(signals, **thresholds), length, window))
+    samfile.close()
+    return(regions)
+
+def findBreakpoints(assembly, alignment, bedfile, processes=1, window=1000, minmapq=20,
+    lowdepth=0.2, pairfrac=0.2, clipfrac=0.2, minreads=5):
+    '''Write suspect misassembly regions of a sorted, indexed bam to a bed file
+
+    Windows are flagged for collapsed coverage relative to the contig median,
+    excess discordant or chimeric pairs, or pileups of soft clipped reads;
+    adjacent flagged windows are merged into one region. Memory is bounded by
+    the longest contig. Returns a summary with the per assembly score, the
+    number of suspect regions per megabase of assembly.
+    '''
+    fasta_index = IndexedFasta(assembly)
+    names = list(fasta_index.names)
+    lengths = fasta_index.lengths.copy()
+    fasta_index.close()
+    thresholds = {'lowdepth' : lowdepth, 'pairfrac' : pairfrac, 'clipfrac' : clipfrac,
+        'minreads' : minreads}
+    args = [(alignment, group, window, minmapq, thresholds)
+        for group in contigGroups(names, lengths, processes * 4)]
+    if processes > 1 and len(args) > 1:
+        pool = Pool(processes)
+        results = pool.map(breakpointWorker, args, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        results = [breakpointWorker(arg) for arg in args]
+    bedhandle = open(bedfile, 'w')
+    summary = OrderedDict([('Regions', 0), ('FlaggedBases', 0), ('ContigsFlagged', 0)])
+    flaggedcontigs = set()
+    for regions in results:
+        for contig, start, end, support, windows in regions:
+            bedhandle.write('{0}\t{1}\t{2}\t{3}\t{4}\n'.format(contig, start, end, support, windows))
+            summary['Regions'] += 1
+            summary['FlaggedBases'] += end - start
+            flaggedcontigs.add(contig)
+    bedhandle.close()
+    summary['ContigsFlagged'] = len(flaggedcontigs)
+    total = float(lengths.sum())
+    summary['MisassemblyScore'] = summary['Regions'] * 1000000 / total if total else 0.0
+    return(summary)
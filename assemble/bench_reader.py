@@ -0,0 +1,48 @@
+#! /usr/local/bin/python3.4
+import os
+import sys
+import timeit
+import argparse
+from assemble.readers import Fastq
+
+def legacyRead(fastq):
+    '''Line by line generator the block reader replaced, kept as a baseline'''
+    phreddict = dict()
+    for asciis, quals in zip(range(33,126), range(0,92)):
+        phreddict[asciis] = quals
+    fqhandle = open(fastq, 'r')
+    while True:
+        try:
+            header = next(fqhandle).strip()
+            seq = [base for base in next(fqhandle).strip()]
+            sheader = next(fqhandle).strip()
+            quals = [phreddict[int(ord(qual))] for qual in next(fqhandle).strip()]
+            yield(header, sheader, seq, quals)
+        except StopIteration:
+            break
+    fqhandle.close()
+    return
+
+def benchmark(name, generator, size):
+    '''Drain generator and report reads/s and MB/s'''
+    start = timeit.default_timer()
+    nreads = 0
+    for records in generator:
+        nreads += len(records) if name.endswith('batches') else 1
+    elapsed = timeit.default_timer() - start
+    print('{0:<16}{1:>12}{2:>10.2f}{3:>14.0f}{4:>10.2f}'.format(name, nreads,
+        elapsed, nreads/elapsed, size/elapsed/1048576))
+    return
+
+if __name__ == '__main__':
+    bench = argparse.ArgumentParser(prog='bench_reader')
+    bench.add_argument('-f', '--fastq', type=str, dest='fastq',
+        help='Fastq file to parse', default='fq/test_reader.fastq')
+    opts = bench.parse_args()
+    size = os.path.getsize(opts.fastq)
+    print('{0:<16}{1:>12}{2:>10}{3:>14}{4:>10}'.format('Reader', 'Reads', 'Seconds', 'Reads/s', 'MB/s'))
+    benchmark('legacy', legacyRead(opts.fastq), size)
+    benchmark('compat', Fastq(opts.fastq, './', 'phred33', compat=True).read(), size)
+    benchmark('records', Fastq(opts.fastq, './', 'phred33').read(), size)
+    benchmark('unmasked records', Fastq(opts.fastq, './', 'phred33', mask=0).read(), size)
+    benchmark('batches', Fastq(opts.fastq, './', 'phred33').batches(), size)
@@ -0,0 +1,69 @@
+#! /usr/local/bin/python3.4
+import os
+import sys
+import timeit
+import argparse
+import tempfile
+import subprocess
+from assemble.trimmer import Trimmer
+
+def countPairs(fastq):
+    '''Return the number of records in an uncompressed fastq file'''
+    lines = 0
+    fqhandle = open(fastq, 'rb')
+    for chunk in iter(lambda: fqhandle.read(4194304), b''):
+        lines += chunk.count(b'\n')
+    fqhandle.close()
+    return(lines // 4)
+
+def report(name, pairs, kept, elapsed):
+    print('{0:<20}{1:>12}{2:>12}{3:>10.2f}{4:>14.0f}'.format(name, pairs, kept, elapsed, pairs/elapsed))
+    return
+
+def bbduk(bbduk_path, read1, read2, adapters, outdir, threads):
+    '''Run BBDuk with the settings of Cleaner.trimIllumina'''
+    out1 = '{0}/bbduk_r1.fastq'.format(outdir)
+    out2 = '{0}/bbduk_r2.fastq'.format(outdir)
+    tcmd = [bbduk_path, 'ref={0}'.format(','.join(adapters)), 'in1={0}'.format(read1),
+            'in2={0}'.format(read2), 'out1={0}'.format(out1), 'out2={0}'.format(out2),
+            'ktrim=r', 'ktrim=1', 'k=27', 'mink=11', 'qtrim=rl', 'trimq=30', 'minlength=80',
+            'threads={0}'.format(threads)]
+    start = timeit.default_timer()
+    try:
+        trun = subprocess.run(tcmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError:
+        print('{0:<20}not found : {1}'.format('bbduk', bbduk_path))
+        return
+    elapsed = timeit.default_timer() - start
+    if trun.returncode != 0:
+        print('{0:<20}failed with exit code {1}'.format('bbduk', trun.returncode))
+        return
+    report('bbduk', countPairs(read1), countPairs(out1), elapsed)
+    return
+
+if __name__ == '__main__':
+    bench = argparse.ArgumentParser(prog='bench_trimmer')
+    bench.add_argument('-f', '--read1', type=str, dest='read1',
+        help='Read 1 fastq file', default='fq/test_r1.fastq')
+    bench.add_argument('-r', '--read2', type=str, dest='read2',
+        help='Read 2 fastq file', default='fq/test_r2.fastq')
+    bench.add_argument('-a', '--adapters', type=str, dest='adapters', nargs='+',
+        help='Adapter fasta files', default=['fq/adapters.fa'])
+    bench.add_argument('-t', '--threads', type=int, dest='threads', default=4,
+        help='Threads for BBDuk and the most worker processes for the native trimmer')
+    bench.add_argument('--bbduk', type=str, dest='bbduk_path', default='bbduk',
+        help='Path to bbduk')
+    opts = bench.parse_args()
+    outdir = tempfile.mkdtemp(prefix='bench_trimmer_')
+    print('{0:<20}{1:>12}{2:>12}{3:>10}{4:>14}'.format('Trimmer', 'Pairs', 'Kept', 'Seconds', 'Pairs/s'))
+    bbduk(opts.bbduk_path, opts.read1, opts.read2, opts.adapters, outdir, opts.threads)
+    processes = 1
+    while processes <= opts.threads:
+        trimmer = Trimmer(opts.adapters, processes=processes)
+        metrics = trimmer.trim(opts.read1, opts.read2, '{0}/native_r1.fastq'.format(outdir),
+            '{0}/native_r2.fastq'.format(outdir), outdir)
+        report('native x{0}'.format(processes), metrics['Pairs'], metrics['PairsKept'], metrics['Runtime'])
+        processes *= 2
+    for outfile in os.listdir(outdir):
+        os.remove('{0}/{1}'.format(outdir, outfile))
+    os.rmdir(outdir)
@@ -16,9 +16,10 @@ from Bio import SeqIO
 from itertools import repeat
 from multiprocessing import Pool
 from collections import defaultdict
+from assemble.runner import runCommand
 
 class Canu:
-    def __init__(self, canu_path,  pacbio, outdir, threads, egs, depth, name):
+    def __init__(self, canu_path,  pacbio, outdir, threads, egs, depth, name, memory=10):
         #Initialize values and create output directories
         self.canu_path = canu_path
         self.name = name
@@ -27,10 +28,11 @@ class Canu:
         self.threads = threads
         self.log = '{0}/canu.log'.format(self.outdir)
         self.runtime = '{0}/canu_runtime.log'.format(self.outdir)
+        self.metrics = '{0}/stage_metrics.jsonl'.format(os.path.abspath(outdir))
         self.result = '{0}/{1}.contigs.fasta'.format(self.outdir, self.name)
         self.spec = '{0}/{1}.specs'.format(self.outdir, self.name)
         self.egs = egs
-        self.threads = threads
+        self.memory = memory
         if not os.path.exists(self.outdir):
             os.mkdir(self.outdir)
 
@@ -55,15 +57,15 @@ class Canu:
         useGrid=false
         unitigger=bogart
         merylThreads={1}
-        merylMemory=10
+        merylMemory={2}
         maxThreads={1}
-        maxMemory=10
+        maxMemory={2}
         obtOverlapper=mhap
         obtReAlign=true
         obtMhapSensitivity=high
         utgOverlapper=mhap
         utgReAlign=true
-        utgMhapSensitivity=high'''.format(self.egs, self.threads))
+        utgMhapSensitivity=high'''.format(self.egs, self.threads, self.memory))
         ashandle.close()
         logger.close()
 
@@ -81,14 +83,11 @@ class Canu:
         ccmd = [self.canu_path, '-d', self.outdir, '-p', self.name, '-s', 
                 self.spec, '-pacbio-raw', self.pacbio]
         logger.write('Running Canu with the following command\n')
-        logger.write('{0}\n'.format(' '.join(scmd)))
+        logger.write('{0}\n'.format(' '.join(ccmd)))
 
 
         #Running Canu
-        crun = subprocess.Popen(ccmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-        #Capture stdout and stderr
-        clog = crun.communicate()
+        crun = runCommand(ccmd, 'canu', runlogger, self.metrics)
         elapsed = timeit.default_timer() - start
         runlogger.flush()
         runlogger.close()
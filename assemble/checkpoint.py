@@ -0,0 +1,104 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+import subprocess
+
+#Versions found this run, by tool and version arguments, shared by every checkpoint store
+TOOL_VERSIONS = dict()
+VERSION_LOCK = threading.Lock()
+#Seconds to wait for a tool to print its version
+VERSION_TIMEOUT = 10
+
+
+def fileSignature(path, content=False):
+    '''Return a signature of a file from its size and mtime, or its sha256 if content is set'''
+    if not os.path.exists(path):
+        return('missing')
+    if os.path.isdir(path):
+        return('directory')
+    if content:
+        digest = hashlib.sha256()
+        handle = open(path, 'rb')
+        for chunk in iter(lambda: handle.read(4194304), b''):
+            digest.update(chunk)
+        handle.close()
+        return(digest.hexdigest())
+    stat = os.stat(path)
+    return('{0}:{1}'.format(stat.st_size, stat.st_mtime_ns))
+
+def toolVersion(tool, args=('--version',)):
+    '''Return the first line a tool prints for args, or unknown; with args None, the executable signature'''
+    if args is None:
+        #Tools without a safe version flag are never run; a changed executable changes the signature
+        return('executable {0}'.format(fileSignature(shutil.which(tool) or tool)))
+    try:
+        vrun = subprocess.run([tool] + list(args), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL, timeout=VERSION_TIMEOUT)
+    except (OSError, subprocess.SubprocessError):
+        return('unknown')
+    lines = vrun.stdout.decode(errors='replace').strip().splitlines()
+    return(lines[0] if lines else 'unknown')
+
+
+class Checkpoint:
+    '''Record of completed stages kept as json next to the pipeline output.
+
+    A stage is keyed by a hash of its input file signatures, parameters,
+    tool versions and the keys of the stages it depends on, so changing
+    anything upstream invalidates everything downstream. The record is
+    replaced atomically and only after a stage succeeds, so outputs of an
+    interrupted stage are never taken as complete.
+    '''
+
+    def __init__(self, path, content=False):
+        self.path = path
+        self.content = content
+        self.lock = threading.Lock()
+        self.stages = dict()
+        if os.path.exists(path):
+            try:
+                self.stages = json.load(open(path))
+            except ValueError:
+                logging.warning('Ignoring unreadable checkpoint file : {0}'.format(path))
+        return
+
+    def version(self, tool):
+        '''Return the version of a tool given as a path or (path, version arguments), once per run'''
+        path, args = (tool, ('--version',)) if isinstance(tool, str) else tool
+        spec = (path, None if args is None else tuple(args))
+        with VERSION_LOCK:
+            if spec not in TOOL_VERSIONS:
+                TOOL_VERSIONS[spec] = toolVersion(path, args)
+            return(TOOL_VERSIONS[spec])
+
+    def key(self, name, inputs=(), params=None, tools=(), upstream=()):
+        '''Return the hash identifying a run of a stage'''
+        state = {'name' : name, 'params' : params, 'upstream' : list(upstream),
+            'inputs' : [[path, fileSignature(path, self.content)] for path in inputs],
+            'tools' : [[tool, self.version(tool)] for tool in tools]}
+        return(hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest())
+
+    def done(self, name, key, outputs=()):
+        '''Return True if the stage completed with this key and its outputs are still present'''
+        record = self.stages.get(name)
+        if record is None or record['key'] != key:
+            return(False)
+        for path, signature in record['outputs']:
+            if fileSignature(path) != signature:
+                return(False)
+        return(all([os.path.exists(path) for path in outputs]))
+
+    def record(self, name, key, outputs=()):
+        '''Mark a stage complete and write the checkpoint file atomically'''
+        with self.lock:
+            self.stages[name] = {'key' : key,
+                'outputs' : [[path, fileSignature(path)] for path in outputs]}
+            tmppath = '{0}.{1}.tmp'.format(self.path, os.getpid())
+            handle = open(tmppath, 'w')
+            json.dump(self.stages, handle, indent=1, sort_keys=True)
+            handle.close()
+            os.replace(tmppath, self.path)
+        return
@@ -4,9 +4,11 @@ import csv
 import sys
 import Bio
 import glob
+import shutil
 import time
 import timeit
 import logging
+import tempfile
 import argparse
 import itertools
 import subprocess
@@ -16,9 +18,15 @@ from Bio import SeqIO
 from itertools import repeat
 from multiprocessing import Pool
 from collections import defaultdict
+from assemble.runner import runCommand, startCommand, waitCommand, hasExited, seriesPath
+from assemble.streams import InputPipe
+from assemble.trimmer import Trimmer
+from assemble.screen import KmerScreen
+from assemble.indexcache import IndexCache
 
 class Cleaner:
-    def __init__(self, bowtie_path, bbduk_path, sam_path, read1, read2, reference, adapters, outdir, threads):
+    def __init__(self, bowtie_path, bbduk_path, sam_path, read1, read2, reference, adapters, outdir, threads, memory=None,
+        indexcache=None):
         #Initialize values 
         self.bowtie_path = bowtie_path
         self.bbduk_path = bbduk_path
@@ -28,15 +36,22 @@ class Cleaner:
         self.reference = os.path.abspath(reference)
         self.adapters = ','.join([os.path.abspath(vals) for vals in adapters])
         self.threads = threads
+        self.memory = memory
         self.outdir = '{0}/cleaned_fastq'.format(os.path.abspath(outdir))
         self.cillumina = '{0}/cleaned.fastq'.format(self.outdir)
+        self.cread = '{0}/cleaned'.format(self.outdir)
         self.cread1 = '{0}/cleaned.1.fastq'.format(self.outdir)
         self.cread2 = '{0}/cleaned.2.fastq'.format(self.outdir)
         self.tread1 = '{0}/cleaned_trimmed_r1.fastq'.format(self.outdir)
         self.tread2 = '{0}/cleaned_trimmed_r2.fastq'.format(self.outdir)
         self.btindex  = os.path.splitext(reference)[0]
+        if indexcache is None:
+            indexcache = IndexCache('{0}/index_cache'.format(os.path.abspath(outdir)))
+        self.indexcache = indexcache
+        self.conbam = '{0}/contaminants.bam'.format(self.outdir)
         self.log = '{0}/cleaner.log'.format(self.outdir)
         self.runtime = '{0}/cleaner_runtime.log'.format(self.outdir)
+        self.metrics = '{0}/stage_metrics.jsonl'.format(os.path.abspath(outdir))
         
         #Create output directory
         if not os.path.exists(self.outdir):
@@ -44,37 +59,22 @@ class Cleaner:
         return
         
     def buildIndex(self):
-        '''Build bowtie index if it doesnt exist'''
+        '''Build bowtie index of the contaminant reference, or reuse it from the index cache'''
         #Start logging
         start = timeit.default_timer()
         runlogger = open(self.runtime, 'a')
         logger = open(self.log, 'a')
-        
-        #Check for index
-        logger.write('Checking for index\n')
-        conindex = glob.glob('{0}*bt2'.format(self.conindex))
-        print(conindex)
-        if conindex:
-            logger.write('Bowtie index exists : {0}; Skipping step;\n'.format(self.conindex))
-            logger.close()
-            runlogger.close()
-            return(0)
-        
-        #Prepare run command
-        logger.write('Creating bowtie index\n')
-        #Setup bowtie index command
-        bicmd = ['{0}-build'.format(self.bowtie_path ), self.confile, self.conindex]
-        logger.write('Running bowtie index with the following command\n')
-        logger.write('{0}\n'.format(' '.join(bicmd)))
-    
-        #Running bowtie build
-        birun = subprocess.Popen(bicmd, stdout=runlogger, stderr=runlogger)
-        
-        #Capture stdout and stderr
-        bilog = birun.communicate()
+
+        #Check the cache for an index of the same reference contents
+        logger.write('Checking for index in : {0}\n'.format(self.indexcache.cachedir))
+        self.btindex, birun = self.indexcache.index(self.reference, self.bowtie_path, runlogger, self.metrics)
         elapsed = timeit.default_timer() - start
         runlogger.flush()
         runlogger.close()
+        if birun is None:
+            logger.write('Bowtie index exists : {0}; Skipping step;\n'.format(self.btindex))
+            logger.close()
+            return(0)
 
         if birun.returncode != 0 :
             logger.write('Bowtie index failed with exit code : {0}; Check runtime log for details.\n'.format(birun.returncode))
@@ -82,11 +82,11 @@ class Cleaner:
             return(birun.returncode)
         else:
             logger.write('Bowtie index completed successfully; Runtime : {0}\n'.format(elapsed))
-            logger.write('Reference index can be found at : {0}.*.bt2\n'.format(self.conindex))
+            logger.write('Reference index can be found at : {0}.*.bt2\n'.format(self.btindex))
             logger.close()
             return(birun.returncode)
-        
-        
+
+
     def deconIllumina(self):
         '''Remove contaminants from illumina reads'''
         #Start logging
@@ -96,19 +96,20 @@ class Cleaner:
 
         #Prepare run commands
         logger.write('Decontamination  of illumina reads  started\n')
+        #Stream compressed reads through named pipes
+        pipe1 = InputPipe(self.read1, self.outdir, self.threads)
+        pipe2 = InputPipe(self.read2, self.outdir, self.threads)
         #Setup bowtie command
-        bcmd = [self.bowtie_path, '-p', '4', '-x', self.conindex, '-1', self.read1, '-2', self.read2,
+        bcmd = [self.bowtie_path, '-p', str(self.threads), '-x', self.btindex, '-1', pipe1.path, '-2', pipe2.path,
                 '--un-conc', self.cillumina, '--local', '-S', '{0}.sam'.format(self.cread)]
         logger.write('Running Bowtie with the following command\n')
         logger.write('{0}\n'.format(' '.join(bcmd)))
 
 
         #Running bowtie
-        brun = subprocess.Popen(bcmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-        
-        #Capture stdout and stderr
-        blog = brun.communicate()
+        brun = runCommand(bcmd, 'bowtie2', runlogger, self.metrics)
+        pipe1.close()
+        pipe2.close()
         elapsed = timeit.default_timer() - start
         runlogger.flush()
         runlogger.close()
@@ -124,6 +125,180 @@ class Cleaner:
             logger.close()
             return(brun.returncode)
 
+    def deconTrim(self, keepbam=False, trimmer='bbduk'):
+        '''Remove contaminants and trim illumina reads, streaming cleaned pairs into BBDuk
+
+        With the native trimmer, bowtie writes cleaned pairs to files that
+        are trimmed in process once it finishes.
+        '''
+        #Start logging
+        start = timeit.default_timer()
+        runlogger = open(self.runtime, 'a')
+        logger = open(self.log, 'a')
+        native = trimmer == 'native'
+
+        #Prepare run commands
+        logger.write('Decontamination and trimming of illumina reads started\n')
+        pipe1 = InputPipe(self.read1, self.outdir, self.threads)
+        pipe2 = InputPipe(self.read2, self.outdir, self.threads)
+        if native:
+            pipedir = self.outdir
+        else:
+            #Bowtie writes concordantly unaligned pairs into fifos that BBDuk reads
+            pipedir = tempfile.mkdtemp(prefix='decon_', dir=self.outdir)
+        cread1 = '{0}/cleaned.1.fastq'.format(pipedir)
+        cread2 = '{0}/cleaned.2.fastq'.format(pipedir)
+        if not native:
+            os.mkfifo(cread1)
+            os.mkfifo(cread2)
+        bcmd = [self.bowtie_path, '-p', str(self.threads), '-x', self.btindex, '-1', pipe1.path, '-2', pipe2.path,
+                '--un-conc', '{0}/cleaned.%.fastq'.format(pipedir), '--local']
+        if keepbam:
+            #Keep only contaminant hits, as a compact bam
+            bcmd += ['--no-unal']
+            vcmd = [self.sam_path, 'view', '-b', '-F', '4', '-o', self.conbam, '-']
+        else:
+            bcmd += ['-S', os.devnull]
+        tcmd = [self.bbduk_path, 'ref={0}'.format(self.adapters), 'in1={0}'.format(cread1),
+                'in2={0}'.format(cread2), 'out1={0}'.format(self.tread1),
+                'out2={0}'.format(self.tread2), 'ktrim=r', 'ktrim=1', 'k=27', 'mink=11', 'qtrim=rl',
+                'trimq=30', 'minlength=80', 'threads={0}'.format(self.threads)]
+        if self.memory:
+            tcmd.insert(1, '-Xmx{0}g'.format(self.memory))
+        logger.write('Running Bowtie and {0} with the following commands\n'.format(
+            'the native trimmer' if native else 'BBDuk'))
+        if keepbam:
+            logger.write('{0} | {1}\n'.format(' '.join(bcmd), ' '.join(vcmd)))
+        else:
+            logger.write('{0}\n'.format(' '.join(bcmd)))
+        if not native:
+            logger.write('{0}\n'.format(' '.join(tcmd)))
+
+        #Run all stages together
+        runs = list()
+        if keepbam:
+            brun = startCommand(bcmd, stdout=subprocess.PIPE, stderr=runlogger, stage='bowtie2',
+                series=seriesPath(self.metrics, 'bowtie2', bcmd))
+            runs.append(('samtools view', startCommand(vcmd, stdin=brun.stdout, stdout=runlogger, stderr=runlogger,
+                stage='samtools view', series=seriesPath(self.metrics, 'samtools view', vcmd))))
+            brun.stdout.close()
+        else:
+            brun = startCommand(bcmd, stdout=runlogger, stderr=runlogger, stage='bowtie2',
+                series=seriesPath(self.metrics, 'bowtie2', bcmd))
+        runs.append(('bowtie2', brun))
+        if not native:
+            runs.append(('bbduk', startCommand(tcmd, stdout=runlogger, stderr=runlogger, stage='bbduk',
+                series=seriesPath(self.metrics, 'bbduk', tcmd))))
+        #A stage failing before it opens its fifo would block the others; stop them all
+        pending = list(runs)
+        while pending:
+            for stage, run in list(pending):
+                if hasExited(run):
+                    pending.remove((stage, run))
+                    if waitCommand(run, stage, self.metrics).returncode != 0:
+                        for other, process in pending:
+                            process.kill()
+            time.sleep(0.5)
+        runs = [run for stage, run in runs]
+        pipe1.close()
+        pipe2.close()
+        if not native:
+            shutil.rmtree(pipedir, ignore_errors=True)
+        elapsed = timeit.default_timer() - start
+        runlogger.flush()
+        runlogger.close()
+
+        returncode = [run.returncode for run in runs if run.returncode != 0]
+        if returncode:
+            logger.write('Decontamination failed with exit codes : {0}; Check runtime log for details.\n'.format(
+                ', '.join([str(run.returncode) for run in runs])))
+            logger.close()
+            return(returncode[0])
+        if native:
+            logger.write('Decontamination completed successfully; Runtime : {0}\n'.format(elapsed))
+            logger.close()
+            tret = self.trimNative()
+            os.remove(cread1)
+            os.remove(cread2)
+            return(tret)
+        logger.write('Decontamination and trimming completed successfully; Runtime : {0}\n'.format(elapsed))
+        logger.write('Decontaminated reads can be found in : {0}\n'.format(self.outdir))
+        if keepbam:
+            logger.write('Contaminant alignments can be found at : {0}\n'.format(self.conbam))
+        logger.close()
+        return(0)
+
+    def deconScreen(self, keepbam=False, minhits=1):
+        '''Remove contaminants from illumina reads, aligning only pairs that share k-mers with the reference
+
+        Pairs sharing fewer than minhits k-mers with the reference are
+        written straight to the cleaned reads, and candidate pairs that
+        bowtie does not align are appended.
+        '''
+        #Start logging
+        start = timeit.default_timer()
+        runlogger = open(self.runtime, 'a')
+        logger = open(self.log, 'a')
+        logger.write('Screening illumina reads for contaminant k-mers\n')
+        pipedir = tempfile.mkdtemp(prefix='screen_', dir=self.outdir)
+        candidate1 = '{0}/candidate.1.fastq'.format(pipedir)
+        candidate2 = '{0}/candidate.2.fastq'.format(pipedir)
+        try:
+            screen = KmerScreen(self.reference, self.indexcache, minhits=minhits, processes=self.threads)
+            metrics = screen.screen(self.read1, self.read2, self.cread1, self.cread2, candidate1, candidate2,
+                pipedir, self.threads)
+        except (OSError, ValueError) as error:
+            logger.write('K-mer screen failed : {0}\n'.format(error))
+            logger.close()
+            runlogger.close()
+            shutil.rmtree(pipedir, ignore_errors=True)
+            return(1)
+        for metric, value in metrics.items():
+            logger.write('{0} : {1}\n'.format(metric, value))
+
+        runs = list()
+        if metrics['CandidatePairs'] > 0:
+            #Setup bowtie command for candidate pairs only
+            bcmd = [self.bowtie_path, '-p', str(self.threads), '-x', self.btindex, '-1', candidate1,
+                    '-2', candidate2, '--un-conc', '{0}/cleaned.%.fastq'.format(pipedir), '--local']
+            logger.write('Running Bowtie on candidate pairs with the following command\n')
+            if keepbam:
+                bcmd += ['--no-unal']
+                vcmd = [self.sam_path, 'view', '-b', '-F', '4', '-o', self.conbam, '-']
+                logger.write('{0} | {1}\n'.format(' '.join(bcmd), ' '.join(vcmd)))
+                brun = startCommand(bcmd, stdout=subprocess.PIPE, stderr=runlogger, stage='bowtie2',
+                    series=seriesPath(self.metrics, 'bowtie2', bcmd))
+                vrun = startCommand(vcmd, stdin=brun.stdout, stdout=runlogger, stderr=runlogger,
+                    stage='samtools view', series=seriesPath(self.metrics, 'samtools view', vcmd))
+                brun.stdout.close()
+                runs = [waitCommand(brun, 'bowtie2', self.metrics), waitCommand(vrun, 'samtools view', self.metrics)]
+            else:
+                bcmd += ['-S', os.devnull]
+                logger.write('{0}\n'.format(' '.join(bcmd)))
+                runs = [runCommand(bcmd, 'bowtie2', runlogger, self.metrics)]
+            if all([run.returncode == 0 for run in runs]):
+                for cleaned, cread in ((1, self.cread1), (2, self.cread2)):
+                    chandle = open(cread, 'ab')
+                    uhandle = open('{0}/cleaned.{1}.fastq'.format(pipedir, cleaned), 'rb')
+                    shutil.copyfileobj(uhandle, chandle, 4194304)
+                    uhandle.close()
+                    chandle.close()
+        shutil.rmtree(pipedir, ignore_errors=True)
+        elapsed = timeit.default_timer() - start
+        runlogger.flush()
+        runlogger.close()
+
+        returncode = [run.returncode for run in runs if run.returncode != 0]
+        if returncode:
+            logger.write('Decontamination failed with exit codes : {0}; Check runtime log for details.\n'.format(
+                ', '.join([str(run.returncode) for run in runs])))
+            logger.close()
+            return(returncode[0])
+        logger.write('Decontamination completed successfully; Runtime : {0}\n'.format(elapsed))
+        logger.write('Decontaminated reads can be found in : {0}\n'.format(self.outdir))
+        logger.close()
+        return(0)
+
     def trimIllumina(self):
         '''Trim adapters from illumina reads'''
         #Start logging
@@ -137,16 +312,14 @@ class Cleaner:
         tcmd = [self.bbduk_path, 'ref={0}'.format(self.adapters), 'in1={0}'.format(self.cread1), 
                 'in2={0}'.format(self.cread2), 'out1={0}'.format(self.tread1), 
                 'out2={0}'.format(self.tread2), 'ktrim=r', 'ktrim=1', 'k=27', 'mink=11', 'qtrim=rl',
-                'trimq=30', 'minlength=80']
+                'trimq=30', 'minlength=80', 'threads={0}'.format(self.threads)]
+        if self.memory:
+            tcmd.insert(1, '-Xmx{0}g'.format(self.memory))
         logger.write('Running BBDuk with the following command:\n')
         logger.write('{0}\n'.format(' '.join(tcmd)))
 
         #Runnig BBDuk
-        trun = subprocess.Popen(tcmd, stdout=runlogger,
-                stderr=runlogger, shell=False)
-
-        #Capture the stdout and stderr
-        tlog = trun.communicate()
+        trun = runCommand(tcmd, 'bbduk', runlogger, self.metrics)
         elapsed = timeit.default_timer() - start
         runlogger.flush()
         runlogger.close()
@@ -163,6 +336,34 @@ class Cleaner:
             return(trun.returncode)
 
  
+    def trimNative(self):
+        '''Trim adapters and low quality ends from illumina reads in process, with BBDuk's settings'''
+        #Start logging
+        start = timeit.default_timer()
+        logger = open(self.log, 'a')
+        logger.write('Trimming illumina reads with the native trimmer\n')
+        try:
+            trimmer = Trimmer(self.adapters.split(','), processes=self.threads)
+            metrics = trimmer.trim(self.cread1, self.cread2, self.tread1, self.tread2, self.outdir, self.threads)
+        except (OSError, ValueError) as error:
+            logger.write('Native trimmer failed : {0}\n'.format(error))
+            logger.close()
+            return(1)
+        elapsed = timeit.default_timer() - start
+        for metric, value in metrics.items():
+            logger.write('{0} : {1}\n'.format(metric, value))
+        logger.write('Native trimmer completed successfully; Runtime : {0}\n'.format(elapsed))
+        logger.write('Trimmed reads can be found in : {0}\n'.format(self.outdir))
+        logger.close()
+        return(0)
+
+    def cleanReads(self):
+        '''Remove decontaminated reads once they are trimmed'''
+        for cread in (self.cread1, self.cread2):
+            if os.path.exists(cread):
+                os.remove(cread)
+        return
+
     def cleanSam(self):
         '''Remove sam file'''
         os.remove('{0}.sam'.format(self.cread))
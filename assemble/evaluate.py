@@ -16,9 +16,14 @@ from Bio import SeqIO
 from itertools import repeat
 from multiprocessing import Pool
 from collections import defaultdict
+from assemble.runner import runCommand, startCommand, waitCommand, seriesPath
+from assemble.streams import InputPipe
+from assemble.indexcache import IndexCache
+from assemble.alignments import bamMetric, writeBamMetric, findBreakpoints
 
 class Evaluate:
-    def __init__(self, bowtie_path, sam_path, jelly_path, read1, read2, pacbio, assembly, outdir, threads, name, xml):
+    def __init__(self, bowtie_path, sam_path, jelly_path, read1, read2, pacbio, assembly, outdir, threads, name, xml, memory=None,
+        indexcache=None):
         #Initialize values and create output directories
         self.bowtie_path = bowtie_path
         self.jelly_path = jelly_path
@@ -32,10 +37,15 @@ class Evaluate:
         self.name = name
         self.xml = xml
         self.assemblyindex = os.path.splitext(os.path.abspath(assembly))[0]
+        if indexcache is None:
+            indexcache = IndexCache('{0}/index_cache'.format(os.path.abspath(outdir)))
+        self.indexcache = indexcache
         self.outdir = '{0}/{1}'.format(os.path.abspath(outdir), name)
         self.threads = threads
+        self.memory = memory
         self.log = '{0}/evaluate.log'.format(self.outdir)
         self.runtime = '{0}/evaluate_runtime.log'.format(self.outdir)
+        self.metrics = '{0}/stage_metrics.jsonl'.format(os.path.abspath(outdir))
         self.uread1 = '{0}/unaligned_r1.fastq'.format(self.outdir)
         self.uread2 = '{0}/unaligned_r2.fastq'.format(self.outdir)
         self.uread = '{0}/{1}'.format(self.outdir, self.name)
@@ -44,37 +54,23 @@ class Evaluate:
         return
 
     def buildIndex(self):
-        '''Build bowtie index if it doesnt exist'''
+        '''Build bowtie index of the assembly, or reuse it from the index cache'''
         #Start logging
         start = timeit.default_timer()
         runlogger = open(self.runtime, 'a')
         logger = open(self.log, 'a')
-        
-        #Check for index
-        logger.write('Checking for index\n')
-        conindex = glob.glob('{0}*bt2'.format(self.assemblyindex))
-        print(conindex)
-        if conindex:
-            logger.write('Bowtie index exists : {0}; Skipping step;\n'.format(self.assemblyindex))
-            logger.close()
-            runlogger.close()
-            return(0)
-        
-        #Prepare run command
-        logger.write('Creating bowtie index\n')
-        #Setup bowtie index command
-        bicmd = ['{0}-build'.format(self.bowtie_path ), self.assembly, self.assemblyindex]
-        logger.write('Running bowtie index with the following command\n')
-        logger.write('{0}\n'.format(' '.join(bicmd)))
-    
-        #Running bowtie build
-        birun = subprocess.Popen(bicmd, stdout=runlogger, stderr=runlogger)
-        
-        #Capture stdout and stderr
-        bilog = birun.communicate()
+
+        #Check the cache for an index of the same assembly contents
+        logger.write('Checking for index in : {0}\n'.format(self.indexcache.cachedir))
+        self.assemblyindex, birun = self.indexcache.index(os.path.abspath(self.assembly), self.bowtie_path,
+            runlogger, self.metrics)
         elapsed = timeit.default_timer() - start
         runlogger.flush()
         runlogger.close()
+        if birun is None:
+            logger.write('Bowtie index exists : {0}; Skipping step;\n'.format(self.assemblyindex))
+            logger.close()
+            return(0)
 
         if birun.returncode != 0 :
             logger.write('Bowtie index failed with exit code : {0}; Check runtime log for details.\n'.format(birun.returncode))
@@ -82,7 +78,7 @@ class Evaluate:
             return(birun.returncode)
         else:
             logger.write('Bowtie index completed successfully; Runtime : {0}\n'.format(elapsed))
-            logger.write('Decontaminated reads can be found at : {0}.*.bt2\n'.format(self.assemblyindex))
+            logger.write('Assembly index can be found at : {0}.*.bt2\n'.format(self.assemblyindex))
             logger.close()
             return(birun.returncode)
         
@@ -96,19 +92,20 @@ class Evaluate:
 
         #Prepare run commands
         logger.write('Aligning illumina reads to assembly\n')
+        #Stream compressed reads through named pipes
+        pipe1 = InputPipe(self.read1, self.outdir, self.threads)
+        pipe2 = InputPipe(self.read2, self.outdir, self.threads)
         #Setup bowtie command
-        bcmd = [self.bowtie_path, '-p', '5','-x', self.assemblyindex, '-1', self.read1, '-2', self.read2,
+        bcmd = [self.bowtie_path, '-p', str(self.threads), '-x', self.assemblyindex, '-1', pipe1.path, '-2', pipe2.path,
                 '--un-conc-gz', self.uread, '--local', '-S', '{0}.sam'.format(self.uread)]
         logger.write('Running Bowtie with the following command\n')
         logger.write('{0}\n'.format(' '.join(bcmd)))
 
 
         #Running bowtie
-        brun = subprocess.Popen(bcmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-        
-        #Capture stdout and stderr
-        blog = brun.communicate()
+        brun = runCommand(bcmd, 'bowtie2', runlogger, self.metrics)
+        pipe1.close()
+        pipe2.close()
         elapsed = timeit.default_timer() - start
         runlogger.flush()
         runlogger.close()
@@ -124,6 +121,120 @@ class Evaluate:
             logger.close()
             return(brun.returncode)
 
+    def alignStream(self):
+        '''Align illumina reads and sort into an indexed bam, without writing sam'''
+        #Start logging
+        start = timeit.default_timer()
+        runlogger = open(self.runtime, 'a')
+        logger = open(self.log, 'a')
+        bam = '{0}.bam'.format(self.uread)
+
+        #Prepare run commands
+        logger.write('Aligning illumina reads to assembly and sorting through a pipe\n')
+        pipe1 = InputPipe(self.read1, self.outdir, self.threads)
+        pipe2 = InputPipe(self.read2, self.outdir, self.threads)
+        bcmd = [self.bowtie_path, '-p', str(self.threads), '-x', self.assemblyindex, '-1', pipe1.path,
+                '-2', pipe2.path, '--un-conc-gz', self.uread, '--local']
+        scmd = [self.sam_path, 'sort', '-@', str(self.threads), '-T', '{0}.sorttmp'.format(self.uread),
+                '-o', bam, '-']
+        if self.memory:
+            #samtools sort takes memory per thread
+            scmd[2:2] = ['-m', '{0}M'.format(max(100, int(self.memory) * 1024 // int(self.threads)))]
+        icmd = [self.sam_path, 'index', bam]
+        logger.write('Running Bowtie and Samtools sort with the following commands\n')
+        logger.write('{0} | {1}\n'.format(' '.join(bcmd), ' '.join(scmd)))
+
+        #Bowtie writes sam straight into samtools sort
+        brun = startCommand(bcmd, stdout=subprocess.PIPE, stderr=runlogger, stage='bowtie2',
+            series=seriesPath(self.metrics, 'bowtie2', bcmd))
+        srun = startCommand(scmd, stdin=brun.stdout, stdout=runlogger, stderr=runlogger, stage='samtools sort',
+            series=seriesPath(self.metrics, 'samtools sort', scmd))
+        #Only samtools holds the read end, so bowtie sees a broken pipe if sort fails
+        brun.stdout.close()
+        stages = [('bowtie2', waitCommand(brun, 'bowtie2', self.metrics))]
+        pipe1.close()
+        pipe2.close()
+        stages.append(('samtools sort', waitCommand(srun, 'samtools sort', self.metrics)))
+        if brun.returncode != 0 or srun.returncode != 0:
+            runlogger.close()
+            logger.write('Bowtie or samtools sort failed with exit codes : {0}, {1}; Check runtime log for details.\n'.format(
+                brun.returncode, srun.returncode))
+            logger.close()
+            return(brun.returncode or srun.returncode)
+
+        #Index the sorted bam
+        logger.write('Running Samtools index with the following command\n')
+        logger.write('{0}\n'.format(' '.join(icmd)))
+        irun = runCommand(icmd, 'samtools index', runlogger, self.metrics)
+        stages.append(('samtools index', irun))
+        runlogger.flush()
+        runlogger.close()
+
+        #Wall time of each stage, bytes it sent to storage, sort scratch included, and all bytes it
+        #wrote, the sam stream of bowtie included
+        logger.write('Stage\tWall(s)\tBytesWritten\tCharsWritten\n')
+        for stage, run in stages:
+            logger.write('{0}\t{1:.2f}\t{2}\t{3}\n'.format(stage, run.wall, run.writebytes, run.writechars))
+        if irun.returncode != 0:
+            logger.write('Samtools index failed with exit code : {0}; Check runtime log for details.\n'.format(irun.returncode))
+            logger.close()
+            return(irun.returncode)
+        logger.write('Alignment completed successfully; Runtime : {0}\n'.format(timeit.default_timer() - start))
+        logger.write('Indexed bam can be found in : {0}\n'.format(self.outdir))
+        logger.close()
+        return(irun.returncode)
+
+    def coverageMetrics(self):
+        '''Write per contig coverage, mapping and insert size tables of the sorted, indexed bam'''
+        #Start logging
+        start = timeit.default_timer()
+        logger = open(self.log, 'a')
+        bam = '{0}.bam'.format(self.uread)
+
+        #Scan the bam through its index, contig groups in a process pool
+        logger.write('Computing contig coverage and insert size metrics for : {0}\n'.format(bam))
+        try:
+            metrics, inserts = bamMetric(self.assembly, bam, int(self.threads))
+        except (OSError, ValueError) as error:
+            logger.write('Coverage metrics failed : {0}\n'.format(error))
+            logger.close()
+            return(1)
+        writeBamMetric(metrics, inserts, self.uread)
+        elapsed = timeit.default_timer() - start
+        logger.write('Coverage metrics completed successfully; Runtime : {0}\n'.format(elapsed))
+        logger.write('Coverage and insert size tables can be found at : {0}_coverage.tsv, {0}_inserts.tsv\n'.format(
+            self.uread))
+        logger.close()
+        return(0)
+
+    def breakpoints(self):
+        '''Write suspect misassembly regions of the sorted, indexed bam and the assembly score'''
+        #Start logging
+        start = timeit.default_timer()
+        logger = open(self.log, 'a')
+        bam = '{0}.bam'.format(self.uread)
+        bed = '{0}_breakpoints.bed'.format(self.uread)
+
+        #Windows are scanned for coverage collapse, discordant pairs and clipped read pileups
+        logger.write('Scanning for misassembly breakpoints in : {0}\n'.format(bam))
+        try:
+            summary = findBreakpoints(self.assembly, bam, bed, int(self.threads))
+        except (OSError, ValueError) as error:
+            logger.write('Breakpoint detection failed : {0}\n'.format(error))
+            logger.close()
+            return(1)
+        scorefile = open('{0}_misassembly.tsv'.format(self.uread), 'w')
+        scorefile.write('Metric\tValue\n')
+        for metric, value in summary.items():
+            scorefile.write('{0}\t{1}\n'.format(metric, value))
+        scorefile.close()
+        elapsed = timeit.default_timer() - start
+        logger.write('Breakpoint detection completed successfully; {0} suspect regions; Runtime : {1}\n'.format(
+            summary['Regions'], elapsed))
+        logger.write('Suspect regions can be found at : {0}\n'.format(bed))
+        logger.close()
+        return(0)
+
     def sortBam(self):
         '''Sort and index file'''
         #Start logging
@@ -141,11 +252,7 @@ class Evaluate:
 
 
         #Running samtools
-        srun = subprocess.Popen(scmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-        
-        #Capture stdout and stderr
-        slog = srun.communicate()
+        srun = runCommand(scmd, 'samtools sort', runlogger, self.metrics)
         elapsed = timeit.default_timer() - start
         runlogger.flush()
         runlogger.close()
@@ -177,11 +284,7 @@ class Evaluate:
 
 
         #Running samtools
-        srun = subprocess.Popen(scmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-        
-        #Capture stdout and stderr
-        slog = srun.communicate()
+        srun = runCommand(scmd, 'samtools index', runlogger, self.metrics)
         elapsed = timeit.default_timer() - start
         runlogger.flush()
         runlogger.close()
@@ -224,29 +327,17 @@ class Evaluate:
 
 
         #Running setup
-        pbrun = subprocess.Popen(secmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-        pbrun.wait()
+        pbrun = runCommand(secmd, 'pbjelly setup', runlogger, self.metrics)
         #Running mapping
-        pbrun = subprocess.Popen(macmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-        pbrun.wait()
+        pbrun = runCommand(macmd, 'pbjelly mapping', runlogger, self.metrics)
         #Running support
-        pbrun = subprocess.Popen(sucmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-        pbrun.wait()
+        pbrun = runCommand(sucmd, 'pbjelly support', runlogger, self.metrics)
         #Running extraction
-        pbrun = subprocess.Popen(excmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-        pbrun.wait()
+        pbrun = runCommand(excmd, 'pbjelly extraction', runlogger, self.metrics)
         #Running assembly
-        pbrun = subprocess.Popen(ascmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-        pbrun.wait()
+        pbrun = runCommand(ascmd, 'pbjelly assembly', runlogger, self.metrics)
         #Running output
-        pbrun = subprocess.Popen(otcmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-        pbrun.wait()
+        pbrun = runCommand(otcmd, 'pbjelly output', runlogger, self.metrics)
         return
 
     def cleanSam(self):
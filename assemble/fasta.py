@@ -0,0 +1,166 @@
+import os
+import sys
+import mmap
+import logging
+import numpy as np
+from collections import namedtuple
+
+FastaRecord = namedtuple('FastaRecord', ['header', 'seq', 'fid', 'length'])
+
+
+class IndexedFasta:
+    '''Memory mapped fasta file with a samtools compatible .fai index.
+
+    The index is reused when it is newer than the fasta file and written
+    next to it otherwise, so that repeat runs never rescan the sequence.
+    Sequences are only read from the map when fetched; lengths come from
+    the index alone.
+    '''
+
+    def __init__(self, fasta, persist=True):
+        self.fasta = os.path.abspath(fasta)
+        self.fai = '{0}.fai'.format(self.fasta)
+        self.persist = persist
+        self.handle = open(self.fasta, 'rb')
+        if os.path.getsize(self.fasta) > 0:
+            self.map = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.map = b''
+        FORMAT = '%(asctime)-15s : %(levelname)-8s :  %(message)s'
+        logging.basicConfig(format=FORMAT)
+        if os.path.exists(self.fai) and os.path.getmtime(self.fai) >= os.path.getmtime(self.fasta):
+            self.loadIndex()
+        else:
+            self.buildIndex()
+        self.ids = dict(zip(self.names, range(len(self.names))))
+        return
+
+    def __len__(self):
+        return(len(self.names))
+
+    def loadIndex(self):
+        '''Read an existing .fai file'''
+        names = list()
+        columns = list()
+        for lines in open(self.fai):
+            lines = lines.rstrip('\n').split('\t')
+            names.append(lines[0])
+            columns.append([int(value) for value in lines[1:5]])
+        columns = np.array(columns, dtype=np.int64).reshape(-1, 4)
+        self.names = names
+        self.lengths, self.offsets, self.linebases, self.linewidths = columns.T.copy()
+        #End of the sequence bytes, from the fixed line layout
+        fulllines = self.lengths // np.maximum(self.linebases, 1)
+        self.ends = self.offsets + fulllines * self.linewidths + self.lengths % np.maximum(self.linebases, 1)
+        return
+
+    def buildIndex(self):
+        '''Scan the fasta once for record offsets, lengths and line layout'''
+        data = np.frombuffer(self.map, dtype=np.uint8) if len(self.map) else np.zeros(0, dtype=np.uint8)
+        size = len(data)
+        names = list()
+        columns = list()
+        regular = True
+        if size and data[0] == 62:
+            position = 0
+        else:
+            position = self.map.find(b'\n>')
+            position = position + 1 if position >= 0 else -1
+        while position >= 0:
+            headend = self.map.find(b'\n', position)
+            if headend < 0:
+                headend = size
+            names.append((self.map[position + 1:headend].decode().split() or [''])[0])
+            offset = min(headend + 1, size)
+            nextrec = self.map.find(b'\n>', offset - 1)
+            end = size if nextrec < 0 else nextrec + 1
+            region = data[offset:end]
+            newlines = np.flatnonzero(region == 10)
+            carriage = int(np.count_nonzero(region == 13))
+            length = len(region) - len(newlines) - carriage
+            if len(newlines):
+                linewidth = int(newlines[0]) + 1
+                linebases = linewidth - (1 if linewidth > 1 and region[linewidth - 2] == 13 else 0) - 1
+                widths = np.diff(np.concatenate(([-1], newlines)))
+                #Every line but the last must be full width for .fai offsets to hold
+                if len(widths) > 1 and not (widths[:-1] == linewidth).all():
+                    regular = False
+                if widths[-1] > linewidth:
+                    regular = False
+            else:
+                linebases = linewidth = length
+            columns.append([length, offset, linebases, linewidth, offset + len(region)])
+            if nextrec < 0:
+                break
+            position = nextrec + 1
+        columns = np.array(columns, dtype=np.int64).reshape(-1, 5)
+        self.names = names
+        self.lengths, self.offsets, self.linebases, self.linewidths, self.ends = columns.T.copy()
+        if not regular:
+            logging.warning('Fasta lines have uneven widths; index not written : {0}'.format(self.fasta))
+        elif self.persist:
+            self.writeIndex()
+        return
+
+    def writeIndex(self):
+        '''Write the .fai index atomically; skip read only directories'''
+        tmpfai = '{0}.{1}.tmp'.format(self.fai, os.getpid())
+        try:
+            faihandle = open(tmpfai, 'w')
+            for name, length, offset, linebases, linewidth in zip(self.names, self.lengths,
+                self.offsets, self.linebases, self.linewidths):
+                faihandle.write('{0}\t{1}\t{2}\t{3}\t{4}\n'.format(name, length, offset, linebases, linewidth))
+            faihandle.close()
+            os.replace(tmpfai, self.fai)
+        except OSError as error:
+            logging.warning('Could not write fasta index {0} : {1}'.format(self.fai, error))
+        return
+
+    def index(self, key):
+        '''Return integer id of a contig name or id'''
+        if isinstance(key, str):
+            return(self.ids[key])
+        return(int(key))
+
+    def header(self, key):
+        '''Return the full header line of a contig'''
+        offset = int(self.offsets[self.index(key)])
+        start = self.map.rfind(b'\n>', 0, offset - 1) + 1
+        return(self.map[start + 1:offset].decode().rstrip('\r\n'))
+
+    def fetch(self, key):
+        '''Return the sequence of a contig by name or id'''
+        fid = self.index(key)
+        region = self.map[self.offsets[fid]:self.ends[fid]]
+        return(region.replace(b'\n', b'').replace(b'\r', b'').decode())
+
+    def contigLengths(self):
+        '''Yield (name, length) tuples without touching the sequence'''
+        for name, length in zip(self.names, self.lengths):
+            yield(name, int(length))
+        return
+
+    def composition(self):
+        '''Return a (contigs x 5) matrix of A, C, G, T and N counts, ignoring case'''
+        table = np.full(256, 5, dtype=np.int64)
+        for code, base in enumerate('ACGTN'):
+            table[ord(base)] = code
+            table[ord(base.lower())] = code
+        data = np.frombuffer(self.map, dtype=np.uint8) if len(self.map) else np.zeros(0, dtype=np.uint8)
+        counts = np.zeros((len(self), 5), dtype=np.int64)
+        for fid in range(len(self)):
+            region = data[self.offsets[fid]:self.ends[fid]]
+            counts[fid] = np.bincount(table[region], minlength=6)[:5]
+        return(counts)
+
+    def records(self):
+        '''Yield FastaRecord tuples in file order'''
+        for fid in range(len(self)):
+            yield(FastaRecord(self.header(fid), self.fetch(fid), fid, int(self.lengths[fid])))
+        return
+
+    def close(self):
+        if len(self.map):
+            self.map.close()
+        self.handle.close()
+        return
@@ -0,0 +1,203 @@
+import os
+import json
+import fcntl
+import shutil
+import logging
+import tempfile
+import contextlib
+from assemble.runner import runCommand
+from assemble.checkpoint import fileSignature
+
+
+def directorySize(path):
+    '''Return the total size in bytes of the files in a directory'''
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return(size)
+
+
+class IndexCache:
+    '''Bowtie2 indexes shared between samples and runs, keyed by fasta content.
+
+    An index lives in <cachedir>/<sha256 of the fasta>/index, so renamed
+    or copied references reuse it, and references in read only
+    directories can still be indexed. Digests are remembered by file size
+    and mtime so large references are hashed once. Building an entry
+    holds an exclusive file lock, so concurrent samples build it exactly
+    once; the index is built in a temporary directory and renamed into
+    place, so a partial index is never visible. Other files derived from
+    a fasta, such as k-mer filters, are cached the same way in
+    <cachedir>/<sha256>.<kind>. Entries are touched on use and, above
+    maxsize GB, the least recently used are evicted. Callers read an
+    entry inside hold, which keeps a shared lock on it, and eviction
+    skips entries anyone holds.
+    '''
+
+    def __init__(self, cachedir, maxsize=None):
+        self.cachedir = os.path.abspath(cachedir)
+        self.maxsize = maxsize
+        self.digests = '{0}/digests.json'.format(self.cachedir)
+        if not os.path.exists(self.cachedir):
+            os.makedirs(self.cachedir, exist_ok=True)
+        return
+
+    def lock(self, name, blocking=True, shared=False):
+        '''Return an open handle holding the lock name, or None if busy and not blocking'''
+        handle = open('{0}/.{1}.lock'.format(self.cachedir, name), 'a')
+        operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        try:
+            fcntl.flock(handle, operation if blocking else operation | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handle.close()
+            return(None)
+        return(handle)
+
+    def entryName(self, path):
+        '''Return the name of the cache entry holding path, or None for paths outside the cache'''
+        relative = os.path.relpath(os.path.abspath(path), self.cachedir)
+        if relative == '.' or relative.startswith('..'):
+            return(None)
+        return(relative.split(os.sep)[0])
+
+    def acquire(self, name):
+        '''Return a handle holding a shared lock on entry name, touched, or None if it is missing'''
+        handle = self.lock(name, shared=True)
+        if not os.path.isdir('{0}/{1}'.format(self.cachedir, name)):
+            handle.close()
+            return(None)
+        os.utime('{0}/{1}'.format(self.cachedir, name))
+        return(handle)
+
+    @contextlib.contextmanager
+    def hold(self, path):
+        '''Keep the entry holding path from eviction until the block ends
+
+        Every hold takes and releases its own shared lock, so holds of
+        stages sharing the cache never depend on each other. An entry
+        evicted since index or artifact returned it raises
+        FileNotFoundError. Paths outside the cache are passed through.
+        '''
+        name = self.entryName(path)
+        handle = None
+        if name is not None:
+            handle = self.acquire(name)
+            if handle is None:
+                raise FileNotFoundError('Cache entry was evicted before use : {0}'.format(path))
+        try:
+            yield(path)
+        finally:
+            if handle is not None:
+                handle.close()
+        return
+
+    def digest(self, fasta):
+        '''Return the sha256 of a fasta file, reusing the digest recorded for its size and mtime'''
+        fasta = os.path.abspath(fasta)
+        signature = fileSignature(fasta)
+        handle = self.lock('digests')
+        try:
+            try:
+                digests = json.load(open(self.digests))
+            except (OSError, ValueError):
+                digests = dict()
+            if fasta in digests and digests[fasta][0] == signature:
+                return(digests[fasta][1])
+            digests[fasta] = [signature, fileSignature(fasta, content=True)]
+            tmpdigests = '{0}.{1}.tmp'.format(self.digests, os.getpid())
+            json.dump(digests, open(tmpdigests, 'w'), indent=1, sort_keys=True)
+            os.replace(tmpdigests, self.digests)
+            return(digests[fasta][1])
+        finally:
+            handle.close()
+
+    def index(self, fasta, bowtie_path, runlogger, metrics=None):
+        '''Return the index prefix of fasta and the CommandRun of its build, or None when cached'''
+        if not os.path.isfile(fasta):
+            raise FileNotFoundError('Cannot index missing fasta file : {0}'.format(fasta))
+        digest = self.digest(fasta)
+        entry = '{0}/{1}'.format(self.cachedir, digest)
+        prefix = '{0}/index'.format(entry)
+        birun = None
+        #Present entries are touched; missing ones are built under the exclusive lock and checked again
+        while True:
+            handle = self.acquire(digest)
+            if handle is not None:
+                handle.close()
+                break
+            handle = self.lock(digest)
+            try:
+                if os.path.isdir(entry):
+                    continue
+                builddir = tempfile.mkdtemp(prefix='.tmp_', dir=self.cachedir)
+                bicmd = ['{0}-build'.format(bowtie_path), fasta, '{0}/index'.format(builddir)]
+                runlogger.write('{0}\n'.format(' '.join(bicmd)))
+                runlogger.flush()
+                birun = runCommand(bicmd, 'bowtie2-build', runlogger, metrics)
+                if birun.returncode != 0:
+                    shutil.rmtree(builddir, ignore_errors=True)
+                    return(prefix, birun)
+                os.rename(builddir, entry)
+            finally:
+                handle.close()
+            self.evict(digest)
+        return(prefix, birun)
+
+    def artifact(self, fasta, kind, build):
+        '''Return the entry directory of a kind of derived file of fasta, calling build(directory) once'''
+        if not os.path.isfile(fasta):
+            raise FileNotFoundError('Cannot cache files of missing fasta file : {0}'.format(fasta))
+        name = '{0}.{1}'.format(self.digest(fasta), kind)
+        entry = '{0}/{1}'.format(self.cachedir, name)
+        while True:
+            handle = self.acquire(name)
+            if handle is not None:
+                handle.close()
+                break
+            handle = self.lock(name)
+            try:
+                if os.path.isdir(entry):
+                    continue
+                builddir = tempfile.mkdtemp(prefix='.tmp_', dir=self.cachedir)
+                try:
+                    build(builddir)
+                except BaseException:
+                    shutil.rmtree(builddir, ignore_errors=True)
+                    raise
+                os.rename(builddir, entry)
+            finally:
+                handle.close()
+            self.evict(name)
+        return(entry)
+
+    def evict(self, keep=None):
+        '''Remove least recently used entries until the cache fits in maxsize GB'''
+        if not self.maxsize:
+            return
+        entries = list()
+        for name in os.listdir(self.cachedir):
+            path = '{0}/{1}'.format(self.cachedir, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            entries.append((os.path.getmtime(path), name, directorySize(path)))
+        total = sum([size for mtime, name, size in entries])
+        for mtime, name, size in sorted(entries):
+            if total <= self.maxsize * 1073741824:
+                break
+            if name == keep:
+                continue
+            #Entries being built, checked or read by any run hold a lock and are left alone
+            handle = self.lock(name, blocking=False)
+            if handle is None:
+                continue
+            try:
+                shutil.rmtree('{0}/{1}'.format(self.cachedir, name), ignore_errors=True)
+                total -= size
+                logging.info('Evicted bowtie index {0} from the index cache'.format(name))
+            finally:
+                handle.close()
+        return
@@ -16,6 +16,7 @@ from Bio import SeqIO
 from itertools import repeat
 from multiprocessing import Pool
 from collections import defaultdict
+from assemble.runner import runCommand
 
 class Ngopt:
     def __init__(self, ngopt_path, read1, read2, outdir, name, threads):
@@ -28,6 +29,7 @@ class Ngopt:
         self.name = name
         self.log = '{0}/ngopt.log'.format(self.outdir)
         self.runtime = '{0}/ngopt_runtime.log'.format(self.outdir)
+        self.metrics = '{0}/stage_metrics.jsonl'.format(os.path.abspath(outdir))
         self.result = '{0}/{1}.contigs.fa'.format(self.outdir, self.name)
         if not os.path.exists(self.outdir):
             os.mkdir(self.outdir)
@@ -43,19 +45,14 @@ class Ngopt:
 
         #Prepare run commands
         logger.write('Ngopt pipeline started\n')
-        logger.write('Changing working directory to : {0}'.format(self.outdir))
-        os.chdir(self.outdir)
+        logger.write('Running in working directory : {0}\n'.format(self.outdir))
 
         ncmd = [self.ngopt_path, self.read1, self.read2, './'] 
         logger.write('Running NGOPT with the following command\n')
         logger.write('{0}\n'.format(' '.join(ncmd)))
         print(ncmd)
         #Run NGOPT 
-        nrun = subprocess.Popen(ncmd, stdout=runlogger,
-            stderr=runlogger)
-
-        #Capture stdout and stderr
-        nlog = nrun.communicate()
+        nrun = runCommand(ncmd, 'ngopt', runlogger, self.metrics, cwd=self.outdir)
         elapsed = timeit.default_timer() - start
         runlogger.flush()
         runlogger.flush()
@@ -0,0 +1,108 @@
+import timeit
+import logging
+import numpy as np
+from collections import OrderedDict
+from assemble.readers import PairedFastq
+from assemble.trimmer import BASE_CODES
+from assemble.screen import canonicalKmers, bloomHashes
+
+#Count-min cells are bytes; counts saturate here
+MAX_COUNT = 255
+
+
+class Normalizer:
+    '''Digital normalization of paired reads against a count-min sketch.
+
+    Each read's coverage is estimated as the median count of its
+    canonical k-mers, counted in a sketch of tables rows of bytes taking
+    at most memory GB in total, however many reads are seen. A pair is
+    kept when either mate is estimated below coverage, and only kept
+    pairs are counted, so redundant reads from deep regions are dropped
+    as they stream past. Pairs are decided chunk pairs at a time against
+    the counts of earlier chunks.
+    '''
+
+    def __init__(self, coverage=20, k=20, memory=1.0, tables=4, chunk=2048, phred='phred33'):
+        self.coverage = coverage
+        self.k = k
+        self.tables = tables
+        self.chunk = chunk
+        self.phred = phred
+        #Tables are a power of two wide, at most memory GB in total, so columns are a mask away
+        self.width = 1
+        while self.width * 2 * tables <= memory * 1073741824:
+            self.width *= 2
+        self.counts = np.zeros((tables, self.width), dtype=np.uint8)
+        self.rows = np.arange(tables)[:,None]
+        return
+
+    def positions(self, values):
+        '''Return the (tables x k-mers) sketch columns of k-mers'''
+        first, second = bloomHashes(values)
+        index = np.arange(self.tables, dtype=np.uint64)[:,None]
+        return(((first + index * second) & np.uint64(self.width - 1)).astype(np.int64))
+
+    def medians(self, batch):
+        '''Return the median k-mer count of every read, with the sketch columns and read of its k-mers'''
+        seqs, lengths = batch.fieldMatrix(1)
+        values, valid = canonicalKmers(BASE_CODES[seqs], self.k)
+        reads, columns = np.nonzero(valid)
+        positions = self.positions(values[reads, columns])
+        #Invalid k-mers sort after every count and are left out of the median
+        estimates = np.full(values.shape, MAX_COUNT + 1, dtype=np.uint16)
+        estimates[reads, columns] = self.counts[self.rows, positions].min(axis=0)
+        estimates.sort(axis=1)
+        nvalid = valid.sum(axis=1)
+        if estimates.shape[1] == 0:
+            return(np.zeros(len(batch), dtype=np.int64), positions, reads)
+        median = estimates[np.arange(len(batch)), np.maximum(nvalid - 1, 0) // 2]
+        return(np.where(nvalid > 0, median, 0), positions, reads)
+
+    def count(self, positions):
+        '''Add k-mers at sketch columns positions, saturating at MAX_COUNT'''
+        for table in range(self.tables):
+            columns, counts = np.unique(positions[table], return_counts=True)
+            self.counts[table, columns] = np.minimum(self.counts[table, columns] + counts, MAX_COUNT)
+        return
+
+    def normalizePair(self, batch1, batch2):
+        '''Return which pairs of aligned mate batches to keep, counting the k-mers of kept pairs'''
+        median1, positions1, reads1 = self.medians(batch1)
+        median2, positions2, reads2 = self.medians(batch2)
+        keep = (median1 < self.coverage) | (median2 < self.coverage)
+        self.count(np.concatenate((positions1[:,keep[reads1]], positions2[:,keep[reads2]]), axis=1))
+        return(keep)
+
+    def falsePositiveRate(self):
+        '''Estimate the chance that an unseen k-mer is counted, from the occupancy of the tables'''
+        occupancy = [np.count_nonzero(self.counts[table]) / float(self.width) for table in range(self.tables)]
+        return(float(np.prod(occupancy)))
+
+    def normalize(self, read1, read2, outfile1, outfile2, outdir, threads=1):
+        '''Write pairs of paired fastq files kept by digital normalization; return summary metrics'''
+        start = timeit.default_timer()
+        pairs = PairedFastq(read1, read2, outdir, self.phred, threads=threads)
+        handle1 = open(outfile1, 'wb')
+        handle2 = open(outfile2, 'wb')
+        total = 0
+        kept = 0
+        for batch1, batch2 in pairs.batches():
+            for first in range(0, len(batch1), self.chunk):
+                chunk1 = batch1.slice(first, first + self.chunk)
+                chunk2 = batch2.slice(first, first + self.chunk)
+                keep = self.normalizePair(chunk1, chunk2)
+                handle1.write(chunk1.take(keep).raw())
+                handle2.write(chunk2.take(keep).raw())
+                total += len(chunk1)
+                kept += int(keep.sum())
+        handle1.close()
+        handle2.close()
+        metrics = OrderedDict()
+        metrics['Pairs'] = total
+        metrics['PairsKept'] = kept
+        metrics['RetainedFraction'] = kept / float(total) if total else 0.0
+        metrics['SketchFalsePositiveRate'] = self.falsePositiveRate()
+        metrics['Runtime'] = timeit.default_timer() - start
+        logging.info('Digital normalization kept {0} of {1} pairs ({2:.1%})'.format(kept, total,
+            metrics['RetainedFraction']))
+        return(metrics)
@@ -17,6 +17,7 @@ from Bio import SeqIO
 from itertools import repeat
 from multiprocessing import Pool
 from collections import defaultdict
+from assemble.runner import runCommand
 
 class PandaSeq:
     def __init__(self, panda_path, read1, read2, outdir, threads ):
@@ -28,6 +29,7 @@ class PandaSeq:
         self.threads = threads
         self.log = '{0}/pandaseq.log'.format(self.outdir)
         self.runtime = '{0}/pandaseq_runtime.log'.format(self.outdir)
+        self.metrics = '{0}/stage_metrics.jsonl'.format(os.path.abspath(outdir))
         self.result = '{0}/sample.fa'.format(self.outdir)
         self.params = ['-B', '-o', '3', '-O', '0']
         if not os.path.exists(self.outdir):
@@ -46,17 +48,13 @@ class PandaSeq:
         logger.write('Pandaseq  started\n')
         #Setup pandaseq command
         pcmd = [self.panda_path, '-f', self.read1,'-r', self.read2, '-w',
-            self.result] + self.params
+            self.result, '-T', str(self.threads)] + self.params
         logger.write('Running Pandaseq with the following command\n')
         logger.write('{0}\n'.format(' '.join(pcmd)))
 
 
         #Running pandaseq
-        prun = subprocess.Popen(pcmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-    
-        #Capture stdout and stderr
-        plog = prun.communicate()
+        prun = runCommand(pcmd, 'pandaseq', runlogger, self.metrics)
         elapsed = timeit.default_timer() - start
         runlogger.flush()
         runlogger.close()
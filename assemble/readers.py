@@ -1,28 +1,175 @@
 import os
+import re
 import sys
 import csv
 import time
+import queue
 import logging
+import threading
+import itertools
+import numpy as np
+from multiprocessing import Pool
 from collections import namedtuple
+from collections import OrderedDict
+from assemble.streams import openInput, detectFormat
+
+Record = namedtuple('Record',['header', 'sheader', 'seq', 'quals'])
+PHRED_OFFSETS = {'phred33' : 33, 'phred64' : 64}
+PileupBatch = namedtuple('PileupBatch', ['scaf', 'pos', 'ref', 'depth', 'counts', 'ins', 'qual'])
+PILEUP_ALLELES = 'ACGTN*'
+PILEUP_TOKENS = re.compile(rb'\^.|[+-](\d+)')
+
+
+def fieldIndex(starts, ends):
+    '''Return buffer offsets of every byte in the ranges starts to ends, concatenated'''
+    lengths = ends - starts
+    total = int(lengths.sum())
+    shifts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return(shifts + np.arange(total, dtype=np.int64))
+
+def splitmix(values):
+    '''Scramble uint64 values with the splitmix64 finalizer'''
+    values = values + np.uint64(0x9e3779b97f4a7c15)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return(values ^ (values >> np.uint64(31)))
+
+def addCounts(total, counts):
+    '''Add two count vectors of possibly different length'''
+    if len(counts) > len(total):
+        total, counts = counts, total
+    total = total.copy()
+    total[:len(counts)] += counts
+    return(total)
+
+
+class FastqBatch:
+    '''Block of complete fastq records sharing a single byte buffer.
+
+    Line boundaries are kept as (records x 4) start and end offset matrices
+    into buf, with the ends excluding the newline (and carriage return), so
+    that every field of every record can be sliced out without copying.
+    '''
+
+    def __init__(self, buf, starts, ends, rends, recno):
+        self.buf = buf
+        self.starts = starts
+        self.ends = ends
+        self.rends = rends
+        self.recno = recno
+
+    def __len__(self):
+        return(len(self.starts))
+
+    def slice(self, first, last):
+        '''Return records first to last as a new batch on the same buffer'''
+        return(FastqBatch(self.buf, self.starts[first:last], self.ends[first:last],
+            self.rends[first:last], self.recno + first))
+
+    def lengths(self):
+        '''Return sequence lengths of all records'''
+        return(self.ends[:,1] - self.starts[:,1])
+
+    def header(self, index):
+        return(self.buf[self.starts[index,0]:self.ends[index,0]].tobytes())
+
+    def sheader(self, index):
+        return(self.buf[self.starts[index,2]:self.ends[index,2]].tobytes())
+
+    def seq(self, index):
+        return(self.buf[self.starts[index,1]:self.ends[index,1]])
+
+    def quals(self, index):
+        return(self.buf[self.starts[index,3]:self.ends[index,3]])
+
+    def take(self, index):
+        '''Return the records at index as a new batch on the same buffer'''
+        return(FastqBatch(self.buf, self.starts[index], self.ends[index],
+            self.rends[index], self.recno))
+
+    def raw(self):
+        '''Return the fastq text of all records in the batch'''
+        if len(self) and np.array_equal(self.rends[:-1], self.starts[1:,0]):
+            return(self.buf[self.starts[0,0]:self.rends[-1]].tobytes())
+        return(self.buf[fieldIndex(self.starts[:,0], self.rends)].tobytes())
+
+    def nameMatrix(self):
+        '''Return read names as a zero padded matrix; names stop at whitespace and drop /1 and /2'''
+        matrix, lengths = self.fieldMatrix(0)
+        matrix = matrix[:,1:]
+        stop = (matrix == 32) | (matrix == 9) | (matrix == 0)
+        namelen = np.where(stop.any(axis=1), stop.argmax(axis=1), matrix.shape[1])
+        rows = np.arange(len(matrix))
+        mate = (namelen >= 2) & (matrix[rows,np.maximum(namelen - 2, 0)] == 47) & \
+            ((matrix[rows,np.maximum(namelen - 1, 0)] == 49) | (matrix[rows,np.maximum(namelen - 1, 0)] == 50))
+        namelen[mate] -= 2
+        matrix[np.arange(matrix.shape[1]) >= namelen[:,None]] = 0
+        return(matrix, namelen)
+
+    def names(self):
+        '''Return read names as a list of bytes'''
+        matrix, namelen = self.nameMatrix()
+        return([row[:length].tobytes() for row, length in zip(matrix, namelen)])
+
+    def seqIndex(self):
+        '''Return buffer offsets of all sequence bases in the batch'''
+        return(fieldIndex(self.starts[:,1], self.ends[:,1]))
+
+    def fieldMatrix(self, line):
+        '''Gather one line of every record into a zero padded (reads x cycles) uint8 matrix'''
+        lengths = self.ends[:,line] - self.starts[:,line]
+        width = int(lengths.max()) if len(lengths) else 0
+        cycles = np.arange(width, dtype=np.int64)
+        valid = cycles < lengths[:,None]
+        index = np.where(valid, self.starts[:,line,None] + cycles, 0)
+        matrix = self.buf[index]
+        matrix[~valid] = 0
+        return(matrix, lengths)
+
+    def qualMatrix(self, phredtable):
+        '''Decode all quality strings into a zero padded (reads x cycles) uint8 matrix'''
+        matrix, lengths = self.fieldMatrix(3)
+        return(phredtable[matrix], lengths)
+
+    def nameHashes(self):
+        '''Return a 64 bit hash of every read name, equal for both mates of a pair'''
+        matrix, namelen = self.nameMatrix()
+        weights = splitmix(np.arange(matrix.shape[1], dtype=np.uint64))
+        hashes = (matrix.astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)
+        return(splitmix(hashes ^ namelen.astype(np.uint64)))
+
+    def seqHashes(self):
+        '''Return a 64 bit hash of every sequence'''
+        matrix, lengths = self.fieldMatrix(1)
+        weights = splitmix(np.arange(matrix.shape[1], dtype=np.uint64))
+        hashes = (matrix.astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)
+        return(splitmix(hashes ^ lengths.astype(np.uint64)))
 
 
 class Fastq:
 
-    def __init__(self, fastqfile, outdir, phred):
+    def __init__(self, fastqfile, outdir, phred, compat=False, blocksize=4194304, mask=20, threads=1):
         self.fastq = fastqfile
         self.outdir = outdir
         self.phred = phred
+        self.threads = threads
+        self.compat = compat
+        self.blocksize = blocksize
+        #Bases below mask are N in decoded records; batches and raw() keep the input bytes
+        self.mask = mask
         FORMAT = '%(asctime)-15s : %(levelname)-8s :  %(message)s'
         logging.basicConfig(format=FORMAT)
-        self.phreddict = self.phredmap()
-        
+        self.phredtable = self.phredmap()
+
 
     def phredmap(self):
-        phreddict = dict()
-        if self.phred == "phred33":
-            for asciis, quals in zip(range(33,126), range(0,92)):
-                phreddict[asciis] = quals
-        return(phreddict)
+        '''Return 256 entry lookup table from quality character to phred score'''
+        if self.phred not in PHRED_OFFSETS:
+            logging.error('Unknown quality encoding : {0}'.format(self.phred))
+            raise ValueError('Unknown quality encoding : {0}; use one of {1}'.format(self.phred, ', '.join(sorted(PHRED_OFFSETS))))
+        offset = PHRED_OFFSETS[self.phred]
+        phredtable = np.clip(np.arange(256) - offset, 0, 93).astype(np.uint8)
+        return(phredtable)
 
     def formatChecker(self, header, seq, sheader, quals, line, phred):
         if header[0] != "@":
@@ -34,89 +181,649 @@ class Fastq:
         if seq == '':
             return(4)
 
+    def batchChecker(self, batch):
+        '''Vectorized formatChecker; return (code, index) of first bad record'''
+        buf = batch.buf
+        starts = batch.starts
+        ends = batch.ends
+        codes = np.zeros(len(batch), dtype=np.int8)
+        seqlen = ends[:,1] - starts[:,1]
+        quallen = ends[:,3] - starts[:,3]
+        codes[seqlen == 0] = 4
+        codes[seqlen != quallen] = 3
+        codes[(ends[:,2] == starts[:,2]) | (buf[starts[:,2]] != 43)] = 2
+        codes[(ends[:,0] == starts[:,0]) | (buf[starts[:,0]] != 64)] = 1
+        bad = np.flatnonzero(codes)
+        if len(bad) == 0:
+            return(0, len(batch))
+        return(int(codes[bad[0]]), int(bad[0]))
+
     def qualmasker(self, seq, quals):
         maskedseq = list()
         for base, qual in zip(seq, quals):
-            if qual < 20:
+            if qual < self.mask:
                 maskedseq.append('N')
             else:
                 maskedseq.append(base)
         return(maskedseq, quals)
-        
-    def read(self):
-        fqhandle = open(self.fastq, 'r')
-        Record = namedtuple('Record',['header', 'sheader', 'seq', 'quals'])
-        lineno = 0
+
+    def maskBatch(self, batch):
+        '''Return the batch with bases below the mask threshold replaced by N, on a copy of its buffer'''
+        lowtable = self.phredtable < self.mask
+        qualindex = fieldIndex(batch.starts[:,3], batch.ends[:,3])
+        lowqual = np.flatnonzero(lowtable[batch.buf[qualindex]])
+        if len(lowqual) == 0:
+            return(batch)
+        #Map low quality positions back onto the sequence line of the same read
+        readno = np.searchsorted(batch.starts[:,3], qualindex[lowqual], side='right') - 1
+        shift = batch.starts[readno,3] - batch.starts[readno,1]
+        buf = batch.buf.copy()
+        buf[qualindex[lowqual] - shift] = 78
+        return(FastqBatch(buf, batch.starts, batch.ends, batch.rends, batch.recno))
+
+    def splitBlock(self, data, eof, multiple=1):
+        '''Locate line boundaries in a block; return starts, ends and consumed bytes'''
+        buf = np.frombuffer(data, dtype=np.uint8)
+        newlines = np.flatnonzero(buf == 10)
+        nrec = len(newlines) // 4
+        nrec -= nrec % multiple
+        if nrec == 0:
+            return(buf, None, None, 0)
+        newlines = newlines[:nrec * 4]
+        starts = np.empty(nrec * 4, dtype=np.int64)
+        starts[0] = 0
+        starts[1:] = newlines[:-1] + 1
+        ends = newlines.astype(np.int64)
+        #Drop carriage returns from windows line endings
+        crlf = (ends > starts) & (buf[ends - 1] == 13)
+        ends[crlf] -= 1
+        return(buf, starts.reshape(nrec, 4), ends.reshape(nrec, 4), int(newlines[-1]) + 1)
+
+    def batches(self, start=0, end=None, multiple=1):
+        '''Read fastq file in large blocks and yield batches of complete records.
+
+        start and end restrict reading to the records whose header begins in
+        that byte range; start must fall on a record boundary. Batch sizes are
+        kept to a multiple of multiple records, e.g. 2 for interleaved pairs.
+        '''
+        fqhandle = openInput(self.fastq, self.threads)
+        if start > 0:
+            fqhandle.seek(start)
+        carry = bytearray()
+        recno = 0
+        offset = start
+        done = False
         while True:
-            try:
-                #Get fastq record
-                header = next(fqhandle).strip()
-                lineno
-                seq = [base for base in next(fqhandle).strip()]
-                sheader = next(fqhandle).strip()
-                quals = [self.phreddict[int(ord(qual))] for qual in next(fqhandle).strip()]
-                lineno += 1
-            
-                #Check if record adheres to fastq format
-                check = self.formatChecker(header, seq, sheader, quals, lineno, self.phred)
-                if check == 1:
-                    logging.error('Invalid header in fastq read ; record number : {1}'.format(lineno))
-                    raise NameError('Invalid header in fastq read; record number : {0}'.format(lineno))
-                if check == 2:
-                    logging.error('Invalid secondary header in fastq read ; record number : {1}'.format(lineno))
-                    raise NameError('Invalid secondary header in fastq read; record number : {0}'.format(lineno))
-                if check == 3:
-                    logging.error('Sequence and quality strings of unequl length in fastq read; record number : {0}'.format(lineno))
-                    raise NameError('Sequence and quality strings of unequal length in fastq read; record number : {0}'.format(lineno))
-                if check == 4:
-                    logging.error('Sequence data missing; record number : {0}'.format(lineno))
-                    raise NameError('Sequence data missing; record number : {0}'.format(lineno))
-
-                #Optionally mask low quality reads
-                #seq, quals = self.qualmasker(seq, quals)
-
-                #Return record
-                record = Record(header, sheader, seq, quals)
+            block = fqhandle.read(self.blocksize)
+            eof = not block
+            data = carry
+            data += block
+            if eof and len(data) > 0 and data[-1] != 10:
+                data += b'\n'
+            buf, starts, ends, used = self.splitBlock(data, eof, multiple)
+            if starts is None:
+                if eof:
+                    if len(data.strip()) > 0:
+                        logging.error('Truncated fastq record at end of file; record number : {0}'.format(recno + 1))
+                    break
+                buf = None
+                carry = data
+                continue
+            rends = np.empty(len(starts), dtype=np.int64)
+            rends[:-1] = starts[1:,0]
+            rends[-1] = used
+            batch = FastqBatch(buf, starts, ends, rends, recno)
+            if end is not None:
+                last = int(np.searchsorted(starts[:,0] + offset, end))
+                if last < len(batch):
+                    batch = batch.slice(0, last)
+                    done = True
+                if len(batch) == 0:
+                    break
+            check, index = self.batchChecker(batch)
+            if check != 0:
+                if index > 0:
+                    yield(batch.slice(0, index))
+                self.formatError(check, recno + index + 1)
+                break
+            yield(batch)
+            if done:
+                break
+            recno += len(batch)
+            offset += used
+            carry = bytearray(data[used:])
+            if eof and len(carry) == 0:
+                break
+        fqhandle.close()
+        logging.info('End of file')
+        return
+
+    def formatError(self, check, lineno):
+        '''Log formatChecker error codes'''
+        if check == 1:
+            logging.error('Invalid header in fastq read ; record number : {0}'.format(lineno))
+        if check == 2:
+            logging.error('Invalid secondary header in fastq read ; record number : {0}'.format(lineno))
+        if check == 3:
+            logging.error('Sequence and quality strings of unequl length in fastq read; record number : {0}'.format(lineno))
+        if check == 4:
+            logging.error('Sequence data missing; record number : {0}'.format(lineno))
+        return
+
+    def records(self, batch):
+        '''Yield the records of a batch; sequence and quality as uint8 arrays, or lists in compat mode'''
+        phredtable = self.phredtable
+        if self.mask:
+            batch = self.maskBatch(batch)
+        for index in range(len(batch)):
+            header = batch.header(index)
+            sheader = batch.sheader(index)
+            seq = batch.seq(index)
+            quals = phredtable[batch.quals(index)]
+            if self.compat:
+                header = header.decode()
+                sheader = sheader.decode()
+                seq = list(seq.tobytes().decode())
+                quals = quals.tolist()
+
+            #Return record
+            record = Record(header, sheader, seq, quals)
+            yield(record)
+        return
+
+    def read(self):
+        '''Yield fastq records'''
+        for batch in self.batches():
+            for record in self.records(batch):
                 yield(record)
-            except StopIteration:
-                logging.info('End of file')
+
+        return
+
+
+
+def readAhead(batches, depth):
+    '''Run a batch generator in a background thread, buffering up to depth batches'''
+    buffered = queue.Queue(depth)
+    stopped = threading.Event()
+
+    def fill():
+        try:
+            for batch in batches:
+                while not stopped.is_set():
+                    try:
+                        buffered.put(batch, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if stopped.is_set():
+                    return
+            buffered.put(None)
+        except Exception as error:
+            buffered.put(error)
+        return
+
+    thread = threading.Thread(target=fill, daemon=True)
+    thread.start()
+    try:
+        while True:
+            batch = buffered.get()
+            if batch is None:
                 break
-            except NameError:
+            if isinstance(batch, Exception):
+                raise batch
+            yield(batch)
+    finally:
+        stopped.set()
+    return
+
+def parseBatch(reader, data):
+    '''Build a batch from raw fastq text of complete records, split by reader'''
+    buf, starts, ends, used = reader.splitBlock(bytearray(data), True)
+    if starts is None:
+        return(FastqBatch(buf, np.zeros((0, 4), dtype=np.int64), np.zeros((0, 4), dtype=np.int64),
+            np.zeros(0, dtype=np.int64), 0))
+    rends = np.empty(len(starts), dtype=np.int64)
+    rends[:-1] = starts[1:,0]
+    rends[-1] = used
+    return(FastqBatch(buf, starts, ends, rends, 0))
+
+def sameNames(batch1, batch2):
+    '''Return a boolean array, True where mate names of two aligned batches agree'''
+    matrix1, namelen1 = batch1.nameMatrix()
+    matrix2, namelen2 = batch2.nameMatrix()
+    width = max(matrix1.shape[1], matrix2.shape[1])
+    matrix1 = np.pad(matrix1, ((0, 0), (0, width - matrix1.shape[1])))
+    matrix2 = np.pad(matrix2, ((0, 0), (0, width - matrix2.shape[1])))
+    return((namelen1 == namelen2) & (matrix1 == matrix2).all(axis=1))
+
+
+class PairedFastq:
+    '''Walk paired fastq files in lockstep, yielding aligned batches of mates.
+
+    read2 may be None for interleaved input. Each file is parsed in a
+    background thread that reads ahead up to prefetch batches. In repair
+    mode, mates are matched by name through a buffer of at most buffersize
+    unpaired reads per file; reads evicted from the buffer are orphans.
+    Interleaved input is repaired within its one stream, the first read
+    of a name taken as read 1.
+    '''
+
+    def __init__(self, read1, read2, outdir, phred, repair=False, buffersize=1000000,
+        prefetch=4, compat=False, mask=20, threads=1):
+        self.read1 = read1
+        self.read2 = read2
+        self.outdir = outdir
+        self.interleaved = read2 is None
+        self.repair = repair
+        self.buffersize = buffersize
+        self.prefetch = prefetch
+        self.orphans = 0
+        self.reader1 = Fastq(read1, outdir, phred, compat=compat, mask=mask, threads=threads)
+        if self.interleaved:
+            self.reader2 = self.reader1
+        else:
+            self.reader2 = Fastq(read2, outdir, phred, compat=compat, mask=mask, threads=threads)
+        FORMAT = '%(asctime)-15s : %(levelname)-8s :  %(message)s'
+        logging.basicConfig(format=FORMAT)
+
+    def mates(self):
+        '''Yield aligned (read1, read2) batch pairs without name checks'''
+        if self.interleaved:
+            for batch in readAhead(self.reader1.batches(multiple=2), self.prefetch):
+                yield(batch.take(slice(0, None, 2)), batch.take(slice(1, None, 2)))
+            return
+        source1 = readAhead(self.reader1.batches(), self.prefetch)
+        source2 = readAhead(self.reader2.batches(), self.prefetch)
+        pending1 = next(source1, None)
+        pending2 = next(source2, None)
+        while pending1 is not None and pending2 is not None:
+            size = min(len(pending1), len(pending2))
+            yield(pending1.slice(0, size), pending2.slice(0, size))
+            pending1 = pending1.slice(size, len(pending1))
+            pending2 = pending2.slice(size, len(pending2))
+            if len(pending1) == 0:
+                pending1 = next(source1, None)
+            if len(pending2) == 0:
+                pending2 = next(source2, None)
+        if pending1 is not None or pending2 is not None:
+            logging.error('Paired fastq files have different numbers of reads; rerun in repair mode')
+        return
+
+    def repaired(self, chunk=65536):
+        '''Yield aligned batch pairs of mates matched by name'''
+        waiting = (OrderedDict(), OrderedDict())
+        matched = (list(), list())
+        self.orphans = 0
+        sources = [self.namedRecords(readAhead(self.reader1.batches(), self.prefetch))]
+        if not self.interleaved:
+            sources.append(self.namedRecords(readAhead(self.reader2.batches(), self.prefetch)))
+        for records in itertools.zip_longest(*sources):
+            for side, named in enumerate(records):
+                if named is None:
+                    continue
+                name, record = named
+                #Interleaved mates share one stream; a read whose name is waiting as read 1 is read 2
+                if self.interleaved and name in waiting[0]:
+                    side = 1
+                other = 1 - side
+                if name in waiting[other]:
+                    matched[side].append(record)
+                    matched[other].append(waiting[other].pop(name))
+                else:
+                    waiting[side][name] = record
+                    if len(waiting[side]) > self.buffersize:
+                        waiting[side].popitem(last=False)
+                        self.orphans += 1
+            if len(matched[0]) >= chunk:
+                yield(self.rebatch(matched[0], self.reader1), self.rebatch(matched[1], self.reader2))
+                matched = (list(), list())
+        if matched[0]:
+            yield(self.rebatch(matched[0], self.reader1), self.rebatch(matched[1], self.reader2))
+        self.orphans += len(waiting[0]) + len(waiting[1])
+        if self.orphans:
+            logging.warning('Dropped {0} reads without a mate while repairing pairs'.format(self.orphans))
+        return
+
+    def namedRecords(self, batches):
+        '''Yield (name, raw record) for every record in a stream of batches'''
+        for batch in batches:
+            for index, name in enumerate(batch.names()):
+                yield(name, batch.buf[batch.starts[index,0]:batch.rends[index]].tobytes())
+        return
+
+    def rebatch(self, records, reader):
+        '''Build a batch from a list of raw fastq records'''
+        data = bytearray(b''.join(records))
+        if data[-1] != 10:
+            data += b'\n'
+        buf, starts, ends, used = reader.splitBlock(data, True)
+        rends = np.empty(len(starts), dtype=np.int64)
+        rends[:-1] = starts[1:,0]
+        rends[-1] = used
+        return(FastqBatch(buf, starts, ends, rends, 0))
+
+    def batches(self):
+        '''Yield aligned (read1, read2) batch pairs with matching read names'''
+        if self.repair:
+            for batch1, batch2 in self.repaired():
+                yield(batch1, batch2)
+            return
+        pairs = 0
+        for batch1, batch2 in self.mates():
+            same = sameNames(batch1, batch2)
+            if not same.all():
+                index = int(np.flatnonzero(~same)[0])
+                if index > 0:
+                    yield(batch1.slice(0, index), batch2.slice(0, index))
+                logging.error('Read names out of sync in paired fastq; pair number : {0}; rerun in repair mode'.format(pairs + index + 1))
                 break
+            pairs += len(batch1)
+            yield(batch1, batch2)
+        return
+
+    def read(self):
+        '''Yield (read1, read2) record pairs'''
+        for batch1, batch2 in self.batches():
+            for record1, record2 in zip(self.reader1.records(batch1), self.reader2.records(batch2)):
+                yield(record1, record2)
+        return
+
+    def write(self, outfile1, outfile2):
+        '''Write synchronized pairs to two fastq files; return number of pairs'''
+        handle1 = open(outfile1, 'wb')
+        handle2 = open(outfile2, 'wb')
+        pairs = 0
+        for batch1, batch2 in self.batches():
+            handle1.write(batch1.raw())
+            handle2.write(batch2.raw())
+            pairs += len(batch1)
+        handle1.close()
+        handle2.close()
+        return(pairs)
+
+
+class FastqStats:
+    '''Mergeable quality control accumulators for a fastq file.
 
+    Duplicates are estimated from a k minimum values sketch of sequence
+    hashes, so partial results from separate byte ranges merge exactly.
+    '''
+
+    def __init__(self, sketch=4096):
+        self.reads = 0
+        self.sketch = sketch
+        self.lengths = np.zeros(0, dtype=np.int64)
+        self.bases = np.zeros(256, dtype=np.int64)
+        self.cyclequal = np.zeros(0, dtype=np.int64)
+        self.cyclereads = np.zeros(0, dtype=np.int64)
+        self.hashes = np.zeros(0, dtype=np.uint64)
+
+    def update(self, batch, phredtable):
+        '''Add a batch of records to the accumulators'''
+        lengths = batch.lengths()
+        self.reads += len(batch)
+        self.lengths = addCounts(self.lengths, np.bincount(lengths))
+        self.bases += np.bincount(batch.buf[batch.seqIndex()], minlength=256)
+        quals, quallengths = batch.qualMatrix(phredtable)
+        self.cyclequal = addCounts(self.cyclequal, quals.sum(axis=0, dtype=np.int64))
+        #Reads covering cycle c are those longer than c
+        self.cyclereads = addCounts(self.cyclereads, np.bincount(quallengths)[::-1].cumsum()[::-1][1:])
+        self.hashes = np.unique(np.concatenate((self.hashes, batch.seqHashes())))[:self.sketch]
+        return
+
+    def merge(self, other):
+        '''Add the accumulators of another FastqStats'''
+        self.reads += other.reads
+        self.lengths = addCounts(self.lengths, other.lengths)
+        self.bases += other.bases
+        self.cyclequal = addCounts(self.cyclequal, other.cyclequal)
+        self.cyclereads = addCounts(self.cyclereads, other.cyclereads)
+        self.hashes = np.unique(np.concatenate((self.hashes, other.hashes)))[:self.sketch]
         return
 
+    def distinct(self):
+        '''Estimate the number of distinct sequences'''
+        if len(self.hashes) < self.sketch:
+            return(float(len(self.hashes)))
+        return((self.sketch - 1) / (float(self.hashes[-1]) / 2**64))
+
+    def summary(self):
+        '''Return per sample quality control metrics'''
+        counts = self.bases
+        acgt = sum(counts[ord(base)] + counts[ord(base.lower())] for base in 'ACGT')
+        gc = sum(counts[ord(base)] + counts[ord(base.lower())] for base in 'GC')
+        ncount = counts[ord('N')] + counts[ord('n')]
+        total = int(counts.sum())
+        observed = np.flatnonzero(self.lengths)
+        metrics = OrderedDict()
+        metrics['Reads'] = self.reads
+        metrics['Bases'] = total
+        metrics['MinLength'] = int(observed[0]) if len(observed) else 0
+        metrics['MaxLength'] = int(observed[-1]) if len(observed) else 0
+        metrics['MeanLength'] = total / float(self.reads) if self.reads else 0.0
+        metrics['GC'] = float(gc) / float(acgt) if acgt else 0.0
+        metrics['NRate'] = float(ncount) / total if total else 0.0
+        metrics['MeanQuality'] = float(self.cyclequal.sum()) / total if total else 0.0
+        metrics['Duplicates'] = max(0.0, 1 - self.distinct() / self.reads) if self.reads else 0.0
+        return(metrics)
+
+    def write(self, prefix):
+        '''Write summary, per cycle quality and length histogram tables'''
+        outfile = open('{0}_summary.tsv'.format(prefix), 'w')
+        outfile.write('Metric\tValue\n')
+        for metric, value in self.summary().items():
+            outfile.write('{0}\t{1}\n'.format(metric, value))
+        outfile.close()
+        outfile = open('{0}_cycles.tsv'.format(prefix), 'w')
+        outfile.write('Cycle\tReads\tMeanQuality\n')
+        for cycle, (reads, qual) in enumerate(zip(self.cyclereads, self.cyclequal)):
+            outfile.write('{0}\t{1}\t{2:.2f}\n'.format(cycle + 1, reads, qual / float(reads) if reads else 0.0))
+        outfile.close()
+        outfile = open('{0}_lengths.tsv'.format(prefix), 'w')
+        outfile.write('Length\tReads\n')
+        for length in np.flatnonzero(self.lengths):
+            outfile.write('{0}\t{1}\n'.format(length, self.lengths[length]))
+        outfile.close()
+        return
+
+
+def recordStart(fastq, offset, window=1048576):
+    '''Return the offset of the first fastq record starting at or after offset'''
+    if offset == 0:
+        return(0)
+    fqhandle = open(fastq, 'rb')
+    fqhandle.seek(offset - 1)
+    data = fqhandle.read(window)
+    fqhandle.close()
+    lines = data.split(b'\n')
+    position = offset - 1 + len(lines[0]) + 1
+    #A header is an @ line followed two lines later by a + line, with equal
+    #sequence and quality lengths; quality lines starting with @ fail this
+    for index in range(1, len(lines) - 4):
+        if lines[index][:1] == b'@' and lines[index + 2][:1] == b'+' and \
+            len(lines[index + 1].rstrip(b'\r')) == len(lines[index + 3].rstrip(b'\r')):
+            return(position)
+        position += len(lines[index]) + 1
+    return(os.path.getsize(fastq))
+
+def chunkStats(args):
+    '''Compute FastqStats over one byte range of a fastq file'''
+    fastq, phred, start, end = args
+    reader = Fastq(fastq, './', phred)
+    stats = FastqStats()
+    for batch in reader.batches(start, end):
+        stats.update(batch, reader.phredtable)
+    return(stats)
+
+def fastqStats(fastq, phred='phred33', processes=1):
+    '''Compute FastqStats with record aligned byte ranges processed in a process pool'''
+    if detectFormat(fastq) != 'plain':
+        #Compressed streams cannot be split; decompress and parse in one pass
+        return(chunkStats((fastq, phred, 0, None)))
+    size = os.path.getsize(fastq)
+    nchunks = processes * 4
+    bounds = sorted(set([recordStart(fastq, size * chunk // nchunks) for chunk in range(nchunks)] + [size]))
+    ranges = [(fastq, phred, start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+    pool = Pool(processes)
+    results = pool.map(chunkStats, ranges)
+    pool.close()
+    pool.join()
+    stats = FastqStats()
+    for chunk in results:
+        stats.merge(chunk)
+    return(stats)
 
 
 class Pileup:
     #Class to parse the pileup format and extract relevant information
-    
-    def __init__(self, pileupfile, outdir):
+    #Only the first sample of a multi sample mpileup is read; allele counts
+    #are kept in PILEUP_ALLELES order with deletion placeholders under '*'
+
+    def __init__(self, pileupfile, outdir, phred='phred33', blocksize=33554432):
         self.pileup = pileupfile
         self.outdir = outdir
+        self.blocksize = blocksize
+        self.scaffolds = list()
+        self.scafids = dict()
+        self.phredoffset = PHRED_OFFSETS[phred]
+        self.alleletable = np.full(256, len(PILEUP_ALLELES) + 1, dtype=np.int64)
+        for code, allele in enumerate(PILEUP_ALLELES):
+            self.alleletable[ord(allele)] = code
+            self.alleletable[ord(allele.lower())] = code
+        self.alleletable[ord('#')] = PILEUP_ALLELES.index('*')
+        self.alleletable[ord('.')] = len(PILEUP_ALLELES)
+        self.alleletable[ord(',')] = len(PILEUP_ALLELES)
         FORMAT = '%(asctime)-15s : %(levelname)-8s :  %(message)s'
         logging.basicConfig(format=FORMAT)
 
-    def getAlt(self, alt, qual):
-        alt = list()
-        altdir = list()
-        altevi = dict()
-        altqual = list()
-        for base in alt:
-            if base == '.' or base == ',':
-                al
-                
-        
+    def getAlt(self, alt):
+        '''Locate read start markers and indels in base columns.
+
+        Works on a single column or on many columns joined by tabs; returns
+        (start, end) ranges of alt to drop and the offset of every insertion.
+        Read end markers ($) are single characters and are left to the caller.
+        '''
+        cuts = list()
+        insertions = list()
+        position = 0
+        for token in PILEUP_TOKENS.finditer(alt):
+            if token.start() < position:
+                continue
+            position = token.end()
+            if token.group(1) is not None:
+                #Indel: skip the inserted or deleted sequence that follows the length
+                position += int(token.group(1))
+                if alt[token.start()] == 43:
+                    insertions.append(token.start())
+            cuts.append((token.start(), position))
+        return(cuts, insertions)
+
+    def scafid(self, scaf):
+        '''Return integer id of a scaffold name'''
+        if scaf not in self.scafids:
+            self.scafids[scaf] = len(self.scaffolds)
+            self.scaffolds.append(scaf)
+        return(self.scafids[scaf])
+
+    def columnRows(self, data, starts, ends):
+        '''Gather one column of every line; return its bytes and the row of each byte'''
+        lengths = ends - starts
+        rows = np.repeat(np.arange(len(starts), dtype=np.int64), lengths)
+        return(data[fieldIndex(starts, ends)], rows, lengths)
+
+    def parseInts(self, data, starts, ends):
+        '''Parse a column of decimal integers'''
+        lengths = ends - starts
+        width = int(lengths.max())
+        places = lengths[:,None] - 1 - np.arange(width)
+        valid = places >= 0
+        digits = data[np.where(valid, starts[:,None] + np.arange(width), 0)].astype(np.int64) - 48
+        return((np.where(valid, digits * 10**np.maximum(places, 0), 0)).sum(axis=1))
+
+    def scafIds(self, data, starts, ends):
+        '''Return scaffold ids of a column of names; names are only decoded where they change'''
+        lengths = ends - starts
+        width = int(lengths.max())
+        valid = np.arange(width) < lengths[:,None]
+        names = np.where(valid, data[np.where(valid, starts[:,None] + np.arange(width), 0)], 0)
+        change = np.ones(len(starts), dtype=bool)
+        change[1:] = (names[1:] != names[:-1]).any(axis=1)
+        firsts = np.flatnonzero(change)
+        ids = [self.scafid(data[starts[row]:ends[row]].tobytes().decode()) for row in firsts]
+        return(np.repeat(np.array(ids, dtype=np.int32), np.diff(np.append(firsts, len(starts)))))
+
+    def makeBatch(self, block):
+        '''Parse a block of complete pileup lines into a PileupBatch'''
+        data = np.frombuffer(block, dtype=np.uint8)
+        delims = np.flatnonzero((data == 9) | (data == 10))
+        newlines = np.flatnonzero(data[delims] == 10)
+        ncols = int(newlines[0]) + 1
+        if ncols < 6 or len(delims) % ncols != 0 or not (np.diff(newlines) == ncols).all():
+            logging.error('Malformed pileup block in {0}; expected {1} columns per line'.format(self.pileup, ncols))
+            raise ValueError('Malformed pileup block in {0}'.format(self.pileup))
+        bounds = delims.reshape(-1, ncols)
+        ends = bounds[:,:6]
+        starts = np.empty_like(ends)
+        starts[0,0] = 0
+        starts[1:,0] = bounds[:-1,-1] + 1
+        starts[:,1:] = ends[:,:-1] + 1
+        npos = len(bounds)
+        nalleles = len(PILEUP_ALLELES)
+        scaf = self.scafIds(data, starts[:,0], ends[:,0])
+        pos = self.parseInts(data, starts[:,1], ends[:,1]).astype(np.int32)
+        depth = self.parseInts(data, starts[:,3], ends[:,3]).astype(np.int32)
+        ref = np.where(ends[:,2] > starts[:,2], data[starts[:,2]], 78).astype(np.uint8)
+        ref[(ref >= 97) & (ref <= 122)] -= 32
+
+        #Clean all base columns in one pass; separators keep the rows apart
+        alts = data[fieldIndex(starts[:,4], ends[:,4] + 1)]
+        joined = alts.tobytes()
+        removed = np.zeros(len(alts) + 1, dtype=np.int8)
+        cuts, insertions = self.getAlt(joined)
+        if cuts:
+            cuts = np.array(cuts, dtype=np.int64)
+            removed[cuts[:,0]] += 1
+            removed[cuts[:,1]] -= 1
+        keep = (np.cumsum(removed[:-1]) == 0) & (alts != 36)
+        rowof = np.cumsum(alts == 9) - (alts == 9)
+        ins = np.bincount(rowof[np.array(insertions, dtype=np.int64)], minlength=npos).astype(np.int32)
+        keep &= alts != 9
+        table = np.bincount(rowof[keep] * (nalleles + 2) + self.alleletable[alts[keep]],
+            minlength=npos * (nalleles + 2)).reshape(npos, nalleles + 2)
+        #Fold reference matches into the count of the reference base
+        counts = table[:,:nalleles].astype(np.int32)
+        refcode = self.alleletable[ref]
+        known = refcode < nalleles
+        counts[np.flatnonzero(known), refcode[known]] += table[known,nalleles].astype(np.int32)
+
+        quals, rows, qualen = self.columnRows(data, starts[:,5], ends[:,5])
+        qualsum = np.bincount(rows, weights=quals, minlength=npos)
+        qual = np.zeros(npos, dtype=np.float32)
+        covered = (qualen > 0) & (depth > 0)
+        qual[covered] = qualsum[covered] / qualen[covered] - self.phredoffset
+
+        #Zero depth positions carry a * placeholder in the base column
+        counts[depth == 0] = 0
+        ins[depth == 0] = 0
+        return(PileupBatch(scaf, pos, ref, depth, counts, ins, qual))
+
     def read(self):
-        phandle = open(self.pileup)
-        Baseinfo = namedtuple("Baseinfo", ['scaf', 'pos', 'ref', 'cov', 'alt', 'altdir', 'altevi', 'altqual'])
+        '''Yield PileupBatch blocks of roughly blocksize bytes of pileup'''
+        phandle = open(self.pileup, 'rb')
         while True:
-            try:
-                lines = lines.split('\t').strip()
-                scaf = lines[0]
-                pos = lines[1]
-                ref = lines[2]
-                cov = lines[3]
-                alt = lines[4]
-                qual = lines[5]
-            
+            block = phandle.read(self.blocksize)
+            if not block:
+                break
+            block += phandle.readline()
+            if not block.endswith(b'\n'):
+                block += b'\n'
+            yield(self.makeBatch(block))
+        phandle.close()
+        return
+
+    def collect(self):
+        '''Read the whole pileup into a single PileupBatch'''
+        batches = list(self.read())
+        if not batches:
+            return(None)
+        return(PileupBatch(*[np.concatenate(field) for field in zip(*batches)]))
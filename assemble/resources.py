@@ -0,0 +1,42 @@
+import os
+import logging
+from collections import namedtuple
+
+Allocation = namedtuple('Allocation', ['threads', 'memory'])
+
+def nodeCores():
+    '''Return the number of cores this process may run on'''
+    try:
+        return(len(os.sched_getaffinity(0)))
+    except AttributeError:
+        return(os.cpu_count() or 1)
+
+def nodeMemory():
+    '''Return the physical memory of the node in GB'''
+    try:
+        return(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 1073741824)
+    except (ValueError, OSError):
+        return(4)
+
+
+class Resources:
+    '''Cores and memory available to the pipeline.
+
+    The user's thread and memory requests are capped at what the node
+    has; each stage asks for a share of that budget and receives a
+    thread count and a memory limit in GB to forward to its tool.
+    '''
+
+    def __init__(self, threads=None, memory=None):
+        self.cores = nodeCores()
+        self.ram = nodeMemory()
+        self.threads = min(int(threads), self.cores) if threads else self.cores
+        #Leave some memory to the operating system when no limit is given
+        self.memory = min(int(memory), self.ram) if memory else max(1, int(self.ram * 0.9))
+        if threads and int(threads) > self.cores:
+            logging.warning('Requested {0} threads; node has {1} cores'.format(threads, self.cores))
+        return
+
+    def allocate(self, share=1.0):
+        '''Return the Allocation for a stage using share of the budget'''
+        return(Allocation(max(1, int(self.threads * share)), max(1, int(self.memory * share))))
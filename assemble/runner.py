@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import signal
+import logging
+import timeit
+import threading
+import subprocess
+from collections import namedtuple
+
+#writebytes reach storage, writechars include pipes and the page cache
+CommandRun = namedtuple('CommandRun', ['returncode', 'wall', 'user', 'sys', 'maxrss',
+    'readbytes', 'writebytes', 'writechars'])
+#Serializes appends from stages running in parallel threads
+METRICS_LOCK = threading.Lock()
+#Live sampling of running commands; interval in seconds and memory ceiling in GB
+SAMPLER = {'interval' : None, 'memlimit' : None}
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+def configureSampler(interval=None, memlimit=None):
+    '''Sample every command every interval seconds and kill it above memlimit GB'''
+    SAMPLER['interval'] = interval
+    SAMPLER['memlimit'] = memlimit
+    return
+
+def procIo(pid):
+    '''Return the /proc/<pid>/io counters of a process, or an empty dictionary'''
+    counters = dict()
+    try:
+        for lines in open('/proc/{0}/io'.format(pid)):
+            key, value = lines.split(':')
+            counters[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return(counters)
+
+def processTree(root):
+    '''Return the pid of root and all of its descendants'''
+    children = dict()
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            stat = open('/proc/{0}/stat'.format(entry)).read()
+        except OSError:
+            continue
+        #The command name may hold spaces, so fields are counted from its closing bracket
+        ppid = int(stat[stat.rfind(')') + 2:].split()[1])
+        children.setdefault(ppid, list()).append(int(entry))
+    tree = [root]
+    for pid in tree:
+        tree.extend(children.get(pid, list()))
+    return(tree)
+
+def processSample(pid):
+    '''Return cpu ticks, rss in KB, open files and io counters of one process'''
+    stat = open('/proc/{0}/stat'.format(pid)).read()
+    fields = stat[stat.rfind(')') + 2:].split()
+    #utime, stime and the times of reaped children, so ticks do not drop when children exit
+    ticks = sum([int(value) for value in fields[11:15]])
+    rss = int(fields[21]) * PAGE_SIZE // 1024
+    try:
+        openfiles = len(os.listdir('/proc/{0}/fd'.format(pid)))
+    except OSError:
+        openfiles = 0
+    counters = procIo(pid)
+    return(ticks, rss, openfiles, counters.get('read_bytes', 0), counters.get('write_bytes', 0))
+
+
+class ResourceSampler(threading.Thread):
+    '''Poll the process tree of a running command.
+
+    Every interval seconds the CPU%, resident memory, open files and io
+    of the tree are appended to series; if resident memory exceeds
+    memlimit GB the whole tree is killed, before the OOM killer picks a
+    victim among other jobs on the node.
+    '''
+
+    def __init__(self, process, stage, interval, memlimit=None, series=None, runlogger=None):
+        threading.Thread.__init__(self, daemon=True)
+        self.process = process
+        self.stage = stage
+        self.interval = interval
+        self.memlimit = int(memlimit * 1048576) if memlimit else None
+        self.series = series
+        self.runlogger = runlogger
+        self.stopped = threading.Event()
+        self.exceeded = False
+        self.peakrss = 0
+        return
+
+    def sample(self):
+        totals = [0, 0, 0, 0, 0]
+        pids = processTree(self.process.pid)
+        for pid in pids:
+            try:
+                values = processSample(pid)
+            except (OSError, ValueError, IndexError):
+                continue
+            totals = [total + value for total, value in zip(totals, values)]
+        return(len(pids), totals)
+
+    def kill(self, rss):
+        self.exceeded = True
+        message = 'Stage {0} killed; resident memory {1}KB exceeded the {2}KB limit'.format(
+            self.stage, rss, self.memlimit)
+        logging.error(message)
+        if self.runlogger is not None:
+            self.runlogger.write('{0}\n'.format(message))
+            self.runlogger.flush()
+        for pid in reversed(processTree(self.process.pid)):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+        return
+
+    def run(self):
+        handle = open(self.series, 'w') if self.series else None
+        if handle is not None:
+            handle.write('Time\tElapsed\tProcesses\tCPUPercent\tRSSKB\tOpenFiles\tReadBytes\tWriteBytes\n')
+        lastticks = None
+        lasttime = timeit.default_timer()
+        while not self.stopped.is_set():
+            now = timeit.default_timer()
+            nprocs, (ticks, rss, openfiles, readbytes, writebytes) = self.sample()
+            if lastticks is None or now <= lasttime:
+                cpu = 0.0
+            else:
+                cpu = max(0, ticks - lastticks) * 100.0 / CLOCK_TICKS / (now - lasttime)
+            lastticks, lasttime = ticks, now
+            self.peakrss = max(self.peakrss, rss)
+            if handle is not None:
+                handle.write('{0:.0f}\t{1:.1f}\t{2}\t{3:.1f}\t{4}\t{5}\t{6}\t{7}\n'.format(time.time(),
+                    now - self.process.started, nprocs, cpu, rss, openfiles, readbytes, writebytes))
+                handle.flush()
+            if self.memlimit and rss > self.memlimit:
+                self.kill(rss)
+                break
+            self.stopped.wait(self.interval)
+        if handle is not None:
+            handle.close()
+        return
+
+
+def startCommand(cmd, stdin=None, stdout=None, stderr=None, shell=False, cwd=None, stage=None, series=None):
+    '''Start a command to be reaped by waitCommand, sampling it when the sampler is configured'''
+    process = subprocess.Popen(cmd, stdin=stdin, stdout=stdout, stderr=stderr, shell=shell, cwd=cwd)
+    process.started = timeit.default_timer()
+    process.startedat = time.time()
+    process.sampler = None
+    if SAMPLER['interval'] or SAMPLER['memlimit']:
+        process.sampler = ResourceSampler(process, stage, SAMPLER['interval'] or 5, SAMPLER['memlimit'],
+            series if SAMPLER['interval'] else None, stderr if hasattr(stderr, 'write') else None)
+        process.sampler.start()
+    return(process)
+
+def seriesPath(metrics, stage, cmd):
+    '''Return the path of the time series file for a command, next to the metrics file'''
+    if metrics is None:
+        return(None)
+    name = stage.replace(' ', '_') if stage else os.path.basename(str(cmd).split()[0])
+    return('{0}/{1}_{2}.samples.tsv'.format(os.path.dirname(os.path.abspath(metrics)), name,
+        int(time.time() * 1000)))
+
+def hasExited(process):
+    '''Return True once a process has exited, without reaping it'''
+    if process.returncode is not None:
+        return(True)
+    return(os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None)
+
+def waitCommand(process, stage, metrics=None):
+    '''Reap a command started by startCommand and account for its resource use.
+
+    The exited process is left unreaped until its /proc io counters are
+    read; wait4 then returns CPU time and peak RSS for it and its reaped
+    descendants. A json line is appended to metrics when given.
+    '''
+    if process.returncode is None:
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        counters = procIo(process.pid)
+        sampler = getattr(process, 'sampler', None)
+        if sampler is not None:
+            sampler.stopped.set()
+            sampler.join()
+        pid, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        run = CommandRun(process.returncode, timeit.default_timer() - process.started,
+            usage.ru_utime, usage.ru_stime, usage.ru_maxrss, counters.get('read_bytes', 0),
+            counters.get('write_bytes', 0), counters.get('wchar', 0))
+    else:
+        #Already reaped elsewhere; only the exit status and wall time are known
+        counters = dict()
+        run = CommandRun(process.returncode, timeit.default_timer() - process.started,
+            0.0, 0.0, 0, 0, 0, 0)
+    if metrics is not None:
+        cmd = process.args if isinstance(process.args, str) else ' '.join(process.args)
+        record = {'stage' : stage, 'command' : cmd, 'pid' : process.pid,
+            'start' : process.startedat, 'wall' : round(run.wall, 3), 'user' : round(run.user, 3),
+            'sys' : round(run.sys, 3), 'maxrss_kb' : run.maxrss, 'read_bytes' : run.readbytes,
+            'write_bytes' : run.writebytes, 'rchar' : counters.get('rchar', 0),
+            'wchar' : run.writechars, 'returncode' : run.returncode}
+        sampler = getattr(process, 'sampler', None)
+        if sampler is not None:
+            record['sampled_peak_rss_kb'] = sampler.peakrss
+            record['memory_exceeded'] = sampler.exceeded
+        with METRICS_LOCK:
+            handle = open(metrics, 'a')
+            handle.write('{0}\n'.format(json.dumps(record)))
+            handle.close()
+    return(run)
+
+def runCommand(cmd, stage, runlogger, metrics=None, shell=False, cwd=None):
+    '''Run a command with output to runlogger; return its CommandRun'''
+    process = startCommand(cmd, stdout=runlogger, stderr=runlogger, shell=shell, cwd=cwd, stage=stage,
+        series=seriesPath(metrics, stage, cmd))
+    return(waitCommand(process, stage, metrics))
@@ -0,0 +1,133 @@
+import logging
+import timeit
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Scheduler:
+    '''Run pipeline stages as a dependency graph under a CPU and memory budget.
+
+    Each stage is a function taking its Allocation and returning an exit
+    code. A stage starts once all of its dependencies have succeeded and
+    its share of threads and memory is free; stages depending on a failed
+    stage are skipped, while unrelated branches keep running. Stages must
+    be added after their dependencies, so the graph cannot have cycles.
+    With a Checkpoint store, stages whose inputs, parameters, tools and
+    upstream stages are unchanged since their last success are skipped.
+    Ready stages are started fairly across groups, such as samples, so
+    one group cannot hold the whole budget while others wait.
+    '''
+
+    def __init__(self, resources, checkpoint=None):
+        self.resources = resources
+        self.checkpoint = checkpoint
+        self.stages = OrderedDict()
+        return
+
+    def add(self, name, function, depends=(), share=1.0, inputs=(), params=None, tools=(), outputs=(),
+        group=None):
+        '''Add a stage using share of the budget, to run after the depends stages
+
+        tools are paths, asked for their version with --version, or
+        (path, version arguments) pairs; arguments of None version a tool
+        by the signature of its executable instead of running it.
+        '''
+        for depend in depends:
+            if depend not in self.stages:
+                raise ValueError('Stage {0} depends on unknown stage {1}'.format(name, depend))
+        self.stages[name] = {'function' : function, 'depends' : list(depends),
+            'allocation' : self.resources.allocate(share), 'status' : 'pending',
+            'returncode' : None, 'runtime' : None, 'inputs' : list(inputs), 'params' : params,
+            'tools' : list(tools), 'outputs' : list(outputs), 'key' : None, 'group' : group}
+        return
+
+    def skipBlocked(self):
+        '''Mark pending stages downstream of a failure as skipped'''
+        for name, stage in self.stages.items():
+            if stage['status'] != 'pending':
+                continue
+            blocked = [depend for depend in stage['depends']
+                if self.stages[depend]['status'] in ('failed', 'skipped')]
+            if blocked:
+                stage['status'] = 'skipped'
+                logging.warning('Skipping {0}; upstream stage failed : {1}'.format(name, ', '.join(blocked)))
+        return
+
+    def runStage(self, name):
+        stage = self.stages[name]
+        start = timeit.default_timer()
+        try:
+            returncode = stage['function'](stage['allocation'])
+        except Exception as error:
+            logging.error('Stage {0} raised an error : {1}'.format(name, error))
+            returncode = -1
+        stage['runtime'] = timeit.default_timer() - start
+        return(returncode)
+
+    def ready(self):
+        '''Return pending stages whose dependencies have all completed'''
+        return([name for name, stage in self.stages.items() if stage['status'] == 'pending' and
+            all([self.stages[depend]['status'] == 'done' for depend in stage['depends']])])
+
+    def upToDate(self, name):
+        '''Key a stage against the checkpoint store; return True if it can be skipped'''
+        stage = self.stages[name]
+        if self.checkpoint is None:
+            return(False)
+        stage['key'] = self.checkpoint.key(name, stage['inputs'], stage['params'], stage['tools'],
+            [self.stages[depend]['key'] for depend in stage['depends']])
+        if self.checkpoint.done(name, stage['key'], stage['outputs']):
+            stage['status'] = 'done'
+            logging.info('Stage {0} is up to date; Skipping'.format(name))
+            return(True)
+        return(False)
+
+    def run(self):
+        '''Run all stages; return a dictionary of stage name to status'''
+        freethreads = self.resources.threads
+        freememory = self.resources.memory
+        running = dict()
+        active = dict()
+        order = dict([(name, index) for index, name in enumerate(self.stages)])
+        executor = ThreadPoolExecutor(max(1, len(self.stages)))
+        while True:
+            self.skipBlocked()
+            candidates = self.ready()
+            while candidates:
+                #Fair share: the group with the fewest running stages goes first
+                name = min(candidates, key=lambda name: (active.get(self.stages[name]['group'], 0), order[name]))
+                candidates.remove(name)
+                stage = self.stages[name]
+                if self.upToDate(name):
+                    candidates = self.ready()
+                    continue
+                threads, memory = stage['allocation']
+                #A stage larger than the whole budget still runs, on its own
+                if running and (threads > freethreads or memory > freememory):
+                    continue
+                freethreads -= threads
+                freememory -= memory
+                active[stage['group']] = active.get(stage['group'], 0) + 1
+                stage['status'] = 'running'
+                logging.info('Starting stage {0} with {1} threads and {2}GB memory'.format(name, threads, memory))
+                running[executor.submit(self.runStage, name)] = name
+            if not running:
+                break
+            finished, pending = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                stage = self.stages[name]
+                stage['returncode'] = future.result()
+                freethreads += stage['allocation'].threads
+                freememory += stage['allocation'].memory
+                active[stage['group']] -= 1
+                if stage['returncode'] == 0:
+                    stage['status'] = 'done'
+                    if self.checkpoint is not None:
+                        self.checkpoint.record(name, stage['key'], stage['outputs'])
+                    logging.info('Stage {0} completed successfully; Runtime : {1:.2f}'.format(name, stage['runtime']))
+                else:
+                    stage['status'] = 'failed'
+                    logging.error('Stage {0} failed with returncode {1}'.format(name, stage['returncode']))
+        executor.shutdown()
+        return(OrderedDict([(name, stage['status']) for name, stage in self.stages.items()]))
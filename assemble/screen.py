@@ -0,0 +1,209 @@
+import os
+import json
+import timeit
+import logging
+import collections
+import numpy as np
+from multiprocessing import Pool
+from collections import OrderedDict
+from assemble.fasta import IndexedFasta
+from assemble.readers import Fastq, PairedFastq, parseBatch, splitmix
+from assemble.trimmer import BASE_CODES, packKmers
+
+#Bases of reference sequence packed into k-mers at a time while building
+BUILD_WINDOW = 1048576
+#Screen shared with pool workers, set once per worker by initWorker
+SCREEN_WORKER = {'screen' : None}
+
+
+def reverseComplementKmers(values, k):
+    '''Return the reverse complement of 2 bit packed k-mers'''
+    values = ~values
+    for shift, mask in ((2, 0x3333333333333333), (4, 0x0f0f0f0f0f0f0f0f), (8, 0x00ff00ff00ff00ff),
+        (16, 0x0000ffff0000ffff)):
+        shift = np.uint64(shift)
+        mask = np.uint64(mask)
+        values = ((values >> shift) & mask) | ((values & mask) << shift)
+    values = (values >> np.uint64(32)) | (values << np.uint64(32))
+    return(values >> np.uint64(64 - 2 * k))
+
+def canonicalKmers(codes, k):
+    '''Return the canonical k-mers of a (reads x cycles) code matrix and their validity'''
+    values, valid = packKmers(codes, k)
+    return(np.minimum(values, reverseComplementKmers(values, k)), valid)
+
+def bloomHashes(values):
+    '''Return the two hashes of every k-mer; filter probes are first + index * second'''
+    first = splitmix(values)
+    second = splitmix(values ^ np.uint64(0x5bd1e9955bd1e995)) | np.uint64(1)
+    return(first, second)
+
+def bloomPositions(first, second, index, nwords):
+    '''Return the word and bit of filter probe index of k-mers with hashes first and second'''
+    value = first + np.uint64(index) * second
+    #High bits pick the word by multiply and shift, so the filter need not be a power of two
+    return(((value >> np.uint64(32)) * np.uint64(nwords)) >> np.uint64(32), value & np.uint64(63))
+
+def initWorker(screen):
+    SCREEN_WORKER['screen'] = screen
+    return
+
+def screenWorker(raws):
+    '''Screen one pair of raw fastq blocks in a pool worker'''
+    screen = SCREEN_WORKER['screen']
+    return(screen.screenPair(parseBatch(screen.reader, raws[0]), parseBatch(screen.reader, raws[1])))
+
+
+class KmerScreen:
+    '''Bloom filter of the canonical k-mers of a contaminant reference.
+
+    Read pairs sharing fewer than minhits k-mers with the reference are
+    clean; only the rest need to be aligned. At the default of 1 every
+    pair sharing a k-mer is aligned; higher values send fewer clean pairs
+    to the aligner but pass pairs with only a few contaminant k-mers as
+    clean. The filter is sized for a false positive rate of fpr per k-mer,
+    taking the reference length as the number of k-mers, with the
+    matching number of hashes; the default takes about 2.4 GB per
+    gigabase of reference and sends about one in forty clean 150 bp pairs
+    to the aligner. It is built
+    once into the index cache entry of the reference and memory mapped
+    afterwards, by pool workers too, wherever the reference lives.
+    False positives only send extra pairs to the aligner.
+    '''
+
+    def __init__(self, reference, indexcache, k=25, fpr=0.0001, minhits=1, processes=1):
+        self.reference = os.path.abspath(reference)
+        self.indexcache = indexcache
+        self.k = k
+        self.fpr = fpr
+        self.minhits = minhits
+        self.processes = processes
+        self.kind = 'kmers.k{0}.fpr{1:g}'.format(k, fpr)
+        self.entry = None
+        self.hashes = None
+        self.words = None
+        self.reader = Fastq(None, None, 'phred33')
+        return
+
+    def __getstate__(self):
+        #Workers memory map the cached filter instead of receiving a copy
+        state = self.__dict__.copy()
+        state['words'] = None
+        state['indexcache'] = None
+        return(state)
+
+    def load(self):
+        '''Return the filter, building it into the index cache the first time'''
+        if self.words is not None:
+            return(self.words)
+        if self.entry is None:
+            self.entry = self.indexcache.artifact(self.reference, self.kind, self.build)
+        self.hashes = json.load(open('{0}/bloom.json'.format(self.entry)))['hashes']
+        self.words = np.asarray(np.load('{0}/bloom.npy'.format(self.entry), mmap_mode='r'))
+        return(self.words)
+
+    def size(self, total):
+        '''Return the filter words and hashes giving fpr for total k-mers'''
+        bits = -total * np.log(self.fpr) / np.log(2) ** 2
+        nwords = max(1, int(np.ceil(bits / 64)))
+        hashes = max(1, int(round(nwords * 64 / float(total) * np.log(2))))
+        return(nwords, hashes)
+
+    def build(self, directory):
+        '''Insert every canonical k-mer of the reference into a new filter written to directory'''
+        start = timeit.default_timer()
+        fasta = IndexedFasta(self.reference)
+        nwords, hashes = self.size(max(1, int(fasta.lengths.sum())))
+        words = np.zeros(nwords, dtype=np.uint64)
+        data = np.frombuffer(fasta.map, dtype=np.uint8) if len(fasta.map) else np.zeros(0, dtype=np.uint8)
+        for fid in range(len(fasta)):
+            region = data[fasta.offsets[fid]:fasta.ends[fid]]
+            codes = BASE_CODES[region[(region != 10) & (region != 13)]]
+            for offset in range(0, max(1, len(codes) - self.k + 1), BUILD_WINDOW):
+                window = codes[offset:offset + BUILD_WINDOW + self.k - 1]
+                values, valid = canonicalKmers(window[None,:], self.k)
+                first, second = bloomHashes(values[valid])
+                probes = np.concatenate([(word << np.uint64(6)) | bit for word, bit in
+                    [bloomPositions(first, second, index, nwords) for index in range(hashes)]])
+                if len(probes) == 0:
+                    continue
+                #Probes sorted by word are folded into one mask per word and set with a single |=
+                probes.sort()
+                probewords = probes >> np.uint64(6)
+                bounds = np.flatnonzero(np.concatenate(([True], probewords[1:] != probewords[:-1])))
+                masks = np.bitwise_or.reduceat(np.uint64(1) << (probes & np.uint64(63)), bounds)
+                words[probewords[bounds]] |= masks
+        #Views of the map must be released before it can be closed
+        data = region = None
+        fasta.close()
+        np.save('{0}/bloom.npy'.format(directory), words)
+        json.dump({'k' : self.k, 'fpr' : self.fpr, 'words' : nwords, 'hashes' : hashes},
+            open('{0}/bloom.json'.format(directory), 'w'))
+        logging.info('Built k-mer filter of {0} bits and {1} hashes for {2}; Runtime : {3:.2f}'.format(
+            nwords * 64, hashes, self.reference, timeit.default_timer() - start))
+        return
+
+    def hits(self, batch):
+        '''Return the number of k-mers of every read found in the filter'''
+        words = self.load()
+        seqs, lengths = batch.fieldMatrix(1)
+        values, valid = canonicalKmers(BASE_CODES[seqs], self.k)
+        reads, columns = np.nonzero(valid)
+        first, second = bloomHashes(values[reads, columns])
+        #Only k-mers passing every earlier hash are tested against the next
+        for index in range(self.hashes):
+            word, bit = bloomPositions(first, second, index, len(words))
+            present = ((words[word] >> bit) & np.uint64(1)) == 1
+            first = first[present]
+            second = second[present]
+            reads = reads[present]
+        return(np.bincount(reads, minlength=len(batch)))
+
+    def screenPair(self, batch1, batch2):
+        '''Split aligned batches of mates into clean and candidate pairs; return their fastq text'''
+        candidate = (self.hits(batch1) + self.hits(batch2)) >= self.minhits
+        clean = ~candidate
+        return(batch1.take(clean).raw(), batch2.take(clean).raw(), batch1.take(candidate).raw(),
+            batch2.take(candidate).raw(), int(candidate.sum()))
+
+    def screen(self, read1, read2, clean1, clean2, candidate1, candidate2, outdir, threads=1):
+        '''Write clean pairs and candidate pairs of paired fastq files; return summary metrics'''
+        start = timeit.default_timer()
+        #Built or found once here, so workers only map the cached file
+        self.load()
+        with self.indexcache.hold(self.entry):
+            pairs = PairedFastq(read1, read2, outdir, 'phred33', threads=threads)
+            handles = [open(outfile, 'wb') for outfile in (clean1, clean2, candidate1, candidate2)]
+            counts = [0, 0]
+
+            def write(result, size):
+                for handle, data in zip(handles, result[:4]):
+                    handle.write(data)
+                counts[0] += size
+                counts[1] += result[4]
+
+            if self.processes > 1:
+                pool = Pool(self.processes, initializer=initWorker, initargs=(self,))
+                pending = collections.deque()
+                for batch1, batch2 in pairs.batches():
+                    pending.append((pool.apply_async(screenWorker, ((batch1.raw(), batch2.raw()),)), len(batch1)))
+                    if len(pending) >= self.processes * 2:
+                        result, size = pending.popleft()
+                        write(result.get(), size)
+                while pending:
+                    result, size = pending.popleft()
+                    write(result.get(), size)
+                pool.close()
+                pool.join()
+            else:
+                for batch1, batch2 in pairs.batches():
+                    write(self.screenPair(batch1, batch2), len(batch1))
+            for handle in handles:
+                handle.close()
+        metrics = OrderedDict()
+        metrics['Pairs'] = counts[0]
+        metrics['CandidatePairs'] = counts[1]
+        metrics['CleanPairs'] = counts[0] - counts[1]
+        metrics['Runtime'] = timeit.default_timer() - start
+        logging.info('Screened {0} pairs; {1} sent to alignment'.format(counts[0], counts[1]))
+        return(metrics)
@@ -16,18 +16,22 @@ from Bio import SeqIO
 from itertools import repeat
 from multiprocessing import Pool
 from collections import defaultdict
+from assemble.runner import runCommand
 
 class Sga:
-    def __init__(self, sga_path, read1, read2, outdir, name, correct, overlap, assemble, threads):
+    def __init__(self, sga_path, read1, read2, outdir, name, correct, overlap, assemble, threads, pemode=1):
         #Initialize values and create output directories
         self.sga_path = sga_path
         self.read1 = os.path.abspath(read1)
         self.read2 = os.path.abspath(read2)
         self.outdir = '{0}/sga'.format(os.path.abspath(outdir))
         self.threads = threads
+        #Pairing mode for preprocess; 1 for two files of paired reads
+        self.pemode = pemode
         self.name = name
         self.log = '{0}/sga.log'.format(self.outdir)
         self.runtime = '{0}/sga_runtime.log'.format(self.outdir)
+        self.metrics = '{0}/stage_metrics.jsonl'.format(os.path.abspath(outdir))
         self.preprocess = '{0}/{1}.fastq'.format(self.outdir, self.name)
         self.index = '{0}/{1}'.format(self.outdir, self.name)
         self.ckmer = correct
@@ -52,17 +56,13 @@ class Sga:
 
         #Prepare preprocess commands
         logger.write('SGA pipeline started\n')
-        ppcmd = [self.sga_path, 'preprocess', '-p', '1', self.read1, self.read2,
+        ppcmd = [self.sga_path, 'preprocess', '-p', str(self.pemode), self.read1, self.read2,
             '-o', self.preprocess]
         logger.write('Running SGA preprocess with the following command\n')
         logger.write('{0}\n'.format(' '.join(ppcmd)))
         
         #Run SGA pre processing
-        pprun = subprocess.Popen(ppcmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-
-        #Capture stdout and stderr
-        pplog = pprun.communicate()
+        pprun = runCommand(ppcmd, 'sga preprocess', runlogger, self.metrics)
         elapsed = timeit.default_timer() - start
         runlogger.write('\nSGA preprocessing runtime logs:\n')
         runlogger.flush()
@@ -89,20 +89,16 @@ class Sga:
         #Prepare index commands
         logger.write('SGA index started\n')
         if os.path.exists(self.correct):
-            icmd = [self.sga_path, 'index', '-t', self.threads, '-a', 'ropebwt', '-p',
+            icmd = [self.sga_path, 'index', '-t', str(self.threads), '-a', 'ropebwt', '-p',
                 self.index, self.correct]
         else:
-            icmd = [self.sga_path, 'index', '-t', self.threads, '-a', 'ropebwt', '-p',
+            icmd = [self.sga_path, 'index', '-t', str(self.threads), '-a', 'ropebwt', '-p',
                 self.index, self.preprocess]
         logger.write('Running SGA index with the following command\n')
         logger.write('{0}\n'.format(' '.join(icmd)))
 
         #Run SGA index
-        irun = subprocess.Popen(icmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-
-        #Capture stdout and stderr
-        ilog = irun.communicate()
+        irun = runCommand(icmd, 'sga index', runlogger, self.metrics)
         elapsed = timeit.default_timer() - start
         runlogger.write('\nSGA index runtime logs:\n')
         runlogger.flush()
@@ -127,16 +123,13 @@ class Sga:
 
         #Prepare correction commands
         logger.write('SGA correct started\n')
-        ccmd = [self.sga_path, 'correct', '-t', self.threads, '-k', str(self.ckmer), '--learn',
+        ccmd = [self.sga_path, 'correct', '-t', str(self.threads), '-k', str(self.ckmer), '--learn',
             '-p', self.index, '-o', self.correct, self.preprocess]
         logger.write('Running SGA correct with the following command\n')
         logger.write('{0}\n'.format(' '.join(ccmd)))
 
         #Run SGA correct
-        crun = subprocess.Popen(ccmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-        #Capture stdout and stderr
-        clog = crun.communicate()
+        crun = runCommand(ccmd, 'sga correct', runlogger, self.metrics)
         elapsed = timeit.default_timer() - start
         runlogger.write('\nSGA correct runtime logs:\n')
         runlogger.flush()
@@ -161,16 +154,13 @@ class Sga:
 
         #Prepare filter commands
         logger.write('SGA filter started\n')
-        fcmd = [self.sga_path, 'filter', '-x', '2', '-t', self.threads, '-p', self.index,
+        fcmd = [self.sga_path, 'filter', '-x', '2', '-t', str(self.threads), '-p', self.index,
                 '-o', self.filter, self.correct]
         logger.write('Running SGA filter with the following command\n')
         logger.write('{0}\n'.format(' '.join(fcmd)))
 
         #Run SGA filter
-        frun = subprocess.Popen(fcmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-        #Capture stdout and stderr
-        flog = frun.communicate()
+        frun = runCommand(fcmd, 'sga filter', runlogger, self.metrics)
         elapsed = timeit.default_timer() - start
         runlogger.write('\nSGA filter runtime logs:\n')
         runlogger.flush()
@@ -195,16 +185,13 @@ class Sga:
 
         #Prepare overlap commands
         logger.write('SGA overlap started\n')
-        ocmd = [self.sga_path, 'overlap', '-m', str(self.okmer), '-t', self.threads, '-o',
+        ocmd = [self.sga_path, 'overlap', '-m', str(self.okmer), '-t', str(self.threads), '-o',
                     self.overlap, '-p', self.index, self.filter]
         logger.write('Running SGA overlap with the following command\n')
         logger.write('{0}\n'.format(' '.join(ocmd)))
 
         #Run SGA overlap
-        orun = subprocess.Popen(ocmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-        #Capture stdout and stderr
-        olog = orun.communicate()
+        orun = runCommand(ocmd, 'sga overlap', runlogger, self.metrics)
         elapsed = timeit.default_timer() - start
         runlogger.write('\nSGA overlap runtime logs:\n')
         runlogger.flush()
@@ -229,16 +216,13 @@ class Sga:
 
         #Prepare assemble commands
         logger.write('SGA assemble started\n')
-        acmd = [self.sga_path, 'assemble', '-t', self.threads, '-m', str(self.akmer), 
+        acmd = [self.sga_path, 'assemble', '-t', str(self.threads), '-m', str(self.akmer), 
                 '-o', self.assemble, self.overlap]
         logger.write('Running SGA assemble with the following command\n')
         logger.write('{0}\n'.format(' '.join(acmd)))
 
         #Run SGA assemble
-        arun = subprocess.Popen(acmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-        #Capture stdout and stderr
-        alog = arun.communicate()
+        arun = runCommand(acmd, 'sga assemble', runlogger, self.metrics)
         elapsed = timeit.default_timer() - start
         runlogger.write('\nSGA assemble runtime logs:\n')
         runlogger.flush()
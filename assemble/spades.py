@@ -16,18 +16,21 @@ from Bio import SeqIO
 from itertools import repeat
 from multiprocessing import Pool
 from collections import defaultdict
+from assemble.runner import runCommand
 
 class Spades:
-    def __init__(self, spades_path, read1, read2, outdir, kmers, threads ):
+    def __init__(self, spades_path, read1, read2, outdir, kmers, threads, memory=None):
         #Initialize values and create output directories
         self.spades_path = spades_path
         self.read1 = os.path.abspath(read1)
         self.read2 = os.path.abspath(read2)
         self.outdir = '{0}/spades'.format(os.path.abspath(outdir))
         self.threads = threads
+        self.memory = memory
         self.kmers = kmers
         self.log = '{0}/spades.log'.format(self.outdir)
         self.runtime = '{0}/spades_runtime.log'.format(self.outdir)
+        self.metrics = '{0}/stage_metrics.jsonl'.format(os.path.abspath(outdir))
         self.result = '{0}/scaffolds.fasta'.format(self.outdir)
         if not os.path.exists(self.outdir):
             os.mkdir(self.outdir)
@@ -44,16 +47,15 @@ class Spades:
         #Prepare run commands
         logger.write('SPAdes  started\n')
         scmd = [self.spades_path, '--pe1-1', self.read1, '--pe1-2', self.read2,
-            '-o', self.outdir, '--careful', '-k', self.kmers]
+            '-o', self.outdir, '--careful', '-k', self.kmers, '-t', str(self.threads)]
+        if self.memory:
+            scmd += ['-m', str(self.memory)]
         logger.write('Running SPAdes with the following command\n')
         logger.write('{0}\n'.format(' '.join(scmd)))
 
 
         #Running Spades
-        srun = subprocess.Popen(scmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-        #Capture stdout and stderr
-        slog = srun.communicate()
+        srun = runCommand(scmd, 'spades', runlogger, self.metrics)
         elapsed = timeit.default_timer() - start
         runlogger.flush()
         runlogger.close()
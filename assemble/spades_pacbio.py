@@ -16,9 +16,10 @@ from Bio import SeqIO
 from itertools import repeat
 from multiprocessing import Pool
 from collections import defaultdict
+from assemble.runner import runCommand
 
 class SpadesHybrid:
-    def __init__(self, spades_path, read1, read2, pacbio, outdir, kmers, threads ):
+    def __init__(self, spades_path, read1, read2, pacbio, outdir, kmers, threads, memory=None):
         #Initialize values and create output directories
         self.spades_path = spades_path
         self.read1 = os.path.abspath(read1)
@@ -26,9 +27,11 @@ class SpadesHybrid:
         self.pacbio = os.path.abspath(pacbio)
         self.outdir = '{0}/spadesHybrid'.format(os.path.abspath(outdir))
         self.threads = threads
+        self.memory = memory
         self.kmers = kmers
         self.log = '{0}/spades.log'.format(self.outdir)
         self.runtime = '{0}/spades_runtime.log'.format(self.outdir)
+        self.metrics = '{0}/stage_metrics.jsonl'.format(os.path.abspath(outdir))
         self.result = '{0}/scaffolds.fasta'.format(self.outdir)
         if not os.path.exists(self.outdir):
             os.mkdir(self.outdir)
@@ -44,18 +47,17 @@ class SpadesHybrid:
 
         #Prepare run commands
         logger.write('SPAdes  started\n')
-        scmd = [spades_path, '--pe1-1', self.read1, '--pe1-2', self.read2,
+        scmd = [self.spades_path, '--pe1-1', self.read1, '--pe1-2', self.read2,
             '--pacbio-reads', self.pacbio, '-o', self.outdir, '--careful',
-            '-k', self.kmers]
+            '-k', self.kmers, '-t', str(self.threads)]
+        if self.memory:
+            scmd += ['-m', str(self.memory)]
         logger.write('Running SPAdes with the following command\n')
         logger.write('{0}\n'.format(' '.join(scmd)))
 
 
         #Running Spades
-        srun = subprocess.Popen(scmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-        #Capture stdout and stderr
-        slog = srun.communicate()
+        srun = runCommand(scmd, 'spades hybrid', runlogger, self.metrics)
         elapsed = timeit.default_timer() - start
         runlogger.flush()
         runlogger.close()
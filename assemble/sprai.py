@@ -16,6 +16,7 @@ from Bio import SeqIO
 from itertools import repeat
 from multiprocessing import Pool
 from collections import defaultdict
+from assemble.runner import runCommand
 
 class Sprai:
     def __init__(self, sprai_path, celera_path, blast_path,  pacbio, outdir, threads, egs, depth):
@@ -28,9 +29,10 @@ class Sprai:
         self.threads = threads
         self.log = '{0}/sprai.log'.format(self.outdir)
         self.runtime = '{0}/sprai_runtime.log'.format(self.outdir)
+        self.metrics = '{0}/stage_metrics.jsonl'.format(os.path.abspath(outdir))
         self.result = '{0}/results/CA/9-terminator/*.scf.fasta'.format(self.outdir)
-        self.ec = '{0}/ec.specs'
-        self.pbasm = '{0}/pbasm.specs'
+        self.ec = '{0}/ec.specs'.format(self.outdir)
+        self.pbasm = '{0}/pbasm.specs'.format(self.outdir)
         self.egs = egs
         self.depth = depth
         if not os.path.exists(self.outdir):
@@ -46,7 +48,7 @@ class Sprai:
         echandle.write('#Input file for sprai pipeline\n')
         echandle.write('input_for_database {0}\n'.format(self.pacbio))
         echandle.write('#Estimated genomes size\n')
-        echandle.write('estimated_genome_size {0}\n'.format(egs))
+        echandle.write('estimated_genome_size {0}\n'.format(self.egs))
         echandle.write('#Estimated coverage\n')
         echandle.write('estimated_depth 0\n')
         echandle.write('#Celera assembler path\n')
@@ -177,21 +179,24 @@ class Sprai:
         logger.write('{0}\n'.format(' '.join(scmd)))
 
 
-        #Running Spades
-        srun = subprocess.Popen(scmd, stdout=runlogger,
-            stderr=runlogger, shell=False)
-        #Capture stdout and stderr
-        slog = srun.communicate()
+        #Running Sprai; it writes its result directories to the working directory
+        srun = runCommand(scmd, 'sprai', runlogger, self.metrics, cwd=self.outdir)
         elapsed = timeit.default_timer() - start
         runlogger.flush()
         runlogger.close()
-        self.result = glob.glob('{0}/result*/CA/9-terminator/*.scf.fasta'.format(self.outdir))[0]
         if srun.returncode != 0 :
             logger.write('Sprai failed with exit code : {0}; Check runtime log for details.\n'.format(srun.returncode))
             logger.close()
             return(srun.returncode)
+        #Sprai names its result directory by date, so scaffolds are only found once it has run
+        results = glob.glob('{0}/result*/CA/9-terminator/*.scf.fasta'.format(self.outdir))
+        if not results:
+            logger.write('Sprai completed without writing scaffolds; Check runtime log for details.\n')
+            logger.close()
+            return(1)
         else:
+            self.result = results[0]
             logger.write('Sprai completed successfully; Runtime : {0}\n'.format(elapsed))
-            logger.write('Contigs can be found in : {0}'.format(result))
+            logger.write('Contigs can be found in : {0}'.format(self.result))
             logger.close()
             return(srun.returncode)
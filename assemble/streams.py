@@ -0,0 +1,269 @@
+import os
+import sys
+import zlib
+import gzip
+import queue
+import shutil
+import struct
+import logging
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+BGZF_BLOCKS = 64
+
+def detectFormat(path):
+    '''Return plain, gzip, bgzf or zstd based on the magic bytes of the file'''
+    handle = open(path, 'rb')
+    head = handle.read(18)
+    handle.close()
+    if head[:4] == ZSTD_MAGIC:
+        return('zstd')
+    if head[:2] == GZIP_MAGIC:
+        #BGZF blocks are gzip members with a BC extra subfield holding the block size
+        if len(head) == 18 and head[3] & 4 and head[12:14] == b'BC':
+            return('bgzf')
+        return('gzip')
+    return('plain')
+
+
+class BlockReader:
+    '''File like reader over an ordered queue of decompressed chunks'''
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.pending = b''
+        self.offset = 0
+        self.eof = False
+
+    def read(self, size=-1):
+        parts = list()
+        wanted = size
+        while wanted != 0 and not self.eof:
+            if self.offset >= len(self.pending):
+                chunk = self.chunks.get()
+                if chunk is None:
+                    self.eof = True
+                    break
+                if isinstance(chunk, Exception):
+                    self.eof = True
+                    raise chunk
+                self.pending = chunk
+                self.offset = 0
+            if wanted < 0:
+                part = self.pending[self.offset:]
+            else:
+                part = self.pending[self.offset:self.offset + wanted]
+                wanted -= len(part)
+            self.offset += len(part)
+            parts.append(part)
+        return(b''.join(parts))
+
+    def close(self):
+        self.eof = True
+        return
+
+
+class InputStream:
+    '''Binary stream over plain, gzip, bgzf or zstd input.
+
+    Decompression runs beside the consumer: BGZF blocks are inflated in
+    parallel by a thread pool (zlib releases the GIL), gzip and zstd are
+    handed to pigz/zstd when available and to a background thread otherwise.
+    '''
+
+    def __init__(self, path, threads=1, depth=16):
+        self.path = path
+        self.threads = max(1, int(threads))
+        self.format = detectFormat(path)
+        self.process = None
+        self.thread = None
+        self.chunks = queue.Queue(depth)
+        self.stopped = threading.Event()
+        if self.format == 'plain':
+            self.handle = open(path, 'rb')
+        elif self.format == 'bgzf':
+            self.handle = BlockReader(self.chunks)
+            self.startThread(self.inflateBgzf)
+        elif self.format == 'gzip' and shutil.which('pigz'):
+            self.startProcess(['pigz', '-dc', '-p', str(self.threads), path])
+        elif self.format == 'zstd' and shutil.which('zstd'):
+            self.startProcess(['zstd', '-dcq', '-T{0}'.format(self.threads), path])
+        elif self.format == 'gzip':
+            self.handle = BlockReader(self.chunks)
+            self.startThread(self.inflateGzip)
+        else:
+            self.handle = BlockReader(self.chunks)
+            self.startThread(self.inflateZstd)
+        return
+
+    def startProcess(self, cmd):
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=1048576)
+        self.handle = self.process.stdout
+        return
+
+    def startThread(self, target):
+        self.thread = threading.Thread(target=self.feed, args=(target,), daemon=True)
+        self.thread.start()
+        return
+
+    def put(self, chunk):
+        '''Queue a chunk; return False once the consumer has gone away'''
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(chunk, timeout=0.5)
+                return(True)
+            except queue.Full:
+                continue
+        return(False)
+
+    def feed(self, target):
+        try:
+            for chunk in target():
+                if not self.put(chunk):
+                    return
+        except Exception as error:
+            logging.error('Decompression failed for {0} : {1}'.format(self.path, error))
+            self.put(error)
+            return
+        self.put(None)
+        return
+
+    def bgzfBlocks(self, handle):
+        '''Yield raw BGZF blocks'''
+        while True:
+            header = handle.read(18)
+            if len(header) == 0:
+                return
+            if len(header) < 18 or header[:2] != GZIP_MAGIC or header[12:14] != b'BC':
+                raise IOError('Invalid BGZF block header in {0}'.format(self.path))
+            bsize = struct.unpack('<H', header[16:18])[0]
+            yield(header + handle.read(bsize - 17))
+
+    def inflateBgzf(self):
+        handle = open(self.path, 'rb')
+        pool = ThreadPoolExecutor(self.threads)
+        pending = list()
+        group = list()
+        for block in self.bgzfBlocks(handle):
+            group.append(block)
+            if len(group) == BGZF_BLOCKS:
+                pending.append(pool.submit(inflateBlocks, group))
+                group = list()
+            #Keep a bounded number of groups in flight, in file order
+            if len(pending) > 2 * self.threads:
+                yield(pending.pop(0).result())
+        if group:
+            pending.append(pool.submit(inflateBlocks, group))
+        for future in pending:
+            yield(future.result())
+        pool.shutdown()
+        handle.close()
+        return
+
+    def inflateGzip(self):
+        handle = gzip.open(self.path, 'rb')
+        while True:
+            chunk = handle.read(4194304)
+            if not chunk:
+                break
+            yield(chunk)
+        handle.close()
+        return
+
+    def inflateZstd(self):
+        import zstandard
+        handle = zstandard.ZstdDecompressor().stream_reader(open(self.path, 'rb'))
+        while True:
+            chunk = handle.read(4194304)
+            if not chunk:
+                break
+            yield(chunk)
+        handle.close()
+        return
+
+    def read(self, size=-1):
+        return(self.handle.read(size))
+
+    def close(self):
+        self.stopped.set()
+        self.handle.close()
+        if self.process is not None:
+            self.process.wait()
+            if self.process.returncode not in (0, -13):
+                logging.error('Decompression of {0} exited with code {1}'.format(self.path, self.process.returncode))
+        return
+
+
+def inflateBlocks(blocks):
+    '''Decompress a group of BGZF blocks and return the concatenated data'''
+    return(b''.join([zlib.decompress(block[18:-8], -15) for block in blocks]))
+
+def openInput(path, threads=1):
+    '''Open fastq input for binary reading, decompressing if needed'''
+    if detectFormat(path) == 'plain':
+        return(open(path, 'rb'))
+    return(InputStream(path, threads))
+
+
+class InputPipe:
+    '''Expose compressed input to external tools as a named pipe.
+
+    Plain files are passed through unchanged; otherwise path points to a
+    fifo in outdir that a background thread fills with decompressed data.
+    Each pipe can be read only once, by a single consumer.
+    '''
+
+    def __init__(self, path, outdir, threads=1):
+        self.source = path
+        self.threads = threads
+        self.thread = None
+        self.pipedir = None
+        self.path = path
+        if detectFormat(path) == 'plain':
+            return
+        self.pipedir = tempfile.mkdtemp(prefix='pipe_', dir=outdir)
+        name = os.path.basename(path)
+        for suffix in ('.gz', '.bgz', '.zst'):
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+        self.path = '{0}/{1}'.format(self.pipedir, name)
+        os.mkfifo(self.path)
+        self.thread = threading.Thread(target=self.feed, daemon=True)
+        self.thread.start()
+        return
+
+    def feed(self):
+        stream = InputStream(self.source, self.threads)
+        try:
+            phandle = open(self.path, 'wb')
+            while True:
+                chunk = stream.read(1048576)
+                if not chunk:
+                    break
+                phandle.write(chunk)
+            phandle.close()
+        except BrokenPipeError:
+            logging.warning('Consumer closed named pipe early : {0}'.format(self.path))
+        finally:
+            stream.close()
+        return
+
+    def close(self):
+        '''Wait for the feeder and remove the fifo'''
+        if self.thread is None:
+            return
+        while self.thread.is_alive():
+            #Unblock a feeder still waiting for a reader to open the fifo
+            try:
+                fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+            except OSError:
+                break
+            self.thread.join(0.1)
+            os.close(fd)
+        self.thread.join()
+        shutil.rmtree(self.pipedir, ignore_errors=True)
+        return
@@ -0,0 +1,134 @@
+import shutil
+import timeit
+import logging
+import tempfile
+import numpy as np
+from collections import OrderedDict
+from assemble.readers import Fastq, PairedFastq, splitmix
+
+GENOME_UNITS = {'k' : 1000, 'm' : 1000000, 'g' : 1000000000}
+#Longest first keys hold the length in their top 24 bits and a hash below
+MAX_KEY_LENGTH = 2**24 - 1
+
+
+def genomeSize(egs):
+    '''Return a genome size given as 30m, 2.5g or 4600000 in bases'''
+    egs = str(egs).strip().lower()
+    if egs[-1:] in GENOME_UNITS:
+        return(int(float(egs[:-1]) * GENOME_UNITS[egs[-1]]))
+    return(int(float(egs)))
+
+
+class Subsampler:
+    '''Downsample reads to depth times the genome size in one pass over the input.
+
+    Reads, or pairs, are ranked by a key and those with the lowest keys
+    holding depth x gsize bases are kept, in input order. By default the
+    key is a seeded hash of the read name, so mates are kept together and
+    reruns with the same seed select the same reads whatever the batch
+    boundaries; with longest the key ranks longer reads first, for long
+    reads. While streaming, reads under a shrinking key threshold are
+    spooled to disk and only their keys and lengths are held in memory;
+    the final selection is read back from the spool, not the input.
+    '''
+
+    def __init__(self, gsize, depth, seed=0, longest=False, phred='phred33'):
+        self.gsize = gsize
+        self.depth = depth
+        self.target = int(depth * gsize)
+        self.seed = np.uint64(seed)
+        self.longest = longest
+        self.phred = phred
+        return
+
+    def keys(self, batches):
+        '''Return the ranking key of every read, or pair, in a tuple of aligned batches'''
+        hashes = splitmix(batches[0].nameHashes() ^ self.seed)
+        if not self.longest:
+            return(hashes)
+        lengths = np.minimum(batches[0].lengths(), MAX_KEY_LENGTH).astype(np.uint64)
+        return(((np.uint64(MAX_KEY_LENGTH) - lengths) << np.uint64(40)) | (hashes >> np.uint64(24)))
+
+    def threshold(self, keys, bases):
+        '''Return the smallest key not kept when keeping the lowest keys holding target bases'''
+        order = np.argsort(keys, kind='stable')
+        total = np.cumsum(bases[order])
+        over = int(np.searchsorted(total, self.target, side='right'))
+        if over >= len(keys):
+            return(None)
+        return(keys[order[over]])
+
+    def select(self, batches, outfiles, reread, outdir):
+        '''Write the reads of a stream of batch tuples kept at the target depth; return summary metrics'''
+        start = timeit.default_timer()
+        spooldir = tempfile.mkdtemp(prefix='subsample_', dir=outdir)
+        spools = ['{0}/spool.{1}.fastq'.format(spooldir, mate + 1) for mate in range(len(outfiles))]
+        handles = [open(spool, 'wb') for spool in spools]
+        limit = None
+        keys = np.zeros(0, dtype=np.uint64)
+        bases = np.zeros(0, dtype=np.int64)
+        reads = 0
+        total = 0
+        for group in batches:
+            batchkeys = self.keys(group)
+            batchbases = sum([batch.lengths() for batch in group])
+            reads += len(batchkeys)
+            total += int(batchbases.sum())
+            spooled = np.ones(len(batchkeys), dtype=bool) if limit is None else batchkeys < limit
+            for handle, batch in zip(handles, group):
+                handle.write(batch.take(spooled).raw())
+            keys = np.concatenate((keys, batchkeys[spooled]))
+            bases = np.concatenate((bases, batchbases[spooled]))
+            #Tighten the threshold once the spool holds twice the target
+            if bases.sum() > 2 * self.target:
+                limit = self.threshold(keys, bases)
+                keys, bases = keys[keys < limit], bases[keys < limit]
+        for handle in handles:
+            handle.close()
+        #Keys left under an earlier limit may fit the target exactly; that limit still applies to the spool
+        final = self.threshold(keys, bases)
+        if final is not None:
+            limit = final
+        kept = [0, 0]
+        if limit is None:
+            #Input is already below the target depth; the spool holds every read
+            for spool, outfile in zip(spools, outfiles):
+                shutil.move(spool, outfile)
+            kept = [reads, total]
+        else:
+            handles = [open(outfile, 'wb') for outfile in outfiles]
+            for group in reread(spools):
+                selected = self.keys(group) < limit
+                for handle, batch in zip(handles, group):
+                    handle.write(batch.take(selected).raw())
+                kept[0] += int(selected.sum())
+                kept[1] += int(sum([batch.lengths()[selected].sum() for batch in group]))
+            for handle in handles:
+                handle.close()
+        shutil.rmtree(spooldir, ignore_errors=True)
+        metrics = OrderedDict()
+        metrics['Reads'] = reads
+        metrics['Bases'] = total
+        metrics['InputDepth'] = total / float(self.gsize)
+        metrics['ReadsKept'] = kept[0]
+        metrics['BasesKept'] = kept[1]
+        metrics['OutputDepth'] = kept[1] / float(self.gsize)
+        metrics['RetainedFraction'] = kept[1] / float(total) if total else 0.0
+        metrics['Runtime'] = timeit.default_timer() - start
+        logging.info('Subsampled {0:.1f}x to {1:.1f}x; kept {2} of {3} reads'.format(metrics['InputDepth'],
+            metrics['OutputDepth'], kept[0], reads))
+        return(metrics)
+
+    def subsamplePairs(self, read1, read2, outfile1, outfile2, outdir, threads=1):
+        '''Downsample paired fastq files, keeping mates together'''
+        def reread(spools):
+            return(PairedFastq(spools[0], spools[1], outdir, self.phred).batches())
+        pairs = PairedFastq(read1, read2, outdir, self.phred, threads=threads)
+        return(self.select(pairs.batches(), [outfile1, outfile2], reread, outdir))
+
+    def subsampleReads(self, reads, outfile, outdir, threads=1):
+        '''Downsample a single fastq file, such as pacbio reads'''
+        def reread(spools):
+            return([(batch,) for batch in Fastq(spools[0], outdir, self.phred).batches()])
+        fastq = Fastq(reads, outdir, self.phred, threads=threads)
+        return(self.select([(batch,) for batch in fastq.batches()], [outfile], reread, outdir))
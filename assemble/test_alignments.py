@@ -0,0 +1,118 @@
+import re
+import array
+import numpy as np
+import pytest
+
+pysam = pytest.importorskip('pysam')
+from assemble.alignments import foldBlocks, contigCoverage, bamMetric, findBreakpoints
+
+
+def alignedRead(header, name, flag, contig, start, cigar, mate=None, tlen=0, edits=None):
+    '''Return an alignment with placeholder bases; mate is (contig, start) of a mapped mate'''
+    length = sum([int(size) for size, operation in re.findall(r'(\d+)([MIS=X])', cigar)])
+    read = pysam.AlignedSegment(header)
+    read.query_name = name
+    read.flag = flag
+    read.reference_id = contig
+    read.reference_start = start
+    read.mapping_quality = 60
+    read.cigarstring = cigar
+    read.query_sequence = 'A' * length
+    read.query_qualities = pysam.qualitystring_to_array('I' * length)
+    if mate is not None:
+        read.next_reference_id, read.next_reference_start = mate
+    read.template_length = tlen
+    if edits is not None:
+        read.set_tag('NM', edits)
+    return(read)
+
+def writeBam(path, contigs, reads):
+    '''Write coordinate sorted, indexed bam of reads built by alignedRead(header, ...) argument tuples'''
+    header = pysam.AlignmentHeader.from_dict({'HD' : {'VN' : '1.6', 'SO' : 'coordinate'},
+        'SQ' : [{'SN' : name, 'LN' : length} for name, length in contigs]})
+    aligned = sorted([alignedRead(header, *read) for read in reads],
+        key=lambda read: (read.reference_id, read.reference_start))
+    bamfile = pysam.AlignmentFile(path, 'wb', header=header)
+    for read in aligned:
+        bamfile.write(read)
+    bamfile.close()
+    pysam.index(path)
+    return(path)
+
+def writeFasta(path, contigs):
+    fasta = open(path, 'w')
+    for name, length in contigs:
+        fasta.write('>{0}\n{1}\n'.format(name, 'A' * length))
+    fasta.close()
+    return(path)
+
+def test_fold_blocks():
+    diff = np.zeros(11, dtype=np.int32)
+    starts, ends = foldBlocks(diff, array.array('i', [0, 2]), array.array('i', [5, 4]))
+    assert len(starts) == 0 and len(ends) == 0
+    assert np.cumsum(diff[:-1]).tolist() == [1, 1, 2, 2, 1, 0, 0, 0, 0, 0]
+
+def test_contig_coverage(tmp_path):
+    contigs = [('c1', 1000)]
+    reads = [('p1', 99, 0, 100, '50M', (0, 250), 200, 1),
+        ('p1', 147, 0, 250, '50M', (0, 100), -200, 0),
+        ('s1', 0, 0, 500, '10S40M', None, 0, 0),
+        ('s2', 0x100, 0, 600, '50M', None, 0, 0)]
+    bam = writeBam(str(tmp_path / 'test.bam'), contigs, reads)
+    samfile = pysam.AlignmentFile(bam, 'rb')
+    metrics, inserts = contigCoverage(samfile, 'c1', 1000, maxinsert=1000)
+    samfile.close()
+    assert metrics['Reads'] == 3
+    assert metrics['MeanDepth'] == pytest.approx(140 / 1000.0)
+    assert metrics['MedianDepth'] == 0.0
+    assert metrics['Breadth1x'] == pytest.approx(0.14)
+    assert metrics['Breadth10x'] == 0.0
+    assert metrics['ProperPairRate'] == 1.0
+    assert metrics['SoftClipRate'] == pytest.approx(10 / 150.0)
+    assert metrics['MismatchRate'] == pytest.approx(1 / 140.0)
+    assert inserts[200] == 1 and inserts.sum() == 1
+
+def test_bam_metric_keeps_contig_order(tmp_path):
+    contigs = [('c1', 1000), ('c2', 500)]
+    reads = [('r1', 0, 1, 0, '100M'), ('r2', 0, 0, 0, '100M')]
+    assembly = writeFasta(str(tmp_path / 'assembly.fa'), contigs)
+    bam = writeBam(str(tmp_path / 'test.bam'), contigs, reads)
+    metrics, inserts = bamMetric(assembly, bam)
+    assert [contig['Contig'] for contig in metrics] == ['c1', 'c2']
+    assert [contig['MeanDepth'] for contig in metrics] == [pytest.approx(0.1), pytest.approx(0.2)]
+    assert inserts.sum() == 0
+
+def chimericJunction(tmp_path):
+    '''Two contigs tiled at even depth with clipped reads and pairs split across contigs at c1:2500'''
+    contigs = [('c1', 5000), ('c2', 5000)]
+    reads = list()
+    for contig, (name, length) in enumerate(contigs):
+        reads.extend([('{0}_{1}'.format(name, start), 0, contig, start, '100M')
+            for start in range(0, length - 99, 10)])
+    for index in range(10):
+        reads.append(('left{0}'.format(index), 0, 0, 2450, '50M50S'))
+        reads.append(('right{0}'.format(index), 0, 0, 2500, '50S50M'))
+        reads.append(('split{0}'.format(index), 65, 0, 2400 + index * 5, '100M', (1, 1000)))
+    assembly = writeFasta(str(tmp_path / 'assembly.fa'), contigs)
+    bam = writeBam(str(tmp_path / 'test.bam'), contigs, reads)
+    return(assembly, bam)
+
+def test_find_breakpoints_flags_chimeric_junction(tmp_path):
+    assembly, bam = chimericJunction(tmp_path)
+    bed = str(tmp_path / 'breakpoints.bed')
+    summary = findBreakpoints(assembly, bam, bed)
+    regions = [line.rstrip('\n').split('\t') for line in open(bed)]
+    assert regions == [['c1', '2000', '3000', 'discordant_pairs,clipped_reads', '1']]
+    assert summary['Regions'] == 1
+    assert summary['FlaggedBases'] == 1000
+    assert summary['ContigsFlagged'] == 1
+    assert summary['MisassemblyScore'] == pytest.approx(100.0)
+
+def test_find_breakpoints_clean_assembly(tmp_path):
+    contigs = [('c1', 5000)]
+    reads = [('r{0}'.format(start), 0, 0, start, '100M') for start in range(0, 4901, 10)]
+    assembly = writeFasta(str(tmp_path / 'assembly.fa'), contigs)
+    bam = writeBam(str(tmp_path / 'test.bam'), contigs, reads)
+    bed = str(tmp_path / 'breakpoints.bed')
+    assert findBreakpoints(assembly, bam, bed)['Regions'] == 0
+    assert open(bed).read() == ''
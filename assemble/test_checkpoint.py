@@ -0,0 +1,53 @@
+import os
+import stat
+import pytest
+from assemble import checkpoint
+from assemble.checkpoint import Checkpoint
+
+
+@pytest.fixture(autouse=True)
+def versions(monkeypatch):
+    monkeypatch.setattr(checkpoint, 'TOOL_VERSIONS', dict())
+    return
+
+def writeTool(tmp_path, name='tool'):
+    '''Write a tool that prints its arguments and counts its runs in <tool>.runs'''
+    tool = tmp_path / name
+    tool.write_text('#!/bin/sh\necho run >> "$0.runs"\necho "{0} $@"\n'.format(name))
+    tool.chmod(tool.stat().st_mode | stat.S_IXUSR)
+    return(str(tool))
+
+def runs(tool):
+    if not os.path.exists('{0}.runs'.format(tool)):
+        return(0)
+    return(len(open('{0}.runs'.format(tool)).read().splitlines()))
+
+def test_version_is_asked_once_per_run(tmp_path):
+    tool = writeTool(tmp_path)
+    first = Checkpoint(str(tmp_path / 'first.json'))
+    second = Checkpoint(str(tmp_path / 'second.json'))
+    assert first.version(tool) == 'tool --version'
+    assert second.version(tool) == 'tool --version'
+    first.key('stage', tools=[tool])
+    assert runs(tool) == 1
+
+def test_stage_declares_version_arguments(tmp_path):
+    tool = writeTool(tmp_path)
+    store = Checkpoint(str(tmp_path / 'checkpoints.json'))
+    assert store.version((tool, ['-version'])) == 'tool -version'
+    assert store.version(tool) == 'tool --version'
+    assert runs(tool) == 2
+
+def test_tool_without_version_flag_is_not_run(tmp_path):
+    tool = writeTool(tmp_path)
+    store = Checkpoint(str(tmp_path / 'checkpoints.json'))
+    before = store.key('stage', tools=[(tool, None)])
+    assert runs(tool) == 0
+    os.utime(tool, (0, 0))
+    checkpoint.TOOL_VERSIONS.clear()
+    assert store.key('stage', tools=[(tool, None)]) != before
+    assert runs(tool) == 0
+
+def test_missing_tool_is_unknown(tmp_path):
+    store = Checkpoint(str(tmp_path / 'checkpoints.json'))
+    assert store.version(str(tmp_path / 'missing')) == 'unknown'
@@ -0,0 +1,49 @@
+import stat
+from assemble.evaluate import Evaluate
+
+
+def writeTool(path, script):
+    path.write_text('#!/bin/sh\n{0}\n'.format(script))
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return(str(path))
+
+#Drains both read pipes and streams 100 kB of stand in sam
+BOWTIE = '''while [ $# -gt 0 ]; do
+    case "$1" in -1|-2) cat "$2" > /dev/null; shift;; esac
+    shift
+done
+head -c 100000 /dev/zero'''
+
+#Sort writes 50 kB of scratch beside -T and copies its input to -o; index touches the bai
+SAMTOOLS = '''if [ "$1" = "index" ]; then touch "$2.bai"; exit 0; fi
+while [ $# -gt 0 ]; do
+    case "$1" in -T) scratch="$2"; shift;; -o) output="$2"; shift;; esac
+    shift
+done
+head -c 50000 /dev/zero > "$scratch.tmp.0000.bam"
+rm "$scratch.tmp.0000.bam"
+cat > "$output"'''
+
+def stageTable(log):
+    lines = open(log).read().splitlines()
+    first = lines.index('Stage\tWall(s)\tBytesWritten\tCharsWritten')
+    return(dict([(line.split('\t')[0], line.split('\t')[1:]) for line in lines[first + 1:first + 4]]))
+
+def test_align_stream_reports_each_stage(tmp_path):
+    reads = list()
+    for mate in (1, 2):
+        fastq = tmp_path / 'r{0}.fq'.format(mate)
+        fastq.write_text('@p1/{0}\nACGT\n+\nIIII\n'.format(mate))
+        reads.append(str(fastq))
+    assembly = tmp_path / 'assembly.fa'
+    assembly.write_text('>c1\nACGT\n')
+    evaluate = Evaluate(writeTool(tmp_path / 'bowtie2', BOWTIE), writeTool(tmp_path / 'samtools', SAMTOOLS),
+        None, reads[0], reads[1], None, str(assembly), str(tmp_path / 'out'), 1, 'test', None)
+    assert evaluate.alignStream() == 0
+    assert open('{0}.bam'.format(evaluate.uread), 'rb').read() == b'\0' * 100000
+    stages = stageTable(evaluate.log)
+    assert sorted(stages) == ['bowtie2', 'samtools index', 'samtools sort']
+    #The sam stream counts against bowtie, the scratch and bam against sort
+    assert int(stages['bowtie2'][2]) >= 100000
+    assert int(stages['samtools sort'][2]) >= 150000
+    assert all([float(wall) >= 0 for wall, written, chars in stages.values()])
@@ -0,0 +1,83 @@
+import os
+import pytest
+from assemble.fasta import IndexedFasta
+
+FASTA = '>c1 first contig\nACGTACGTAC\nGTACGTAC\n>c2\nNNNNggcc\n>c3\nAC\n'
+
+
+def writeFasta(tmp_path, text=FASTA, name='test.fa'):
+    fasta = tmp_path / name
+    fasta.write_bytes(text.encode())
+    return(str(fasta))
+
+def test_fetch_and_lengths(tmp_path):
+    fasta = IndexedFasta(writeFasta(tmp_path))
+    assert fasta.names == ['c1', 'c2', 'c3']
+    assert fasta.lengths.tolist() == [18, 8, 2]
+    assert fasta.fetch('c1') == 'ACGTACGTACGTACGTAC'
+    assert fasta.fetch(1) == 'NNNNggcc'
+    assert fasta.header('c1') == 'c1 first contig'
+    assert fasta.composition().tolist() == [[5, 5, 4, 4, 0], [0, 2, 2, 0, 4], [1, 1, 0, 0, 0]]
+    assert list(fasta.contigLengths()) == [('c1', 18), ('c2', 8), ('c3', 2)]
+    fasta.close()
+
+def test_index_matches_samtools(tmp_path):
+    pysam = pytest.importorskip('pysam')
+    fasta = writeFasta(tmp_path)
+    IndexedFasta(fasta).close()
+    ours = open('{0}.fai'.format(fasta)).read()
+    os.remove('{0}.fai'.format(fasta))
+    pysam.faidx(fasta)
+    assert ours == open('{0}.fai'.format(fasta)).read()
+
+def test_index_is_reused(tmp_path, monkeypatch):
+    fasta = writeFasta(tmp_path)
+    IndexedFasta(fasta).close()
+    def rescan(self):
+        raise AssertionError('fasta was scanned again')
+    monkeypatch.setattr(IndexedFasta, 'buildIndex', rescan)
+    reused = IndexedFasta(fasta)
+    assert reused.fetch('c1') == 'ACGTACGTACGTACGTAC'
+    assert reused.fetch('c3') == 'AC'
+    reused.close()
+
+def test_stale_index_is_rebuilt(tmp_path):
+    fasta = writeFasta(tmp_path)
+    IndexedFasta(fasta).close()
+    writeFasta(tmp_path, '>other\nGGGG\n')
+    #The fasta is newer than its index
+    os.utime('{0}.fai'.format(fasta), (0, 0))
+    rebuilt = IndexedFasta(fasta)
+    assert rebuilt.names == ['other'] and rebuilt.fetch(0) == 'GGGG'
+    rebuilt.close()
+    assert open('{0}.fai'.format(fasta)).read() == 'other\t4\t7\t4\t5\n'
+
+def test_irregular_lines_are_not_indexed(tmp_path):
+    fasta = writeFasta(tmp_path, '>c1\nACG\nTACGTA\nC\n>c2\nGG\n')
+    irregular = IndexedFasta(fasta)
+    assert irregular.fetch('c1') == 'ACGTACGTAC'
+    assert irregular.fetch('c2') == 'GG'
+    assert irregular.lengths.tolist() == [10, 2]
+    irregular.close()
+    #A .fai could not describe these lines, so none is written
+    assert not os.path.exists('{0}.fai'.format(fasta))
+
+def test_windows_line_endings(tmp_path):
+    fasta = IndexedFasta(writeFasta(tmp_path, '>c1\r\nACGT\r\nAC\r\n>c2\r\nGG\r\n'))
+    assert fasta.lengths.tolist() == [6, 2]
+    assert fasta.linebases.tolist()[0] == 4 and fasta.linewidths.tolist()[0] == 6
+    assert fasta.fetch('c1') == 'ACGTAC'
+    fasta.close()
+
+def test_no_trailing_newline_and_no_persist(tmp_path):
+    fasta = writeFasta(tmp_path, '>c1\nACGT\nAC')
+    unsaved = IndexedFasta(fasta, persist=False)
+    assert unsaved.fetch('c1') == 'ACGTAC'
+    unsaved.close()
+    assert not os.path.exists('{0}.fai'.format(fasta))
+
+def test_empty_fasta(tmp_path):
+    empty = IndexedFasta(writeFasta(tmp_path, ''))
+    assert len(empty) == 0
+    assert empty.composition().shape == (0, 5)
+    empty.close()
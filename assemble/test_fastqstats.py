@@ -0,0 +1,72 @@
+import gzip
+import random
+import numpy as np
+import pytest
+from assemble.readers import Fastq, FastqStats, fastqStats, chunkStats, recordStart
+
+
+def writeReads(path, reads=3000, seed=13):
+    '''Write reads of varied length; every third read repeats the one before and qualities may start with @'''
+    rng = random.Random(seed)
+    records = list()
+    seq = ''
+    for index in range(reads):
+        if index % 3 != 2:
+            seq = ''.join([rng.choice('ACGTN') for base in range(rng.randint(20, 150))])
+        quals = ''.join([rng.choice('@#I5') for base in range(len(seq))])
+        records.append('@r{0}\n{1}\n+\n{2}\n'.format(index, seq, quals))
+    path.write_text(''.join(records))
+    return(str(path))
+
+def sameStats(first, second):
+    assert first.reads == second.reads
+    assert np.array_equal(np.trim_zeros(first.lengths, 'b'), np.trim_zeros(second.lengths, 'b'))
+    assert np.array_equal(first.bases, second.bases)
+    assert np.array_equal(first.cyclequal, second.cyclequal)
+    assert np.array_equal(first.cyclereads, second.cyclereads)
+    assert np.array_equal(first.hashes, second.hashes)
+    assert first.summary() == second.summary()
+
+def test_chunked_stats_equal_single_pass(tmp_path):
+    fastq = writeReads(tmp_path / 'reads.fq')
+    single = chunkStats((fastq, 'phred33', 0, None))
+    assert single.reads == 3000
+    sameStats(fastqStats(fastq, processes=3), single)
+
+def test_small_sketch_merges_exactly(tmp_path):
+    fastq = writeReads(tmp_path / 'reads.fq')
+    whole = FastqStats(sketch=64)
+    parts = [FastqStats(sketch=64), FastqStats(sketch=64)]
+    for index, batch in enumerate(Fastq(fastq, str(tmp_path), 'phred33', blocksize=8192).batches()):
+        whole.update(batch, np.arange(256, dtype=np.uint8))
+        parts[index % 2].update(batch, np.arange(256, dtype=np.uint8))
+    parts[0].merge(parts[1])
+    assert np.array_equal(parts[0].hashes, whole.hashes)
+    assert len(whole.hashes) == 64
+
+def test_compressed_stats(tmp_path):
+    fastq = writeReads(tmp_path / 'reads.fq')
+    compressed = tmp_path / 'reads.fq.gz'
+    compressed.write_bytes(gzip.compress(open(fastq, 'rb').read()))
+    sameStats(fastqStats(str(compressed), processes=2), chunkStats((fastq, 'phred33', 0, None)))
+
+def test_summary(tmp_path):
+    fastq = tmp_path / 'reads.fq'
+    fastq.write_text('@a\nACGN\n+\nIIII\n@b\nGG\n+\n##\n@c\nGG\n+\nII\n')
+    summary = fastqStats(str(fastq)).summary()
+    assert summary['Reads'] == 3
+    assert summary['Bases'] == 8
+    assert (summary['MinLength'], summary['MaxLength']) == (2, 4)
+    assert summary['GC'] == pytest.approx(6 / 7.0)
+    assert summary['NRate'] == pytest.approx(1 / 8.0)
+    assert summary['MeanQuality'] == pytest.approx((40 * 6 + 2 * 2) / 8.0)
+    assert summary['Duplicates'] == pytest.approx(1 / 3.0)
+
+def test_record_start_skips_quality_lines_starting_with_at(tmp_path):
+    fastq = tmp_path / 'reads.fq'
+    fastq.write_text('@a\nACGT\n+\n@III\n@b\nGGGG\n+\nIIII\n')
+    #Offsets inside the first record resolve to the header of the second, not to its @ quality line
+    assert recordStart(str(fastq), 1) == 15
+    assert recordStart(str(fastq), 10) == 15
+    assert recordStart(str(fastq), 12) == 15
+    assert recordStart(str(fastq), 0) == 0
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from evaluate import binEdges, lengthHistogram, ScafoldCounter
+
+
+def test_linear_bins():
+    lengths = [np.array([10, 20, 30, 100]), np.array([55])]
+    histogram = lengthHistogram(lengths, ['a', 'b'], bsize=9)
+    assert len(histogram) == 18
+    first = histogram[histogram['Assembler'] == 'a']
+    assert first['BinStart'].tolist() == pytest.approx(list(range(10, 100, 10)))
+    assert first['BinEnd'].tolist() == pytest.approx(list(range(20, 101, 10)))
+    #Lengths on an edge open the bin to their right; the right most edge is closed
+    assert first['Count'].tolist() == [1, 1, 1, 0, 0, 0, 0, 0, 1]
+    assert first['Bases'].tolist() == [10, 20, 30, 0, 0, 0, 0, 0, 100]
+    assert first['CumCount'].tolist() == [1, 2, 3, 3, 3, 3, 3, 3, 4]
+    assert first['CumBases'].tolist()[-1] == 160
+    assert first['CumFraction'].tolist() == pytest.approx([10 / 160.0, 30 / 160.0] + [60 / 160.0] * 6 + [1.0])
+    second = histogram[histogram['Assembler'] == 'b']
+    #Assemblies share the same edges
+    assert second['BinStart'].tolist() == first['BinStart'].tolist()
+    assert second['Count'].tolist() == [0, 0, 0, 0, 1, 0, 0, 0, 0]
+
+def test_counts_match_numpy():
+    rng = np.random.RandomState(5)
+    lengths = [rng.randint(1, 5000, size=300), rng.randint(1000, 20000, size=200)]
+    histogram = lengthHistogram(lengths, ['a', 'b'], bsize=25)
+    edges = binEdges(np.concatenate(lengths), 25)
+    for name, values in zip(['a', 'b'], lengths):
+        counts, bins = np.histogram(values, edges)
+        assert histogram[histogram['Assembler'] == name]['Count'].tolist() == counts.tolist()
+
+def test_log_bins():
+    edges = binEdges(np.array([1, 10, 100, 1000]), 3, 'log')
+    assert edges.tolist() == pytest.approx([1, 10, 100, 1000])
+    histogram = lengthHistogram([np.array([1, 5, 10, 999, 1000])], ['a'], bsize=3, scale='log')
+    assert histogram['Count'].tolist() == [2, 1, 2]
+    #Zero lengths fall in the first bin rather than breaking the log edges
+    assert binEdges(np.array([0, 100]), 2, 'log').tolist() == pytest.approx([1, 10, 100])
+
+def test_equal_lengths():
+    histogram = lengthHistogram([np.array([7, 7, 7])], ['a'], bsize=4)
+    assert histogram['BinStart'].tolist()[0] == 7 and histogram['BinEnd'].tolist()[-1] == 8
+    assert histogram['Count'].tolist() == [3, 0, 0, 0]
+
+def test_empty_assemblies():
+    histogram = lengthHistogram([np.zeros(0, dtype=np.int64), np.array([5])], ['a', 'b'], bsize=2)
+    empty = histogram[histogram['Assembler'] == 'a']
+    assert empty['Count'].tolist() == [0, 0]
+    assert empty['CumFraction'].tolist() == [0.0, 0.0]
+    assert lengthHistogram([np.zeros(0, dtype=np.int64)], ['a'], bsize=3)['Count'].tolist() == [0, 0, 0]
+    assert len(lengthHistogram([], [], bsize=3)) == 0
+
+def test_counter_reads_assemblies(tmp_path):
+    fasta = tmp_path / 'assembly.fa'
+    fasta.write_text('>a\n{0}\n>b\n{1}\n>c\nACGT\n'.format('A' * 100, 'C' * 50))
+    histogram = ScafoldCounter([str(fasta)], ['test'], bsize=2, minlen=10)
+    assert histogram['Count'].tolist() == [1, 1]
+    assert histogram['Bases'].tolist() == [50, 100]
@@ -0,0 +1,72 @@
+import os
+import stat
+import pytest
+from assemble.indexcache import IndexCache
+
+
+def writeFasta(path, sequence):
+    path.write_text('>contig\n{0}\n'.format(sequence))
+    return(str(path))
+
+def writeBowtie(tmp_path):
+    '''Write a bowtie2-build stand in that writes a 2 MB index at its prefix'''
+    tool = tmp_path / 'bowtie2-build'
+    tool.write_text('#!/bin/sh\nhead -c 2097152 /dev/zero > "$2.1.bt2"\n')
+    tool.chmod(tool.stat().st_mode | stat.S_IXUSR)
+    return(str(tmp_path / 'bowtie2'))
+
+def buildFile(directory):
+    open('{0}/data'.format(directory), 'wb').write(b'\0' * 2097152)
+    return
+
+def entries(cache):
+    return(sorted([name for name in os.listdir(cache.cachedir) if not name.startswith('.')
+        and os.path.isdir('{0}/{1}'.format(cache.cachedir, name))]))
+
+def test_held_index_is_not_evicted(tmp_path):
+    cache = IndexCache(str(tmp_path / 'cache'), maxsize=0.001)
+    bowtie = writeBowtie(tmp_path)
+    logger = open(str(tmp_path / 'run.log'), 'w')
+    prefix, birun = cache.index(writeFasta(tmp_path / 'first.fa', 'ACGT'), bowtie, logger)
+    assert birun.returncode == 0 and os.path.exists('{0}.1.bt2'.format(prefix))
+    with cache.hold(prefix):
+        #Building a second index overflows the cache, but the first is in use
+        other, birun = cache.index(writeFasta(tmp_path / 'second.fa', 'TTTT'), bowtie, logger)
+        assert os.path.exists('{0}.1.bt2'.format(prefix))
+        cache.evict()
+        assert os.path.exists('{0}.1.bt2'.format(prefix))
+    assert not os.path.exists(other)
+    cache.evict()
+    assert entries(cache) == []
+    logger.close()
+
+def test_holds_are_independent(tmp_path):
+    cache = IndexCache(str(tmp_path / 'cache'), maxsize=0.001)
+    entry = cache.artifact(writeFasta(tmp_path / 'first.fa', 'ACGT'), 'test', buildFile)
+    #A hold ending inside another, as from two sample threads, leaves the outer one in place
+    with cache.hold(entry):
+        with cache.hold(entry):
+            pass
+        cache.evict()
+        assert entries(cache) == [os.path.basename(entry)]
+    cache.evict()
+    assert entries(cache) == []
+
+def test_hold_raises_on_evicted_entry(tmp_path):
+    cache = IndexCache(str(tmp_path / 'cache'), maxsize=0.001)
+    entry = cache.artifact(writeFasta(tmp_path / 'first.fa', 'ACGT'), 'test', buildFile)
+    cache.evict()
+    with pytest.raises(FileNotFoundError):
+        with cache.hold(entry):
+            pass
+    #Paths outside the cache are passed through
+    with cache.hold(str(tmp_path / 'first.fa')) as path:
+        assert path == str(tmp_path / 'first.fa')
+
+def test_artifact_builds_once(tmp_path):
+    cache = IndexCache(str(tmp_path / 'cache'))
+    fasta = writeFasta(tmp_path / 'first.fa', 'ACGT')
+    builds = list()
+    entry = cache.artifact(fasta, 'test', builds.append)
+    assert cache.artifact(fasta, 'test', builds.append) == entry
+    assert len(builds) == 1
@@ -0,0 +1,43 @@
+import stat
+from assemble.sprai import Sprai
+from assemble.canu import Canu
+
+
+def writeTool(path, script):
+    path.write_text('#!/bin/sh\n{0}\n'.format(script))
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return(str(path))
+
+def writeReads(tmp_path):
+    reads = tmp_path / 'pacbio.fq'
+    reads.write_text('@p1\nACGT\n+\nIIII\n')
+    return(str(reads))
+
+def sprai(tmp_path, script):
+    bindir = tmp_path / 'sprai_bin'
+    bindir.mkdir()
+    writeTool(bindir / 'ezez_vx1.pl', script)
+    wrapper = Sprai(str(bindir), 'celera', 'blast', writeReads(tmp_path), str(tmp_path), 2, 5000000, 20)
+    wrapper.ecconfig()
+    wrapper.pbasmconfig()
+    return(wrapper, wrapper.sprai())
+
+def test_sprai_finds_scaffolds(tmp_path):
+    wrapper, returncode = sprai(tmp_path, 'mkdir -p result_1/CA/9-terminator\n'
+        'echo ">s1" > result_1/CA/9-terminator/asm.scf.fasta')
+    assert returncode == 0
+    assert wrapper.result == '{0}/result_1/CA/9-terminator/asm.scf.fasta'.format(wrapper.outdir)
+    assert 'estimated_genome_size 5000000\n' in open(wrapper.ec).read()
+
+def test_sprai_failure_returns_exit_code(tmp_path):
+    assert sprai(tmp_path, 'exit 3')[1] == 3
+
+def test_sprai_without_scaffolds_fails(tmp_path):
+    assert sprai(tmp_path, 'exit 0')[1] == 1
+
+def test_canu_runs(tmp_path):
+    canu_path = writeTool(tmp_path / 'canu_bin', 'echo "$@" > "$2/args"')
+    wrapper = Canu(canu_path, writeReads(tmp_path), str(tmp_path), 2, 5000000, 20, 'sample', 4)
+    wrapper.pbconfig()
+    assert wrapper.canu() == 0
+    assert open('{0}/args'.format(wrapper.outdir)).read().split()[:4] == ['-d', wrapper.outdir, '-p', 'sample']
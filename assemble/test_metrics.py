@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+from evaluate import assemblyMetrics, assemblyLengths, ScafoldMetric
+
+LENGTHS = [30, 100, 20, 50]
+
+
+def test_contiguity():
+    metrics = assemblyMetrics(LENGTHS, 400)
+    assert metrics['Contigs'] == 4
+    assert metrics['TotalLength'] == 200
+    assert metrics['Largest'] == 100
+    #Half the total is reached within the largest contig
+    assert (metrics['N50'], metrics['L50']) == (100, 1)
+    #Half the genome needs every contig
+    assert (metrics['NG50'], metrics['LG50']) == (20, 4)
+    assert metrics['auN'] == pytest.approx((100 ** 2 + 50 ** 2 + 30 ** 2 + 20 ** 2) / 200.0)
+    assert 'GC' not in metrics
+
+def test_n50_on_a_boundary():
+    #Cumulative length reaches exactly half the total at the second contig
+    metrics = assemblyMetrics([10, 10, 10, 10], 40)
+    assert (metrics['N50'], metrics['L50']) == (10, 2)
+    assert (metrics['NG50'], metrics['LG50']) == (10, 2)
+
+def test_assembly_short_of_genome_size():
+    metrics = assemblyMetrics(LENGTHS, 1000)
+    assert (metrics['NG50'], metrics['LG50']) == (0, 0)
+    assert (metrics['N50'], metrics['L50']) == (100, 1)
+
+def test_empty_assembly():
+    metrics = assemblyMetrics(np.zeros(0, dtype=np.int64), 1000, np.zeros((0, 5), dtype=np.int64))
+    assert metrics['Contigs'] == 0 and metrics['TotalLength'] == 0 and metrics['Largest'] == 0
+    assert (metrics['N50'], metrics['L50'], metrics['NG50'], metrics['LG50']) == (0, 0, 0, 0)
+    assert metrics['auN'] == 0.0
+    assert (metrics['GC'], metrics['NContent']) == (0.0, 0.0)
+
+def test_composition():
+    composition = np.array([[10, 5, 5, 10, 10], [0, 0, 0, 0, 0]])
+    metrics = assemblyMetrics([40, 0], 100, composition)
+    #GC is over called bases only, N content over all bases
+    assert metrics['GC'] == pytest.approx(10 / 30.0)
+    assert metrics['NContent'] == pytest.approx(10 / 40.0)
+
+def test_summary_table(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    fasta = tmp_path / 'assembly.fa'
+    fasta.write_text('>a\n{0}\n>b\n{1}\n>c\nACGT\n'.format('GC' * 60, 'AT' * 25 + 'N' * 50))
+    results = assemblyLengths([str(fasta)], minlen=10)
+    assert results[0][0].tolist() == [120, 100]
+    table = ScafoldMetric([str(fasta)], ['test'], 1000, minlen=10, summary=str(tmp_path / 'summary.tsv'),
+        results=results)
+    assert table.loc['test', 'Contigs'] == 2
+    assert table.loc['test', 'N50'] == 120
+    assert table.loc['test', 'GC'] == pytest.approx(120 / 170.0)
+    assert table.loc['test', 'NContent'] == pytest.approx(50 / 220.0)
+    curve = pd.read_csv(str(tmp_path / 'AssemblyMetrics.csv'), sep='\t')
+    assert curve['ScaffoldLength'].tolist() == [120, 100]
+    assert curve['NG'].tolist() == pytest.approx([12.0, 22.0])
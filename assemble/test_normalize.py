@@ -0,0 +1,58 @@
+import random
+import numpy as np
+from assemble.readers import Fastq
+from assemble.normalize import Normalizer, MAX_COUNT
+
+
+def readBatch(tmp_path, seqs):
+    '''Return one batch of reads with the sequences seqs'''
+    fastq = tmp_path / 'test_normalize.fastq'
+    fastq.write_text(''.join(['@r{0}\n{1}\n+\n{2}\n'.format(index, seq, 'I' * len(seq))
+        for index, seq in enumerate(seqs)]))
+    return(list(Fastq(str(fastq), str(tmp_path), 'phred33').batches())[0])
+
+def test_count_saturates(tmp_path):
+    normalizer = Normalizer(memory=0.0001)
+    normalizer.count(np.zeros((normalizer.tables, 200), dtype=np.int64))
+    assert normalizer.counts[:, 0].tolist() == [200] * normalizer.tables
+    #Bytes would wrap past 255 without the clamp
+    normalizer.count(np.zeros((normalizer.tables, 200), dtype=np.int64))
+    assert normalizer.counts[:, 0].tolist() == [MAX_COUNT] * normalizer.tables
+    normalizer.count(np.zeros((normalizer.tables, 1), dtype=np.int64))
+    assert normalizer.counts[:, 0].tolist() == [MAX_COUNT] * normalizer.tables
+    assert normalizer.counts[:, 1:].sum() == 0
+
+def test_median_of_reads_without_valid_kmers(tmp_path):
+    rng = random.Random(3)
+    seq = ''.join([rng.choice('ACGT') for index in range(40)])
+    normalizer = Normalizer(memory=0.0001)
+    batch = readBatch(tmp_path, [seq, 'N' * 40, 'ACGT', seq[:30] + 'N' + 'ACGTACGTA'])
+    median, positions, reads = normalizer.medians(batch)
+    assert median.tolist() == [0, 0, 0, 0]
+    assert sorted(set(reads.tolist())) == [0, 3]
+    normalizer.count(positions[:, reads == 0])
+    normalizer.count(positions[:, reads == 0])
+    median, positions, reads = normalizer.medians(batch)
+    #Invalid k-mers of the last read are left out rather than counted as saturated
+    assert median.tolist() == [2, 0, 0, 2]
+
+def test_medians_of_reads_shorter_than_k(tmp_path):
+    normalizer = Normalizer(memory=0.0001)
+    median, positions, reads = normalizer.medians(readBatch(tmp_path, ['ACGT', 'GGC']))
+    assert median.tolist() == [0, 0]
+    assert positions.shape == (normalizer.tables, 0)
+
+def test_normalize_caps_redundant_pairs(tmp_path):
+    rng = random.Random(5)
+    seq1 = ''.join([rng.choice('ACGT') for index in range(100)])
+    seq2 = ''.join([rng.choice('ACGT') for index in range(100)])
+    read1 = tmp_path / 'r1.fq'
+    read2 = tmp_path / 'r2.fq'
+    read1.write_text(''.join(['@p{0}/1\n{1}\n+\n{2}\n'.format(index, seq1, 'I' * 100) for index in range(50)]))
+    read2.write_text(''.join(['@p{0}/2\n{1}\n+\n{2}\n'.format(index, seq2, 'I' * 100) for index in range(50)]))
+    normalizer = Normalizer(coverage=5, memory=0.0001, chunk=1)
+    metrics = normalizer.normalize(str(read1), str(read2), str(tmp_path / 'n1.fq'), str(tmp_path / 'n2.fq'),
+        str(tmp_path))
+    assert metrics['Pairs'] == 50
+    assert metrics['PairsKept'] == 5
+    assert len(open(str(tmp_path / 'n1.fq')).read().splitlines()) == 20
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from assemble.readers import Pileup
+
+#Columns of counts are A, C, G, T, N, *
+PILEUP = [('c1\t1\tA\t4\t.,^IT$g\tIIII', [2, 0, 1, 1, 0, 0], 0),
+    #Indel sequences are skipped, insertions counted, and * counted as a deletion
+    ('c1\t2\tc\t3\t.+2AG,-1T*\tI#I', [0, 2, 0, 0, 0, 1], 1),
+    #Zero depth positions carry a * placeholder that is not counted
+    ('c2\t5\tN\t0\t*\t*', [0, 0, 0, 0, 0, 0], 0),
+    #Mapping qualities after ^ may be + or $ and are not bases, indels or read ends
+    ('c2\t6\tG\t2\t^+A^$.\tII', [1, 0, 1, 0, 0, 0], 0),
+    ('c2\t7\tT\t1\t.+10ACGTACGTAC\tI', [0, 0, 0, 1, 0, 0], 1),
+    ('c2\t8\tt\t2\t#,\tII', [0, 0, 0, 1, 0, 1], 0)]
+
+
+def writePileup(tmp_path, lines):
+    pileup = tmp_path / 'test.pileup'
+    pileup.write_text(''.join(['{0}\n'.format(line) for line in lines]))
+    return(str(pileup))
+
+def test_pileup_columns(tmp_path):
+    reader = Pileup(writePileup(tmp_path, [line for line, counts, ins in PILEUP]), str(tmp_path))
+    batch = reader.collect()
+    assert reader.scaffolds == ['c1', 'c2']
+    assert batch.scaf.tolist() == [0, 0, 1, 1, 1, 1]
+    assert batch.pos.tolist() == [1, 2, 5, 6, 7, 8]
+    assert batch.ref.tobytes() == b'ACNGTT'
+    assert batch.depth.tolist() == [4, 3, 0, 2, 1, 2]
+    assert batch.counts.tolist() == [counts for line, counts, ins in PILEUP]
+    assert batch.ins.tolist() == [ins for line, counts, ins in PILEUP]
+    assert batch.qual[0] == pytest.approx(40)
+    assert batch.qual[1] == pytest.approx((40 + 2 + 40) / 3.0)
+    assert batch.qual[2] == 0
+
+def test_pileup_blocks_match_single_block(tmp_path):
+    lines = [line for line, counts, ins in PILEUP] * 50
+    whole = Pileup(writePileup(tmp_path, lines), str(tmp_path)).collect()
+    #Blocks end mid line and are completed to the next newline
+    blocks = Pileup(writePileup(tmp_path, lines), str(tmp_path), blocksize=100)
+    assert len(list(blocks.read())) > 10
+    split = blocks.collect()
+    for field in whole._fields:
+        assert np.array_equal(getattr(whole, field), getattr(split, field))
+
+def test_extra_samples_are_ignored(tmp_path):
+    reader = Pileup(writePileup(tmp_path, ['c1\t1\tA\t2\t.T\tII\t3\tGGG\tIII']), str(tmp_path))
+    assert reader.collect().counts.tolist() == [[1, 0, 0, 1, 0, 0]]
+
+def test_malformed_pileup_raises(tmp_path):
+    reader = Pileup(writePileup(tmp_path, ['c1\t1\tA\t1\t.\tI', 'c1\t2\tA\t1\t.']), str(tmp_path))
+    with pytest.raises(ValueError):
+        reader.collect()
+
+def test_empty_pileup(tmp_path):
+    assert Pileup(writePileup(tmp_path, []), str(tmp_path)).collect() is None
@@ -1,6 +1,59 @@
-#! /usr/local/bin/python3.4
-from readers import Fastq
-test = Fastq('../fq/test_reader.fastq','./','phred33')
-reader = test.read()
-for records in reader:
-    print(records) 
+from assemble.readers import Fastq, PairedFastq
+
+FASTQ = b'@r1/1\nACGTACGT\n+\nIIII##II\n@r2/1\nGGGG\n+\nIIII\n'
+
+
+def writeFastq(tmp_path, data=FASTQ):
+    fastq = tmp_path / 'test_reader.fastq'
+    fastq.write_bytes(data)
+    return(str(fastq))
+
+def test_read_records(tmp_path):
+    records = list(Fastq(writeFastq(tmp_path), str(tmp_path), 'phred33', mask=0).read())
+    assert [record.header for record in records] == [b'@r1/1', b'@r2/1']
+    assert records[0].seq.tobytes() == b'ACGTACGT'
+    assert records[0].quals.tolist() == [40, 40, 40, 40, 2, 2, 40, 40]
+
+def test_records_are_masked_by_default(tmp_path):
+    records = list(Fastq(writeFastq(tmp_path), str(tmp_path), 'phred33').read())
+    assert records[0].seq.tobytes() == b'ACGTNNGT'
+    assert records[0].quals.tolist() == [40, 40, 40, 40, 2, 2, 40, 40]
+    assert records[1].seq.tobytes() == b'GGGG'
+
+def test_masking_leaves_batches_unchanged(tmp_path):
+    reader = Fastq(writeFastq(tmp_path), str(tmp_path), 'phred33')
+    batches = list(reader.batches())
+    records = [list(reader.records(batch)) for batch in batches]
+    assert records[0][0].seq.tobytes() == b'ACGTNNGT'
+    assert b''.join([batch.raw() for batch in batches]) == FASTQ
+
+def test_paired_write_is_byte_exact(tmp_path):
+    read1 = writeFastq(tmp_path)
+    read2 = str(tmp_path / 'mates.fastq')
+    open(read2, 'wb').write(FASTQ.replace(b'/1\n', b'/2\n'))
+    pairs = PairedFastq(read1, read2, str(tmp_path), 'phred33')
+    assert [record1.seq.tobytes() for record1, record2 in pairs.read()] == [b'ACGTNNGT', b'GGGG']
+    pairs.write(str(tmp_path / 'out1.fastq'), str(tmp_path / 'out2.fastq'))
+    assert open(str(tmp_path / 'out1.fastq'), 'rb').read() == FASTQ
+
+def mateHeaders(batches):
+    headers = ([], [])
+    for batch1, batch2 in batches:
+        headers[0].extend([batch1.header(index) for index in range(len(batch1))])
+        headers[1].extend([batch2.header(index) for index in range(len(batch2))])
+    return(headers)
+
+def test_repair_interleaved_pairs_mates(tmp_path):
+    records = [b'@a/1\nA\n+\nI\n', b'@a/2\nC\n+\nI\n', b'@b/1\nG\n+\nI\n', b'@b/2\nT\n+\nI\n']
+    fastq = writeFastq(tmp_path, b''.join(records))
+    pairs = PairedFastq(fastq, None, str(tmp_path), 'phred33', repair=True)
+    assert mateHeaders(pairs.batches()) == ([b'@a/1', b'@b/1'], [b'@a/2', b'@b/2'])
+    assert pairs.orphans == 0
+
+def test_repair_interleaved_out_of_order(tmp_path):
+    records = [b'@a/1\nA\n+\nI\n', b'@b/1\nG\n+\nI\n', b'@c/1\nG\n+\nI\n', b'@b/2\nT\n+\nI\n',
+        b'@a/2\nC\n+\nI\n']
+    fastq = writeFastq(tmp_path, b''.join(records))
+    pairs = PairedFastq(fastq, None, str(tmp_path), 'phred33', repair=True)
+    assert mateHeaders(pairs.batches()) == ([b'@b/1', b'@a/1'], [b'@b/2', b'@a/2'])
+    assert pairs.orphans == 1
@@ -0,0 +1,46 @@
+import logging
+import pytest
+from assemble import resources
+from assemble.resources import Resources, Allocation, nodeCores, nodeMemory
+
+
+@pytest.fixture
+def node(monkeypatch):
+    '''A node of 8 cores and 32 GB'''
+    monkeypatch.setattr(resources, 'nodeCores', lambda: 8)
+    monkeypatch.setattr(resources, 'nodeMemory', lambda: 32)
+    return
+
+def test_requests_within_the_node(node):
+    budget = Resources(4, 16)
+    assert (budget.threads, budget.memory) == (4, 16)
+    assert (budget.cores, budget.ram) == (8, 32)
+
+def test_requests_are_capped(node, caplog):
+    with caplog.at_level(logging.WARNING):
+        budget = Resources(64, 512)
+    assert (budget.threads, budget.memory) == (8, 32)
+    assert 'Requested 64 threads; node has 8 cores' in caplog.text
+
+def test_defaults_use_the_node(node):
+    budget = Resources()
+    assert budget.threads == 8
+    #Some memory is left to the operating system
+    assert budget.memory == 28
+
+def test_allocate(node):
+    budget = Resources(6, 20)
+    assert budget.allocate() == Allocation(6, 20)
+    assert budget.allocate(0.5) == Allocation(3, 10)
+    #Small shares still get one thread and one GB
+    assert budget.allocate(0.01) == Allocation(1, 1)
+
+def test_small_node(monkeypatch):
+    monkeypatch.setattr(resources, 'nodeCores', lambda: 1)
+    monkeypatch.setattr(resources, 'nodeMemory', lambda: 1)
+    budget = Resources()
+    assert (budget.threads, budget.memory) == (1, 1)
+
+def test_node_probes():
+    assert nodeCores() >= 1
+    assert nodeMemory() >= 0
@@ -0,0 +1,83 @@
+import sys
+import json
+import time
+import pytest
+from assemble import runner
+from assemble.runner import startCommand, waitCommand, runCommand, hasExited, seriesPath
+
+
+@pytest.fixture(autouse=True)
+def unsampled(monkeypatch):
+    monkeypatch.setitem(runner.SAMPLER, 'interval', None)
+    monkeypatch.setitem(runner.SAMPLER, 'memlimit', None)
+    return
+
+def records(metrics):
+    return([json.loads(line) for line in open(metrics)])
+
+def test_exit_codes():
+    assert waitCommand(startCommand(['true']), 'true').returncode == 0
+    assert waitCommand(startCommand('exit 3', shell=True), 'exit').returncode == 3
+    #Commands killed by a signal report its negative number, as subprocess does
+    assert waitCommand(startCommand('kill -9 $$', shell=True), 'kill').returncode == -9
+
+def test_wall_time():
+    run = waitCommand(startCommand(['sleep', '0.3']), 'sleep')
+    assert 0.3 <= run.wall < 5
+    #Sleeping uses next to no CPU
+    assert run.user + run.sys < 0.3
+
+def test_cpu_time_and_memory():
+    allocate = 'data = bytearray(50000000); sum(range(5000000))'
+    run = waitCommand(startCommand([sys.executable, '-c', allocate]), 'python')
+    assert run.user > 0
+    assert run.maxrss >= 50000
+
+def test_write_accounting(tmp_path):
+    output = tmp_path / 'zeros'
+    run = waitCommand(startCommand('head -c 200000 /dev/zero > {0}'.format(output), shell=True), 'head')
+    assert output.stat().st_size == 200000
+    #Characters written count every write call, whether or not it reached storage
+    assert run.writechars >= 200000
+    assert run.writebytes >= 0 and run.readbytes >= 0
+
+def test_metrics_lines(tmp_path):
+    metrics = str(tmp_path / 'metrics.jsonl')
+    log = open(str(tmp_path / 'run.log'), 'w')
+    first = runCommand(['echo', 'assembled'], 'spades', log, metrics)
+    second = runCommand('exit 1', 'abyss', log, metrics, shell=True)
+    log.close()
+    assert open(str(tmp_path / 'run.log')).read() == 'assembled\n'
+    lines = records(metrics)
+    assert [line['stage'] for line in lines] == ['spades', 'abyss']
+    assert lines[0]['command'] == 'echo assembled' and lines[1]['command'] == 'exit 1'
+    assert [line['returncode'] for line in lines] == [first.returncode, second.returncode] == [0, 1]
+    assert lines[0]['wall'] == round(first.wall, 3)
+    assert lines[0]['wchar'] == first.writechars >= len('assembled\n')
+    for key in ('pid', 'start', 'user', 'sys', 'maxrss_kb', 'read_bytes', 'write_bytes', 'rchar'):
+        assert key in lines[0]
+    #Unsampled commands carry no sampler fields
+    assert 'memory_exceeded' not in lines[0]
+
+def test_already_reaped():
+    process = startCommand(['sh', '-c', 'exit 2'])
+    process.wait()
+    run = waitCommand(process, 'reaped')
+    assert run.returncode == 2
+    assert (run.user, run.sys, run.maxrss, run.writechars) == (0.0, 0.0, 0, 0)
+
+def test_has_exited():
+    process = startCommand(['sleep', '0.2'])
+    assert not hasExited(process)
+    while not hasExited(process):
+        time.sleep(0.01)
+    #hasExited leaves the process for waitCommand to reap
+    assert process.returncode is None
+    assert waitCommand(process, 'sleep').returncode == 0
+
+def test_series_path(tmp_path):
+    assert seriesPath(None, 'spades', 'spades.py') is None
+    path = seriesPath(str(tmp_path / 'metrics.jsonl'), 'spades evaluate', 'spades.py')
+    assert path.startswith('{0}/spades_evaluate_'.format(tmp_path)) and path.endswith('.samples.tsv')
+    assert seriesPath(str(tmp_path / 'metrics.jsonl'), None, '/opt/bin/abyss-pe k=64').startswith(
+        '{0}/abyss-pe_'.format(tmp_path))
@@ -0,0 +1,61 @@
+import sys
+import json
+import pytest
+from assemble import runner
+from assemble.runner import configureSampler, startCommand, waitCommand, runCommand
+
+#Touches 400 MB, so it is resident, and holds it for up to 30 s
+ALLOCATE = '{0} -c "import time; data = bytearray(400000000); data[::4096] = bytes(97657); ' \
+    'time.sleep(30)"'.format(sys.executable)
+
+
+@pytest.fixture(autouse=True)
+def sampler(monkeypatch):
+    '''Restore the sampler configuration after each test'''
+    monkeypatch.setitem(runner.SAMPLER, 'interval', None)
+    monkeypatch.setitem(runner.SAMPLER, 'memlimit', None)
+    return
+
+def test_memory_ceiling_kills_the_tree(tmp_path):
+    configureSampler(0.05, 0.1)
+    metrics = str(tmp_path / 'metrics.jsonl')
+    log = open(str(tmp_path / 'run.log'), 'w')
+    #The shell would sleep on after its child is killed unless the whole tree goes
+    run = runCommand('{0}; sleep 30'.format(ALLOCATE), 'spades', log, metrics, shell=True)
+    log.close()
+    assert run.returncode == -9
+    assert run.wall < 15
+    record = json.loads(open(metrics).read())
+    assert record['memory_exceeded'] is True
+    assert record['sampled_peak_rss_kb'] > 104857
+    assert 'Stage spades killed; resident memory' in open(str(tmp_path / 'run.log')).read()
+
+def test_commands_under_the_ceiling_run(tmp_path):
+    configureSampler(0.05, 2)
+    metrics = str(tmp_path / 'metrics.jsonl')
+    run = runCommand(['sleep', '0.2'], 'sleep', None, metrics)
+    assert run.returncode == 0
+    record = json.loads(open(metrics).read())
+    assert record['memory_exceeded'] is False
+    assert record['sampled_peak_rss_kb'] > 0
+
+def test_series_is_written(tmp_path):
+    configureSampler(0.05)
+    series = str(tmp_path / 'sleep.samples.tsv')
+    process = startCommand('sleep 0.3 & sleep 0.3; wait', shell=True, stage='sleep', series=series)
+    assert waitCommand(process, 'sleep').returncode == 0
+    assert not process.sampler.exceeded
+    lines = [line.split('\t') for line in open(series).read().splitlines()]
+    assert lines[0] == ['Time', 'Elapsed', 'Processes', 'CPUPercent', 'RSSKB', 'OpenFiles', 'ReadBytes',
+        'WriteBytes']
+    assert len(lines) > 3
+    #The shell and both of its sleeps are sampled together
+    assert max([int(line[2]) for line in lines[1:]]) >= 3
+    assert all([int(line[4]) > 0 for line in lines[1:]])
+
+def test_unconfigured_sampler_is_off(tmp_path):
+    configureSampler(0.05)
+    configureSampler()
+    process = startCommand(['true'])
+    assert process.sampler is None
+    waitCommand(process, 'true')
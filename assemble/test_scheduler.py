@@ -0,0 +1,137 @@
+import time
+import threading
+import pytest
+from assemble import resources
+from assemble.resources import Resources
+from assemble.checkpoint import Checkpoint
+from assemble.scheduler import Scheduler
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    '''A budget of 4 threads and 8 GB'''
+    monkeypatch.setattr(resources, 'nodeCores', lambda: 64)
+    monkeypatch.setattr(resources, 'nodeMemory', lambda: 256)
+    return(Resources(4, 8))
+
+
+class Recorder:
+    '''Stage functions recording their start order and the threads and memory in use'''
+
+    def __init__(self, pause=0.1):
+        self.pause = pause
+        self.lock = threading.Lock()
+        self.started = list()
+        self.threads = 0
+        self.memory = 0
+        self.peak = (0, 0)
+        return
+
+    def stage(self, name, returncode=0):
+        def function(allocation):
+            with self.lock:
+                self.started.append(name)
+                self.threads += allocation.threads
+                self.memory += allocation.memory
+                self.peak = (max(self.peak[0], self.threads), max(self.peak[1], self.memory))
+            time.sleep(self.pause)
+            with self.lock:
+                self.threads -= allocation.threads
+                self.memory -= allocation.memory
+            return(returncode)
+        return(function)
+
+def failing(allocation):
+    raise RuntimeError('tool crashed')
+
+def test_failure_skips_only_downstream(budget):
+    recorder = Recorder(0)
+    scheduler = Scheduler(budget)
+    scheduler.add('clean', recorder.stage('clean'), share=0.25)
+    scheduler.add('spades', recorder.stage('spades', 1), ['clean'], 0.25)
+    scheduler.add('spades_evaluate', recorder.stage('spades_evaluate'), ['spades'], 0.25)
+    scheduler.add('spades_report', recorder.stage('spades_report'), ['spades_evaluate'], 0.25)
+    scheduler.add('abyss', failing, ['clean'], 0.25)
+    scheduler.add('abyss_evaluate', recorder.stage('abyss_evaluate'), ['abyss'], 0.25)
+    scheduler.add('sga', recorder.stage('sga'), ['clean'], 0.25)
+    scheduler.add('sga_evaluate', recorder.stage('sga_evaluate'), ['sga'], 0.25)
+    status = scheduler.run()
+    assert list(status.items()) == [('clean', 'done'), ('spades', 'failed'), ('spades_evaluate', 'skipped'),
+        ('spades_report', 'skipped'), ('abyss', 'failed'), ('abyss_evaluate', 'skipped'), ('sga', 'done'),
+        ('sga_evaluate', 'done')]
+    assert scheduler.stages['spades']['returncode'] == 1
+    assert scheduler.stages['abyss']['returncode'] == -1
+    assert 'spades_evaluate' not in recorder.started and 'abyss_evaluate' not in recorder.started
+
+def test_dependencies_run_first(budget):
+    recorder = Recorder(0.02)
+    scheduler = Scheduler(budget)
+    scheduler.add('clean', recorder.stage('clean'), share=0.25)
+    scheduler.add('normalize', recorder.stage('normalize'), ['clean'], 0.25)
+    scheduler.add('spades', recorder.stage('spades'), ['normalize'], 0.25)
+    scheduler.add('abyss', recorder.stage('abyss'), ['clean'], 0.25)
+    assert set(scheduler.run().values()) == set(['done'])
+    assert recorder.started[0] == 'clean'
+    assert recorder.started.index('normalize') < recorder.started.index('spades')
+
+def test_unknown_dependency(budget):
+    scheduler = Scheduler(budget)
+    with pytest.raises(ValueError):
+        scheduler.add('spades', failing, ['clean'])
+
+def test_budget_is_respected(budget):
+    recorder = Recorder()
+    scheduler = Scheduler(budget)
+    for index in range(6):
+        scheduler.add('stage{0}'.format(index), recorder.stage('stage{0}'.format(index)), share=0.5)
+    start = time.time()
+    assert set(scheduler.run().values()) == set(['done'])
+    #Two stages of 2 threads and 4 GB fit at a time, so six run in three waves
+    assert recorder.peak == (4, 8)
+    assert time.time() - start >= 0.3
+
+def test_memory_limits_concurrency(monkeypatch):
+    monkeypatch.setattr(resources, 'nodeCores', lambda: 64)
+    monkeypatch.setattr(resources, 'nodeMemory', lambda: 256)
+    recorder = Recorder()
+    scheduler = Scheduler(Resources(16, 8))
+    for index in range(4):
+        scheduler.add('stage{0}'.format(index), recorder.stage('stage{0}'.format(index)), share=0.5)
+    scheduler.run()
+    assert recorder.peak == (16, 8)
+
+def test_oversized_stage_runs_alone(budget):
+    recorder = Recorder()
+    scheduler = Scheduler(budget)
+    scheduler.add('small', recorder.stage('small'), share=0.25)
+    scheduler.add('large', recorder.stage('large'), share=2.0)
+    scheduler.add('after', recorder.stage('after'), share=0.25)
+    assert set(scheduler.run().values()) == set(['done'])
+    #Nothing else runs beside it, and smaller stages are not held back while it waits
+    assert recorder.peak == (8, 16)
+    assert recorder.started == ['small', 'after', 'large']
+
+def test_fair_share_across_groups(budget):
+    recorder = Recorder(0.2)
+    scheduler = Scheduler(budget)
+    for index in range(4):
+        scheduler.add('first{0}'.format(index), recorder.stage('first{0}'.format(index)), share=0.5,
+            group='first')
+    scheduler.add('second0', recorder.stage('second0'), share=0.5, group='second')
+    scheduler.run()
+    #Without fair share the second sample would wait for two waves of the first
+    assert set(recorder.started[:2]) == set(['first0', 'second0'])
+    assert set(recorder.started[2:4]) == set(['first1', 'first2']) and recorder.started[4] == 'first3'
+
+def test_checkpointed_stages_are_skipped(budget, tmp_path):
+    recorder = Recorder(0)
+    output = tmp_path / 'contigs.fa'
+    def assemble(allocation):
+        output.write_text('>c1\nACGT\n')
+        return(recorder.stage('assemble')(allocation))
+    for attempt in range(2):
+        scheduler = Scheduler(budget, Checkpoint(str(tmp_path / 'checkpoints.json')))
+        scheduler.add('assemble', assemble, params={'k' : 31}, outputs=[str(output)])
+        scheduler.add('evaluate', recorder.stage('evaluate'), ['assemble'], params={'minlen' : 0})
+        assert set(scheduler.run().values()) == set(['done'])
+    assert recorder.started == ['assemble', 'evaluate']
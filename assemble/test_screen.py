@@ -0,0 +1,94 @@
+import os
+import json
+import random
+import pytest
+import numpy as np
+from assemble.screen import KmerScreen
+from assemble.indexcache import IndexCache
+
+
+def randomSequence(rng, length):
+    return(''.join([rng.choice('ACGT') for index in range(length)]))
+
+def writePairs(path1, path2, pairs):
+    handle1 = open(path1, 'w')
+    handle2 = open(path2, 'w')
+    for name, seq1, seq2 in pairs:
+        handle1.write('@{0}/1\n{1}\n+\n{2}\n'.format(name, seq1, 'I' * len(seq1)))
+        handle2.write('@{0}/2\n{1}\n+\n{2}\n'.format(name, seq2, 'I' * len(seq2)))
+    handle1.close()
+    handle2.close()
+    return
+
+@pytest.fixture
+def contaminant(tmp_path):
+    '''Contaminant reference, 50 pairs drawn from it and 50 random pairs'''
+    rng = random.Random(7)
+    refdir = tmp_path / 'reference'
+    refdir.mkdir()
+    reference = randomSequence(rng, 20000)
+    (refdir / 'contaminant.fa').write_text('>contaminant\n{0}\n'.format(reference))
+    pairs = list()
+    for index in range(50):
+        start = rng.randrange(0, len(reference) - 400)
+        pairs.append(('con{0}'.format(index), reference[start:start + 100], reference[start + 250:start + 350]))
+        pairs.append(('ok{0}'.format(index), randomSequence(rng, 100), randomSequence(rng, 100)))
+    writePairs(str(tmp_path / 'r1.fq'), str(tmp_path / 'r2.fq'), pairs)
+    return(str(refdir / 'contaminant.fa'))
+
+def screenReads(tmp_path, screen, tag):
+    outputs = [str(tmp_path / '{0}_{1}.fq'.format(tag, name)) for name in ('clean1', 'clean2', 'cand1', 'cand2')]
+    metrics = screen.screen(str(tmp_path / 'r1.fq'), str(tmp_path / 'r2.fq'), *outputs, outdir=str(tmp_path))
+    names = [line.split('/')[0] for index, line in enumerate(open(outputs[2])) if index % 4 == 0]
+    return(metrics, names, [open(output).read() for output in outputs])
+
+def test_screen_sends_contaminant_pairs_to_alignment(tmp_path, contaminant):
+    screen = KmerScreen(contaminant, IndexCache(str(tmp_path / 'cache')))
+    metrics, names, outputs = screenReads(tmp_path, screen, 'single')
+    assert metrics['Pairs'] == 100
+    assert set(['@con{0}'.format(index) for index in range(50)]) <= set(names)
+    assert metrics['CandidatePairs'] <= 52
+
+def test_filter_is_cached_away_from_the_reference(tmp_path, contaminant):
+    cache = IndexCache(str(tmp_path / 'cache'))
+    before = set(os.listdir(os.path.dirname(contaminant)))
+    KmerScreen(contaminant, cache).load()
+    assert set(os.listdir(os.path.dirname(contaminant))) - before <= set(['contaminant.fa.fai'])
+    entries = [name for name in os.listdir(cache.cachedir) if name.endswith('.kmers.k25.fpr0.0001')]
+    assert len(entries) == 1
+    #A second screen maps the cached entry and never builds
+    rebuilt = KmerScreen(contaminant, cache)
+    rebuilt.build = None
+    settings = json.load(open('{0}/{1}/bloom.json'.format(cache.cachedir, entries[0])))
+    assert rebuilt.load().shape == (settings['words'],)
+    assert rebuilt.hashes == settings['hashes']
+
+def test_filter_is_sized_from_the_false_positive_rate(tmp_path, contaminant):
+    screen = KmerScreen(contaminant, IndexCache(str(tmp_path / 'cache')), fpr=0.01)
+    nwords, hashes = screen.size(1000000)
+    assert nwords * 64 == pytest.approx(1000000 * 9.585, rel=0.01)
+    assert hashes == 7
+    screen.load()
+    words = np.asarray(screen.words)
+    filled = np.unpackbits(words.view(np.uint8)).mean()
+    assert 0.4 < filled < 0.6
+
+def test_workers_map_the_parent_filter(tmp_path, contaminant):
+    cache = IndexCache(str(tmp_path / 'cache'))
+    single = screenReads(tmp_path, KmerScreen(contaminant, cache), 'single')
+    pooled = KmerScreen(contaminant, cache, processes=2)
+    #Neither the parent nor its workers may build the filter again
+    pooled.build = None
+    assert screenReads(tmp_path, pooled, 'pooled')[2] == single[2]
+
+def test_single_shared_kmer_is_aligned_by_default(tmp_path, contaminant):
+    reference = open(contaminant).read().split('\n')[1]
+    rng = random.Random(9)
+    #One contaminant 25-mer inside otherwise random mates, its flanking bases differing from the reference
+    other = dict(zip('ACGT', 'CGTA'))
+    seq1 = randomSequence(rng, 39) + other[reference[4999]] + reference[5000:5025] + other[reference[5025]] + \
+        randomSequence(rng, 34)
+    writePairs(str(tmp_path / 'r1.fq'), str(tmp_path / 'r2.fq'), [('one', seq1, randomSequence(rng, 100))])
+    cache = IndexCache(str(tmp_path / 'cache'))
+    assert screenReads(tmp_path, KmerScreen(contaminant, cache), 'default')[1] == ['@one']
+    assert screenReads(tmp_path, KmerScreen(contaminant, cache, minhits=2), 'two')[1] == []
@@ -0,0 +1,102 @@
+import gzip
+import zlib
+import shutil
+import struct
+import subprocess
+import pytest
+from assemble import streams
+from assemble.streams import InputStream, InputPipe, detectFormat, openInput
+
+DATA = ''.join(['@r{0}\nACGTACGTNN\n+\nIIIIIIII##\n'.format(index) for index in range(20000)]).encode()
+
+
+def bgzfBlock(data):
+    '''Return one BGZF block of data, a gzip member with the BC extra subfield'''
+    deflate = zlib.compressobj(6, zlib.DEFLATED, -15)
+    cdata = deflate.compress(data) + deflate.flush()
+    header = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff' + struct.pack('<H', 6) + b'BC' + \
+        struct.pack('<HH', 2, len(cdata) + 25)
+    return(header + cdata + struct.pack('<II', zlib.crc32(data), len(data)))
+
+def writeBgzf(path, data, blocksize=1000):
+    handle = open(path, 'wb')
+    for start in range(0, len(data), blocksize):
+        handle.write(bgzfBlock(data[start:start + blocksize]))
+    #End of file marker is an empty block
+    handle.write(bgzfBlock(b''))
+    handle.close()
+    return(path)
+
+def readAll(stream, size=65536):
+    parts = list()
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        parts.append(chunk)
+    stream.close()
+    return(b''.join(parts))
+
+def test_detect_format(tmp_path):
+    plain = tmp_path / 'reads.fq'
+    plain.write_bytes(DATA)
+    compressed = tmp_path / 'reads.fq.gz'
+    compressed.write_bytes(gzip.compress(DATA))
+    assert detectFormat(str(plain)) == 'plain'
+    assert detectFormat(str(compressed)) == 'gzip'
+    assert detectFormat(writeBgzf(str(tmp_path / 'reads.fq.bgz'), DATA)) == 'bgzf'
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_bgzf_round_trip(tmp_path, threads):
+    #Hundreds of blocks, so groups are inflated in parallel and must come back in order
+    bgzf = writeBgzf(str(tmp_path / 'reads.fq.bgz'), DATA)
+    assert readAll(InputStream(bgzf, threads)) == DATA
+
+def test_gzip_round_trip_without_pigz(tmp_path, monkeypatch):
+    monkeypatch.setattr(streams.shutil, 'which', lambda name: None)
+    compressed = tmp_path / 'reads.fq.gz'
+    #Concatenated members, as written by parallel compressors
+    compressed.write_bytes(gzip.compress(DATA[:1000]) + gzip.compress(DATA[1000:]))
+    stream = InputStream(str(compressed))
+    assert stream.process is None
+    assert readAll(stream, 777) == DATA
+
+def test_zstd_round_trip(tmp_path):
+    if shutil.which('zstd') is None:
+        pytest.skip('zstd is not installed')
+    plain = tmp_path / 'reads.fq'
+    plain.write_bytes(DATA)
+    subprocess.check_call(['zstd', '-q', str(plain), '-o', str(tmp_path / 'reads.fq.zst')])
+    assert detectFormat(str(tmp_path / 'reads.fq.zst')) == 'zstd'
+    assert readAll(openInput(str(tmp_path / 'reads.fq.zst'), 2)) == DATA
+
+def test_zstd_round_trip_in_process(tmp_path, monkeypatch):
+    zstandard = pytest.importorskip('zstandard')
+    monkeypatch.setattr(streams.shutil, 'which', lambda name: None)
+    compressed = tmp_path / 'reads.fq.zst'
+    compressed.write_bytes(zstandard.ZstdCompressor().compress(DATA))
+    assert readAll(InputStream(str(compressed))) == DATA
+
+def test_corrupt_bgzf_raises(tmp_path):
+    bgzf = tmp_path / 'reads.fq.bgz'
+    bgzf.write_bytes(bgzfBlock(DATA[:1000]) + b'\x1f\x8b\x08\x04garbage')
+    with pytest.raises(IOError):
+        readAll(InputStream(str(bgzf)))
+
+def test_input_pipe(tmp_path):
+    plain = tmp_path / 'reads.fq'
+    plain.write_bytes(DATA)
+    #Plain files are passed through
+    passthrough = InputPipe(str(plain), str(tmp_path))
+    assert passthrough.path == str(plain)
+    passthrough.close()
+    pipe = InputPipe(writeBgzf(str(tmp_path / 'reads.fq.bgz'), DATA), str(tmp_path), 2)
+    assert pipe.path.endswith('/reads.fq') and pipe.path != str(plain)
+    assert open(pipe.path, 'rb').read() == DATA
+    pipe.close()
+    assert [path.name for path in tmp_path.iterdir() if path.name.startswith('pipe_')] == []
+
+def test_input_pipe_unread(tmp_path):
+    #Closing a pipe nobody opened does not hang on the feeder
+    pipe = InputPipe(writeBgzf(str(tmp_path / 'reads.fq.bgz'), DATA), str(tmp_path))
+    pipe.close()
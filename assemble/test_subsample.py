@@ -0,0 +1,78 @@
+import random
+from assemble.readers import Fastq
+from assemble.subsample import Subsampler, genomeSize
+
+
+def writePairs(tmp_path, pairs=400, length=100):
+    '''Write pairs of random reads whose mates share the name p<index>'''
+    rng = random.Random(11)
+    reads = list()
+    for mate in (1, 2):
+        fastq = tmp_path / 'r{0}.fq'.format(mate)
+        fastq.write_text(''.join(['@p{0:04d}/{1}\n{2}\n+\n{3}\n'.format(index, mate,
+            ''.join([rng.choice('ACGT') for base in range(length)]), 'I' * length) for index in range(pairs)]))
+        reads.append(str(fastq))
+    return(reads)
+
+def names(fastq):
+    return([line.rstrip('\n') for index, line in enumerate(open(fastq)) if index % 4 == 0])
+
+def subsample(tmp_path, reads, tag, gsize=10000, depth=2, seed=0):
+    outputs = [str(tmp_path / '{0}_{1}.fq'.format(tag, mate)) for mate in (1, 2)]
+    metrics = Subsampler(gsize, depth, seed=seed).subsamplePairs(reads[0], reads[1], *outputs, outdir=str(tmp_path))
+    return(metrics, [names(output) for output in outputs])
+
+def test_genome_size():
+    assert genomeSize('30m') == 30000000
+    assert genomeSize('2.5M') == 2500000
+    assert genomeSize(' 100k ') == 100000
+    assert genomeSize('1g') == 1000000000
+    assert genomeSize(4600000) == 4600000
+    assert genomeSize('4.6e6') == 4600000
+
+def test_pairs_are_kept_together(tmp_path):
+    reads = writePairs(tmp_path)
+    metrics, (names1, names2) = subsample(tmp_path, reads, 'pairs')
+    #2x of 10 kb is 100 pairs of 2 x 100 bp
+    assert metrics['ReadsKept'] == 100 and metrics['BasesKept'] == 20000
+    assert [name[:-2] for name in names1] == [name[:-2] for name in names2]
+    assert all([name.endswith('/1') for name in names1]) and all([name.endswith('/2') for name in names2])
+    #Kept pairs are written in input order
+    assert names1 == sorted(names1)
+
+def test_seed_reproducibility(tmp_path):
+    reads = writePairs(tmp_path)
+    first = subsample(tmp_path, reads, 'first', seed=1)[1]
+    assert subsample(tmp_path, reads, 'again', seed=1)[1] == first
+    assert subsample(tmp_path, reads, 'other', seed=2)[1] != first
+
+def test_selection_ignores_batch_boundaries(tmp_path):
+    reads = writePairs(tmp_path)
+    whole = subsample(tmp_path, reads, 'whole', depth=1)[1]
+    outputs = [str(tmp_path / 'small_{0}.fq'.format(mate)) for mate in (1, 2)]
+    #Small blocks tighten the spool threshold many times before the end of the input
+    batches = zip(*[Fastq(read, str(tmp_path), 'phred33', blocksize=4096).batches() for read in reads])
+    def reread(spools):
+        return(zip(*[Fastq(spool, str(tmp_path), 'phred33').batches() for spool in spools]))
+    Subsampler(10000, 1).select(batches, outputs, reread, str(tmp_path))
+    assert [names(output) for output in outputs] == whole
+
+def test_shallow_input_passes_through(tmp_path):
+    reads = writePairs(tmp_path, pairs=20)
+    metrics, kept = subsample(tmp_path, reads, 'shallow', depth=50)
+    assert metrics['ReadsKept'] == metrics['Reads'] == 20
+    assert metrics['RetainedFraction'] == 1.0
+    for read, mate in zip(reads, (1, 2)):
+        assert open(str(tmp_path / 'shallow_{0}.fq'.format(mate))).read() == open(read).read()
+    #The spool directory is moved out or removed either way
+    assert [path.name for path in tmp_path.iterdir() if path.name.startswith('subsample_')] == []
+
+def test_longest_reads_first(tmp_path):
+    fastq = tmp_path / 'long.fq'
+    lengths = [500, 2000, 1000, 3000, 100]
+    fastq.write_text(''.join(['@l{0}\n{1}\n+\n{2}\n'.format(index, 'A' * length, 'I' * length)
+        for index, length in enumerate(lengths)]))
+    output = str(tmp_path / 'longest.fq')
+    metrics = Subsampler(1000, 5, longest=True).subsampleReads(str(fastq), output, str(tmp_path))
+    assert names(output) == ['@l1', '@l3']
+    assert metrics['BasesKept'] == 5000
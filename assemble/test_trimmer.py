@@ -0,0 +1,123 @@
+import random
+import numpy as np
+from assemble.trimmer import (BASE_CODES, Trimmer, adapterKmers, adapterTrim, qualityTrim, packKmer,
+    reverseComplement)
+
+ADAPTER = 'AGATCGGAAGAGCACACGTCTGAACTCCAGTCA'
+
+
+def writeAdapters(tmp_path):
+    adapters = tmp_path / 'adapters.fa'
+    adapters.write_text('>truseq\n{0}\n'.format(ADAPTER))
+    return(str(adapters))
+
+def codeMatrix(seqs):
+    '''Return the zero padded (reads x cycles) code matrix of seqs and their lengths'''
+    lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+    matrix = np.zeros((len(seqs), int(lengths.max())), dtype=np.uint8)
+    for index, seq in enumerate(seqs):
+        matrix[index,:len(seq)] = np.frombuffer(seq.encode(), dtype=np.uint8)
+    return(BASE_CODES[matrix], lengths)
+
+def naiveClip(seq, k, mink):
+    '''Clip seq at its first adapter k-mer, else at the longest adapter prefix ending it'''
+    kmers = set()
+    prefixes = set()
+    for adapter in (ADAPTER, reverseComplement(ADAPTER)):
+        kmers.update([adapter[start:start + k] for start in range(len(adapter) - k + 1)])
+        prefixes.update([adapter[:size] for size in range(mink, k)])
+    for start in range(len(seq) - k + 1):
+        if seq[start:start + k] in kmers:
+            return(start, True)
+    for size in range(k - 1, mink - 1, -1):
+        if size <= len(seq) and seq[len(seq) - size:] in prefixes:
+            return(len(seq) - size, True)
+    return(len(seq), False)
+
+def test_adapter_kmers(tmp_path):
+    kmers, prefixes = adapterKmers([writeAdapters(tmp_path)], k=11, mink=5)
+    #Both orientations of a 33 base adapter
+    assert len(kmers) == 2 * (33 - 11 + 1)
+    assert np.all(kmers[1:] > kmers[:-1])
+    assert packKmer(ADAPTER[:11]) in kmers.tolist()
+    assert packKmer(reverseComplement(ADAPTER)[:11]) in kmers.tolist()
+    assert sorted(prefixes) == list(range(5, 11))
+    assert prefixes[7].tolist() == sorted([packKmer(ADAPTER[:7]), packKmer(reverseComplement(ADAPTER)[:7])])
+
+def test_adapter_clipping(tmp_path):
+    kmers, prefixes = adapterKmers([writeAdapters(tmp_path)], k=11, mink=5)
+    insert = 'TTTTTTTTTTCCCCCCCCCC'
+    seqs = [insert + ADAPTER,
+        #Only the adapter prefix fits at the end of the read
+        insert + ADAPTER[:8],
+        insert + ADAPTER[:4],
+        #An N breaks the full k-mer, but a later k-mer still matches
+        insert + 'AGNTCGGAAGAGCACACGTC',
+        insert + reverseComplement(ADAPTER),
+        'GG' + ADAPTER,
+        insert]
+    codes, lengths = codeMatrix(seqs)
+    clip, found = adapterTrim(codes, lengths, kmers, prefixes, 11, 5)
+    assert clip.tolist() == [20, 20, 24, 23, 20, 2, 20]
+    assert found.tolist() == [True, True, False, True, True, True, False]
+
+def test_adapter_clipping_matches_naive_search(tmp_path):
+    kmers, prefixes = adapterKmers([writeAdapters(tmp_path)], k=11, mink=5)
+    rng = random.Random(3)
+    seqs = list()
+    for index in range(400):
+        seq = ''.join([rng.choice('ACGTN' if index % 7 == 0 else 'ACGT') for base in range(rng.randint(5, 60))])
+        adapter = rng.choice((ADAPTER, reverseComplement(ADAPTER)))
+        seqs.append((seq + adapter[:rng.randint(0, 33)])[:80])
+    codes, lengths = codeMatrix(seqs)
+    clip, found = adapterTrim(codes, lengths, kmers, prefixes, 11, 5)
+    assert list(zip(clip.tolist(), found.tolist())) == [naiveClip(seq, 11, 5) for seq in seqs]
+
+def test_quality_window():
+    quals = np.array([[2, 2, 40, 40, 40, 40, 40, 40, 2, 2]], dtype=np.uint8)
+    clip = np.array([10])
+    left, right = qualityTrim(quals, clip, 30, 2)
+    assert (left.tolist(), right.tolist()) == ([2], [8])
+    #A good base next to a bad one falls just short of the mean
+    quals[0,1] = 19
+    assert qualityTrim(quals, clip, 30, 2)[0].tolist() == [2]
+    #A window exactly at the threshold is kept
+    quals[0,1] = 20
+    quals[0,0] = 40
+    assert qualityTrim(quals, clip, 30, 2)[0].tolist() == [0]
+
+def test_quality_trim_respects_adapter_clip():
+    quals = np.full((2, 10), 40, dtype=np.uint8)
+    left, right = qualityTrim(quals, np.array([6, 10]), 30, 4)
+    assert (left.tolist(), right.tolist()) == ([0, 0], [6, 10])
+
+def test_quality_trim_without_good_windows():
+    quals = np.array([[10, 10, 10, 10], [40, 40, 0, 0]], dtype=np.uint8)
+    left, right = qualityTrim(quals, np.array([4, 2]), 30, 4)
+    #Windows longer than the clipped read cannot fit, so nothing is kept
+    assert (left.tolist(), right.tolist()) == ([0, 0], [0, 0])
+    #trimq of 0 turns quality trimming off
+    left, right = qualityTrim(quals, np.array([4, 2]), 0, 4)
+    assert (left.tolist(), right.tolist()) == ([0, 0], [4, 2])
+    #Windows are capped at the read width
+    assert qualityTrim(quals[1:], np.array([2]), 30, 10)[1].tolist() == [0]
+
+def test_trim_pairs(tmp_path):
+    trimmer = Trimmer([writeAdapters(tmp_path)], k=11, mink=5, trimq=20, window=1, minlength=20)
+    rng = random.Random(9)
+    inserts = [''.join([rng.choice('ACGT') for base in range(40)]) for index in range(3)]
+    reads = [(inserts[0], inserts[0]),
+        (inserts[1] + ADAPTER, inserts[1][:30] + ADAPTER),
+        #Too short once the adapter is clipped, so the pair is dropped
+        (inserts[2][:15] + ADAPTER, inserts[2])]
+    for mate in (0, 1):
+        (tmp_path / 'r{0}.fq'.format(mate + 1)).write_text(''.join(['@p{0}/{1}\n{2}\n+\n{3}\n'.format(index,
+            mate + 1, pair[mate], '#' * 2 + 'I' * (len(pair[mate]) - 2)) for index, pair in enumerate(reads)]))
+    metrics = trimmer.trim(str(tmp_path / 'r1.fq'), str(tmp_path / 'r2.fq'), str(tmp_path / 'o1.fq'),
+        str(tmp_path / 'o2.fq'), str(tmp_path))
+    assert (metrics['Pairs'], metrics['PairsKept'], metrics['AdapterReads']) == (3, 2, 3)
+    assert metrics['BasesOut'] == 38 + 38 + 38 + 28
+    trimmed = open(str(tmp_path / 'o1.fq')).read().splitlines()
+    assert trimmed[:4] == ['@p0/1', inserts[0][2:], '+', 'I' * 38]
+    assert trimmed[4:] == ['@p1/1', inserts[1][2:], '+', 'I' * 38]
+    assert open(str(tmp_path / 'o2.fq')).read().splitlines()[5] == inserts[1][2:30]
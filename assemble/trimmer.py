@@ -0,0 +1,246 @@
+import timeit
+import logging
+import collections
+import numpy as np
+from Bio import SeqIO
+from multiprocessing import Pool
+from collections import OrderedDict
+from assemble.readers import Fastq, PairedFastq, fieldIndex, parseBatch
+
+#Two bit base codes; anything other than ACGT is 4 and breaks k-mers
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate('ACGT'):
+    BASE_CODES[ord(base)] = code
+    BASE_CODES[ord(base.lower())] = code
+#Trimmer shared with pool workers, set once per worker by initWorker
+TRIM_WORKER = {'trimmer' : None}
+
+
+def packKmer(seq):
+    '''Return the 2 bit encoding of a sequence, or None if it holds a base other than ACGT'''
+    value = 0
+    for base in seq.upper():
+        if base not in 'ACGT':
+            return(None)
+        value = (value << 2) | 'ACGT'.index(base)
+    return(value)
+
+def reverseComplement(seq):
+    return(seq.upper()[::-1].translate(str.maketrans('ACGT', 'TGCA')))
+
+def adapterKmers(adapters, k=27, mink=11):
+    '''Index adapter fasta files as sorted arrays of 2 bit k-mers.
+
+    Returns the k-mers of every adapter in both orientations, and for
+    each length from mink to k - 1 the adapter prefixes of that length,
+    used to find adapters running off the end of a read.
+    '''
+    kmers = set()
+    prefixes = dict([(size, set()) for size in range(mink, k)])
+    for adapterfile in adapters:
+        for record in SeqIO.parse(adapterfile, 'fasta'):
+            for seq in (str(record.seq).upper(), reverseComplement(str(record.seq))):
+                for start in range(len(seq) - k + 1):
+                    value = packKmer(seq[start:start + k])
+                    if value is not None:
+                        kmers.add(value)
+                for size in range(mink, min(k, len(seq) + 1)):
+                    value = packKmer(seq[:size])
+                    if value is not None:
+                        prefixes[size].add(value)
+    kmers = np.array(sorted(kmers), dtype=np.uint64)
+    prefixes = dict([(size, np.array(sorted(values), dtype=np.uint64)) for size, values in prefixes.items()])
+    return(kmers, prefixes)
+
+def contains(index, values):
+    '''Return a boolean array, True where values are in the sorted array index'''
+    if len(index) == 0:
+        return(np.zeros(values.shape, dtype=bool))
+    position = np.minimum(np.searchsorted(index, values), len(index) - 1)
+    return(index[position] == values)
+
+def packKmers(codes, k):
+    '''Return 2 bit k-mers at every position of a (reads x cycles) code matrix, and their validity'''
+    nreads, width = codes.shape
+    npos = max(0, width - k + 1)
+    if npos == 0:
+        return(np.zeros((nreads, 0), dtype=np.uint64), np.zeros((nreads, 0), dtype=bool))
+    #Build k-mers from power of two sized ones, in log2(k) passes over the matrix
+    power = (codes & 3).astype(np.uint64)
+    size = 1
+    values = None
+    vsize = 0
+    remaining = k
+    while remaining:
+        if remaining & 1:
+            if values is None:
+                values, vsize = power, size
+            else:
+                columns = width - vsize - size + 1
+                values = (values[:,:columns] << np.uint64(2 * size)) | power[:,vsize:vsize + columns]
+                vsize += size
+        remaining >>= 1
+        if remaining:
+            columns = width - 2 * size + 1
+            power = (power[:,:columns] << np.uint64(2 * size)) | power[:,size:size + columns]
+            size *= 2
+    values = values[:,:npos]
+    #K-mers holding an N, or running into the padding, are invalid
+    bad = np.zeros((nreads, width + 1), dtype=np.int32)
+    bad[:,1:] = np.cumsum(codes > 3, axis=1)
+    valid = (bad[:,k:] - bad[:,:npos]) == 0
+    return(values, valid)
+
+def adapterTrim(codes, lengths, kmers, prefixes, k, mink):
+    '''Return read lengths after clipping from the first adapter k-mer, and which reads were clipped'''
+    values, valid = packKmers(codes, k)
+    hits = valid & contains(kmers, values)
+    found = hits.any(axis=1)
+    clip = lengths.copy()
+    clip[found] = hits.argmax(axis=1)[found]
+    #Reads without a full k-mer may end in an adapter prefix; the longest wins
+    rest = np.flatnonzero(~found)
+    for size in range(k - 1, mink - 1, -1):
+        if len(rest) == 0:
+            break
+        starts = lengths[rest] - size
+        columns = np.maximum(starts[:,None] + np.arange(size), 0)
+        suffix = codes[rest[:,None], columns]
+        shifts = (2 * np.arange(size - 1, -1, -1)).astype(np.uint64)
+        value = ((suffix & 3).astype(np.uint64) << shifts).sum(axis=1, dtype=np.uint64)
+        good = (starts >= 0) & (suffix < 4).all(axis=1) & contains(prefixes[size], value)
+        clip[rest[good]] = starts[good]
+        found[rest[good]] = True
+        rest = rest[~good]
+    return(clip, found)
+
+def qualityTrim(quals, clip, trimq, window):
+    '''Return the first and last base of the span from the first to the last window of mean quality trimq'''
+    nreads, width = quals.shape
+    if trimq <= 0:
+        return(np.zeros(nreads, dtype=np.int64), clip)
+    window = max(1, min(window, width))
+    sums = np.zeros((nreads, width + 1), dtype=np.int32)
+    sums[:,1:] = np.cumsum(quals, axis=1)
+    npos = width - window + 1
+    good = (sums[:,window:] - sums[:,:npos]) >= trimq * window
+    good &= (np.arange(npos) + window) <= clip[:,None]
+    anygood = good.any(axis=1)
+    left = np.where(anygood, good.argmax(axis=1), 0)
+    right = np.where(anygood, npos - good[:,::-1].argmax(axis=1) - 1 + window, 0)
+    return(left, right)
+
+def formatRecords(batch, left, right, keep):
+    '''Return fastq text of the kept records with sequence and quality cut to left and right'''
+    starts = batch.starts[keep]
+    ends = batch.ends[keep]
+    left = left[keep]
+    right = right[keep]
+    #Newline and separator bytes are appended to the buffer and addressed like any field
+    tail = len(batch.buf)
+    buf = np.concatenate((batch.buf, np.frombuffer(b'\n+\n', dtype=np.uint8)))
+    segstarts = np.empty((len(starts), 6), dtype=np.int64)
+    segends = np.empty((len(starts), 6), dtype=np.int64)
+    segstarts[:,0], segends[:,0] = starts[:,0], ends[:,0]
+    segstarts[:,1], segends[:,1] = tail, tail + 1
+    segstarts[:,2], segends[:,2] = starts[:,1] + left, starts[:,1] + right
+    segstarts[:,3], segends[:,3] = tail, tail + 3
+    segstarts[:,4], segends[:,4] = starts[:,3] + left, starts[:,3] + right
+    segstarts[:,5], segends[:,5] = tail, tail + 1
+    return(buf[fieldIndex(segstarts.ravel(), segends.ravel())].tobytes())
+
+def initWorker(trimmer):
+    TRIM_WORKER['trimmer'] = trimmer
+    return
+
+def trimWorker(raws):
+    '''Trim one pair of raw fastq blocks in a pool worker'''
+    trimmer = TRIM_WORKER['trimmer']
+    return(trimmer.trimPair(parseBatch(trimmer.reader, raws[0]),
+        parseBatch(trimmer.reader, raws[1])))
+
+
+class Trimmer:
+    '''Adapter and quality trimmer for paired illumina reads.
+
+    Reads are clipped from the first k-mer shared with the adapters, or
+    from an adapter prefix of at least mink bases at their end, then cut
+    to the span between the first and last window of mean quality trimq.
+    Pairs where either mate ends up shorter than minlength are dropped.
+    The defaults mirror the BBDuk settings used by Cleaner.trimIllumina.
+    '''
+
+    def __init__(self, adapters, k=27, mink=11, trimq=30, window=4, minlength=80, phred='phred33',
+        processes=1):
+        self.adapters = adapters
+        self.k = k
+        self.mink = mink
+        self.trimq = trimq
+        self.window = window
+        self.minlength = minlength
+        self.phred = phred
+        self.processes = processes
+        self.kmers, self.prefixes = adapterKmers(adapters, k, mink)
+        self.reader = Fastq(None, None, phred)
+        return
+
+    def trimBatch(self, batch):
+        '''Return first and last kept base of every read in a batch, and which reads held adapters'''
+        seqs, lengths = batch.fieldMatrix(1)
+        clip, adapter = adapterTrim(BASE_CODES[seqs], lengths, self.kmers, self.prefixes, self.k, self.mink)
+        quals, quallengths = batch.qualMatrix(self.reader.phredtable)
+        left, right = qualityTrim(quals, clip, self.trimq, self.window)
+        return(left, right, adapter)
+
+    def trimPair(self, batch1, batch2):
+        '''Trim aligned batches of mates; return fastq text of kept pairs and counts'''
+        left1, right1, adapter1 = self.trimBatch(batch1)
+        left2, right2, adapter2 = self.trimBatch(batch2)
+        keep = (right1 - left1 >= self.minlength) & (right2 - left2 >= self.minlength)
+        counts = np.array([len(batch1), int(keep.sum()), int(adapter1.sum() + adapter2.sum()),
+            int(batch1.lengths().sum() + batch2.lengths().sum()),
+            int((right1 - left1)[keep].sum() + (right2 - left2)[keep].sum())], dtype=np.int64)
+        return(formatRecords(batch1, left1, right1, keep), formatRecords(batch2, left2, right2, keep), counts)
+
+    def trim(self, read1, read2, outfile1, outfile2, outdir, threads=1):
+        '''Trim paired fastq files into outfile1 and outfile2; return summary metrics.
+
+        Batches are trimmed in a pool of processes workers with at most two
+        batches per worker in flight, and written in input order.
+        '''
+        start = timeit.default_timer()
+        pairs = PairedFastq(read1, read2, outdir, self.phred, threads=threads)
+        handle1 = open(outfile1, 'wb')
+        handle2 = open(outfile2, 'wb')
+        counts = np.zeros(5, dtype=np.int64)
+
+        def write(result):
+            handle1.write(result[0])
+            handle2.write(result[1])
+            counts[:] += result[2]
+
+        if self.processes > 1:
+            pool = Pool(self.processes, initializer=initWorker, initargs=(self,))
+            pending = collections.deque()
+            for batch1, batch2 in pairs.batches():
+                pending.append(pool.apply_async(trimWorker, ((batch1.raw(), batch2.raw()),)))
+                if len(pending) >= self.processes * 2:
+                    write(pending.popleft().get())
+            while pending:
+                write(pending.popleft().get())
+            pool.close()
+            pool.join()
+        else:
+            for batch1, batch2 in pairs.batches():
+                write(self.trimPair(batch1, batch2))
+        handle1.close()
+        handle2.close()
+        metrics = OrderedDict()
+        metrics['Pairs'] = int(counts[0])
+        metrics['PairsKept'] = int(counts[1])
+        metrics['AdapterReads'] = int(counts[2])
+        metrics['BasesIn'] = int(counts[3])
+        metrics['BasesOut'] = int(counts[4])
+        metrics['Runtime'] = timeit.default_timer() - start
+        logging.info('Trimmed {0} pairs; {1} kept'.format(metrics['Pairs'], metrics['PairsKept']))
+        return(metrics)
@@ -15,6 +15,7 @@ from Bio import SeqIO
 from itertools import repeat
 from multiprocessing import Pool
 from collections import defaultdict
+from collections import OrderedDict
 from assemble.abyss import Abyss
 from assemble.spades import Spades
 from assemble.ngopt import Ngopt
@@ -24,262 +25,382 @@ from assemble.sprai import Sprai
 from assemble.spades_pacbio import SpadesHybrid
 from assemble.canu import Canu
 from assemble.cleaner import Cleaner
+from assemble.screen import KmerScreen
+from assemble.indexcache import IndexCache
+from assemble.normalize import Normalizer
+from assemble.subsample import Subsampler, genomeSize
 from assemble.evaluate import Evaluate
+from assemble.readers import fastqStats
+from assemble.resources import Resources
+from assemble.scheduler import Scheduler
+from assemble.checkpoint import Checkpoint
+from assemble.runner import configureSampler
 
-def alignAssembly(bowtie_path, sam_path, jelly_path, read1, read2, pacbio, assembly, outdir, threads, names, xml):
+def alignAssembly(bowtie_path, sam_path, jelly_path, read1, read2, pacbio, assembly, outdir, threads, names, xml, memory=None,
+    indexcache=None):
     if assembly:
         for fasta, method in zip(assembly, names):
             logging.info('Aligning reads to assembly : {0}'.format(method))
-            evaluate = Evaluate(bowtie_path, sam_path, jelly_path, read1, read2, None, fasta, outdir, threads, method, None)
+            evaluate = Evaluate(bowtie_path, sam_path, jelly_path, read1, read2, None, fasta, outdir, threads, method, None, memory,
+                indexcache)
             logging.info('Building index')
             eret = evaluate.buildIndex()
-            logging.info('Aligning reads')
-            eret = evaluate.alignIllumina()
-            logging.info('Sorting sam file')
-            eret = evaluate.sortBam()
-            logging.info('Indexing bam file')
-            eret = evaluate.indexBam()
+            if eret != 0:
+                logging.error('Indexing failed for {0}; Check evaluate log : {1}'.format(method, evaluate.log))
+                continue
+            logging.info('Aligning, sorting and indexing reads')
+            #The cached index cannot be evicted while bowtie reads it
+            with evaluate.indexcache.hold(evaluate.assemblyindex):
+                eret = evaluate.alignStream()
+            if eret != 0:
+                logging.error('Alignment failed for {0}; Check evaluate log : {1}'.format(method, evaluate.log))
+                continue
             logging.info('Alignment complete for {0}'.format(method))
-            evaluate.cleanSam()
+            logging.info('Computing coverage metrics')
+            eret = evaluate.coverageMetrics()
+            if eret != 0:
+                logging.error('Coverage metrics failed for {0}; Check evaluate log : {1}'.format(method, evaluate.log))
+            logging.info('Scanning for misassembly breakpoints')
+            eret = evaluate.breakpoints()
+            if eret != 0:
+                logging.error('Breakpoint detection failed for {0}; Check evaluate log : {1}'.format(method, evaluate.log))
     elif xml:
         for pbassembly in xml:
             logging.info('Starting PB jelly for : {0}'.format(pbassembly))
             evaluate = Evaluate(bowtie_path, sam_path, jelly_path, None, None, None, None, outdir, threads, method, pbassembly)
     return
 
-def cleanup(bowtie_path, bbduk_path, read1, read2, pacbio, confile, outdir, threads):
-    cleaner = Cleaner(bowtie_path, bbduk_path, read1, read2, pacbio, confile, outdir, threads)
-    logging.info('Building bowtie index')
-    cret = cleaner.buildIndex()
-    if cret == 0:
-        logging.info("Bowtie index built")
-    else:
-        logging.error("Bowtie index failed")
-        sys.exit()
-    
-    logging.info("Removing contaminants from illumina reads")
-    cret = cleaner.deconIllumina()
-    if cret == 0:
-        logging.info("Contaminants removed from illumina reads")
-    else:
-        logging.error("Bowtie failed on illumina reads")
-        sys.exit()
-
-    cleaner.cleanSam()
-
-    logging.info("Removing contaminants from pacbio reads")
-    cret = cleaner.deconPacbio()
-    if cret == 0:
-        logging.info("Contaminants removed from pacbio reads")
-    else:
-        logging.error("Bowtie failed on pacbio reads")
-        sys.exit()
-    cleaner.cleanSam()
+def readStats(read1, read2, outdir, threads):
+    '''Compute quality control metrics for illumina reads before assembly'''
+    qcdir = '{0}/read_stats'.format(os.path.abspath(outdir))
+    if not os.path.exists(qcdir):
+        os.mkdir(qcdir)
+    for fastq, name in zip([read1, read2], ['r1', 'r2']):
+        logging.info('Computing read statistics for : {0}'.format(fastq))
+        stats = fastqStats(fastq, 'phred33', int(threads))
+        stats.write('{0}/{1}'.format(qcdir, name))
+        for metric, value in stats.summary().items():
+            logging.info('{0} {1} : {2}'.format(name, metric, value))
+    logging.info('Read statistics can be found at : {0}'.format(qcdir))
     return
 
-def realign(bowtie_path, bbduk_path, read1, read2, confile, outdir, threads):
-    cleaner = Cleaner(bowtie_path, bbduk_path, read1, read2, None, confile, outdir, threads)
+def decontaminate(cleaner, trimmer='bbduk', screen=None, keepbam=False):
+    '''Remove contaminants from and trim the illumina reads of a cleaner whose index is built'''
+    #The cached index cannot be evicted while bowtie reads it
+    with cleaner.indexcache.hold(cleaner.btindex):
+        if screen:
+            #Only pairs sharing k-mers with the contaminants are aligned; trimming follows
+            cret = cleaner.deconScreen(keepbam, minhits=screen)
+            if cret == 0:
+                cret = cleaner.trimNative() if trimmer == 'native' else cleaner.trimIllumina()
+            cleaner.cleanReads()
+        else:
+            cret = cleaner.deconTrim(keepbam, trimmer=trimmer)
+    return(cret)
+
+def cleanup(bowtie_path, bbduk_path, sam_path, read1, read2, confile, adapters, outdir, threads,
+            memory=None, trimmer='bbduk', screen=None, indexcache=None, keepbam=False):
+    '''Decontaminate and trim illumina reads without assembling them'''
+    cleaner = Cleaner(bowtie_path, bbduk_path, sam_path, read1, read2, confile, adapters, outdir, threads,
+        memory, indexcache)
     logging.info('Building bowtie index')
     cret = cleaner.buildIndex()
-    if cret == 0:
-        logging.info("Bowtie index built")
-    else:
-        logging.error("Bowtie index failed")
-        sys.exit()
-    
-    logging.info("Removing contaminants from illumina reads")
-    cret = cleaner.deconIllumina()
-    if cret == 0:
-        logging.info("Contaminants removed from illumina reads")
-    else:
-        logging.error("Bowtie failed on illumina reads")
-        sys.exit()
-    
-    logging.info("Sorting to sam files")
-    cret = cleaner.sortBam()
-    if cret == 0:
-        logging.info("Sorting completed")
-    else:
-        logging.error("Sorting failed")
-        sys.exit()
-
-    logging.info("Indexing to bam files")
-    cret = cleaner.indexBam()
-    if cret == 0:
-        logging.info("Indexing completed")
-    else:
-        logging.error("Indexing failed")
-        sys.exit()
+    if cret != 0:
+        logging.error('Bowtie index failed; Check cleaner log : {0}'.format(cleaner.log))
+        return(cret)
+    logging.info('Removing contaminants from illumina reads')
+    cret = decontaminate(cleaner, trimmer, screen, keepbam)
+    if cret != 0:
+        logging.error('Decontamination failed; Check cleaner log : {0}'.format(cleaner.log))
+        return(cret)
+    logging.info('Decontaminated files can be found at : \n {0},{1}'.format(cleaner.tread1, cleaner.tread2))
+    if keepbam:
+        logging.info('Contaminant alignments can be found at : {0}'.format(cleaner.conbam))
+    return(cret)
 
-    cleaner.cleanSam()
-    return
+def realign(bowtie_path, bbduk_path, sam_path, read1, read2, confile, adapters, outdir, threads,
+            memory=None, trimmer='bbduk', screen=None, indexcache=None):
+    '''Decontaminate and trim illumina reads, keeping their contaminant alignments as a bam'''
+    return(cleanup(bowtie_path, bbduk_path, sam_path, read1, read2, confile, adapters, outdir, threads,
+        memory, trimmer, screen, indexcache, keepbam=True))
 
 def unitTest(abyss_path, sga_path, spades_path, ngopt_path, panda_path, 
             blast_path, celera_path, sprai_path, canu_path, bowtie_path, 
             sam_path, bbduk_path, read1, read2, outdir, abyss_klen, 
             sga_klen, spades_klen, sample_name, threads, egs, depth, 
-            reference, adapters):
+            reference, adapters, memory=None, pacbio=None, force=False,
+            scheduler=None, depends=(), trimmer='bbduk', screen=None, indexcache=None,
+            normalize=None, normalize_memory=1.0, subsample=None, pacbio_subsample=None,
+            longest=False, seed=0):
+    '''Run cleaning, every assembler and evaluation as a dependency graph
 
-    #Decontaminate illumina reads
-    logging.info('Decontaminating illumina reads')
-    cleaner = Cleaner(bowtie_path, sam_path, read1, read2, reference, adapters, 
-                    outdir, threads) 
-    logging.info('Building bowtie index')
-    cleaner.buildIndex()
-    logging.info('Aligning illumina reads') 
-    cleaner.deconIllumina()
-    logging.info('Trimming adapter and overrepresented sequences')
-    cleaner.trimIllumina()
-    logging.info('Decontamination of illumina reads completed')
+    When a scheduler is given the stages are only added to it, named
+    after the sample and run after the depends stages, for batch runs.
+    '''
+    resources = Resources(threads, memory)
+    batch = scheduler is not None
+    if not batch:
+        checkpoint = Checkpoint('{0}/checkpoints.json'.format(os.path.abspath(outdir)))
+        if force:
+            checkpoint.stages = dict()
+        scheduler = Scheduler(resources, checkpoint)
+    prefix = '{0}_'.format(sample_name) if batch else ''
+    if indexcache is None:
+        indexcache = IndexCache('{0}/index_cache'.format(os.path.abspath(outdir)))
+    rawreads = [os.path.abspath(read1), os.path.abspath(read2)]
+    cleaner = Cleaner(bowtie_path, bbduk_path, sam_path, read1, read2, reference, adapters, 
+                    outdir, resources.threads, resources.memory, indexcache) 
     read1 = cleaner.tread1
     read2 = cleaner.tread2
-    cleaner.cleanSam()
-    logging.info('Decontaminated files can be found at : \n {0},{1}'.format(read1, read2))
-    
+    cleanreads = [read1, read2]
+    #Assemblers read subsampled and normalized pairs when asked for; evaluation aligns every cleaned pair
+    upstream = prefix + 'cleaner'
+    if subsample:
+        subdir = '{0}/subsampled_fastq'.format(os.path.abspath(outdir))
+        if not os.path.exists(subdir):
+            os.mkdir(subdir)
+        read1 = '{0}/subsampled_r1.fastq'.format(subdir)
+        read2 = '{0}/subsampled_r2.fastq'.format(subdir)
+        upstream = prefix + 'subsample'
+    subreads = [read1, read2]
+    if normalize:
+        normdir = '{0}/normalized_fastq'.format(os.path.abspath(outdir))
+        if not os.path.exists(normdir):
+            os.mkdir(normdir)
+        read1 = '{0}/normalized_r1.fastq'.format(normdir)
+        read2 = '{0}/normalized_r2.fastq'.format(normdir)
+        upstream = prefix + 'normalize'
+    assemblyreads = [read1, read2]
+    longreads = list()
+    longstages = [upstream]
+    if pacbio:
+        longreads = [os.path.abspath(pacbio)]
+        if pacbio_subsample:
+            pbdir = '{0}/subsampled_pacbio'.format(os.path.abspath(outdir))
+            if not os.path.exists(pbdir):
+                os.mkdir(pbdir)
+            pacbio = '{0}/subsampled_pacbio.fastq'.format(pbdir)
+            longstages = [upstream, prefix + 'pacbio_subsample']
 
-    #AbySS call
-    logging.info('Starting AbySS')
-    abyss = Abyss(abyss_path, read1, read2, outdir, abyss_klen, threads)
-    aret = abyss.abyss() 
-    if aret != 0:
-        logging.error("AbySS failed with returncode {0}; Check abyss log for further details : {1}; Exiting pipeline".format(aret, abyss.log))
-        sys.exit()
-    else:
-        logging.info("AbySS completed sucessfully")
+    def runCleaner(allocation):
+        #Decontaminate illumina reads
+        cleaner.threads = allocation.threads
+        cleaner.memory = allocation.memory
+        #Batch runs build the contaminant index in a shared stage; this finds it in the cache
+        logging.info('Building bowtie index')
+        cret = cleaner.buildIndex()
+        if cret != 0:
+            return(cret)
+        logging.info('Aligning illumina reads and trimming adapter and overrepresented sequences') 
+        cret = decontaminate(cleaner, trimmer, screen)
+        if cret == 0:
+            logging.info('Decontaminated files can be found at : \n {0},{1}'.format(*cleanreads))
+        return(cret)
 
-    #SGA call
-    sga_klen = sga_klen.split(",")
-    correct = sga_klen[0]
-    overlap = sga_klen[1]
-    assemble = sga_klen[2]
-    sret = 0
-    logging.info("Starting SGA")
-    sga = Sga(sga_path, read1, read2, outdir, sample_name, correct, overlap, assemble, threads) 
-    logging.info("Starting SGA preprocess")
-    sret = sga.sgaPreProcess()
-    if sret != 0:
-        logging.error("SGA pre precess failed with returncode {0}; Check sga log for further details : {1}; Exiting pipeline".format(sret, sga.log))
-        sys.exit()
-    else:
-        logging.info('SGA pre process completed sucessfully')
+    def runTool(wrapper, function):
+        #Wrappers are built up front for their output paths; threads and memory are set at launch
+        def runWrapper(allocation):
+            wrapper.threads = allocation.threads
+            if hasattr(wrapper, 'memory'):
+                wrapper.memory = allocation.memory
+            return(function())
+        return(runWrapper)
 
-    logging.info("Starting SGA index")
-    sret = sga.sgaIndex()
-    if sret != 0:
-        logging.error("SGA index failed with returncode {0}; Check sga log for further details : {1}; Exiting pipeline".format(sret, sga.log))
-        sys.exit()
-    else:
-        logging.info("SGA index completed sucessfully")
+    def runSga():
+        #Index is rebuilt after correction
+        for step in [sga.sgaPreProcess, sga.sgaIndex, sga.sgaCorrect, sga.sgaIndex,
+            sga.sgaFilter, sga.sgaOverlap, sga.sgaAssemble]:
+            logging.info('Starting SGA step : {0}'.format(step.__name__))
+            sret = step()
+            if sret != 0:
+                logging.error('SGA step {0} failed with returncode {1}; Check sga log for further details : {2}'.format(
+                    step.__name__, sret, sga.log))
+                return(sret)
+        return(0)
 
-    logging.info("Starting SGA correct")
-    sret = sga.sgaCorrect()
-    if sret != 0:
-        logging.error("SGA correct failed with returncode {0}; Check sga log for further details : {1}; Exiting pipeline".format(sret, sga.log))
-        sys.exit()
-    else:
-        logging.info("SGA correct completed sucessfully")
-    
-    logging.info("Starting SGA index")
-    sret = sga.sgaIndex()
-    if sret != 0:
-        logging.error("SGA index failed with returncode {0}; Check sga log for further details : {1}; Exiting pipeline".format(sret, sga.log))
-        sys.exit()
-    else:
-        logging.info("SGA index comepleted sucessfully")
+    def runSprai():
+        logging.info("Writing down specifications")
+        sprai.ecconfig()
+        sprai.pbasmconfig()
+        return(sprai.sprai())
 
-    logging.info("Starting SGA filter")
-    sret = sga.sgaFilter()
-    if sret != 0:
-        logging.error("SGA filter failed with returncode {0}; Check sga log for further details : {1}; Exiting pipeline".format(sret, sga.log))
-        sys.exit()
-    else:
-        logging.info("SGA filter failed")
+    def runCanu():
+        canu.pbconfig()
+        return(canu.canu())
 
-    logging.info("Starting SGA overlap")
-    sret = sga.sgaOverlap()
-    if sret != 0:
-        logging.error("SGA overlap failed with returncode {0}; Check sga log for further details : {1}; Exiting pipeline".format(sret, sga.log))
-        sys.exit()
-    else:
-        logging.info("SGA overlap completed sucessfully")
+    def writeSummary(metrics, path):
+        summary = open(path, 'w')
+        summary.write('Metric\tValue\n')
+        for metric, value in metrics.items():
+            summary.write('{0}\t{1}\n'.format(metric, value))
+        summary.close()
+        return
 
-    logging.info("Starting SGA assemble")
-    sret = sga.sgaAssemble()
-    if sret != 0:
-        logging.error("SGA assembly failed with returncode {0}; Check sga log for further details : {1}; Exiting pipeline".format(sret, sga.log))
-        sys.exit()
-    else:
-        logging.info("SGA assembly comepleted sucessfully")
+    def runSubsample(allocation):
+        #Depth is counted against the estimated genome size; selection is seeded so reruns agree
+        subsampler = Subsampler(genomeSize(egs), subsample, seed)
+        metrics = subsampler.subsamplePairs(cleanreads[0], cleanreads[1], subreads[0], subreads[1], subdir,
+            allocation.threads)
+        writeSummary(metrics, '{0}/subsample_summary.tsv'.format(subdir))
+        return(0)
 
-    logging.info("SGA pipeline completed sucessfully")
+    def runPacbioSubsample(allocation):
+        subsampler = Subsampler(genomeSize(egs), pacbio_subsample, seed, longest)
+        metrics = subsampler.subsampleReads(longreads[0], pacbio, pbdir, allocation.threads)
+        writeSummary(metrics, '{0}/subsample_summary.tsv'.format(pbdir))
+        return(0)
 
-    #Spades call
-    logging.info("SPAdes assembly started")
-    spades = Spades(spades_path, read1, read2, outdir, spades_klen, threads)
-    spret = spades.spades()
-    spret = 0 
-    if spret != 0:
-        logging.error("SPAdes assembly failed with returncode {0}; Check spades log for further details : {1}; Exiting pipeline".format(spret, spades.log))
-        sys.exit()
-    else:
-        logging.info("SPAdes assembly completed sucessfully")
+    def runNormalize(allocation):
+        normalizer = Normalizer(normalize, memory=normalize_memory)
+        metrics = normalizer.normalize(subreads[0], subreads[1], read1, read2, normdir, allocation.threads)
+        writeSummary(metrics, '{0}/normalize_summary.tsv'.format(normdir))
+        return(0)
 
-    #Ngopt call
-    logging.info("NGOPT assembly started")
-    ngopt = Ngopt(ngopt_path, read1, read2, outdir, sample_name, threads)
-    nret = ngopt.ngopt()
-    if nret != 0:
-        logging.error("NGOPT assembly failed with returncode {0}; Check NGOPT log for further details : {1}; Exiting pipeline".format(nret, ngopt.log))
-        sys.exit()
-    else:
-        logging.info("NGOPT assembly completed sucessfully")
-    
-    #PandaSeq call
-    logging.info("PandaSeq assembly started")   
-    panda = PandaSeq(panda_path, read1, read2, outdir, threads)
-    pret = panda.pandaseq()
-    if pret != 0:
-        logging.error("PandaSeq assembly failed with returncode {0}; Check PandaSeq log for further details : {1}; Exiting pipeline".format(pret, panda.log))
-        sys.exit() 
-    else:
-        logging.info("PandaSeq assembly completed sucessfully")
+    def evaluateStage(method, assembly):
+        def runEvaluate(allocation):
+            evaluate = Evaluate(bowtie_path, sam_path, None, cleanreads[0], cleanreads[1], None, assembly, outdir,
+                allocation.threads, method, None, allocation.memory, indexcache)
+            eret = evaluate.buildIndex()
+            if eret != 0:
+                return(eret)
+            with indexcache.hold(evaluate.assemblyindex):
+                eret = evaluate.alignStream()
+            if eret != 0:
+                return(eret)
+            eret = evaluate.coverageMetrics()
+            if eret != 0:
+                return(eret)
+            return(evaluate.breakpoints())
+        return(runEvaluate)
 
-    #Spades hybrid assembly
-    logging.info("Spades hybrid assembly started")
-    spades = SpadesHybrid(spades_path, read1, read2, pacbio, outdir, kmers, threads)
-    spret = spades.spades()
-    if spret != 0:
-        logging.error("SPAdes hybrid assembly failed with returncode {0}; Check spades log for further details : {1}; Exiting pipeline".format(spret, spades.log))
-        sys.exit()
-    else:
-        logging.info("SPAdes hybrid assembly completed sucessfully")
+    #Assemblers as name, wrapper, run function, share of the node, parameters, tool and result;
+    #tools without a safe version flag are declared with None and versioned by their executable
+    abyss = Abyss(abyss_path, read1, read2, outdir, abyss_klen, resources.threads)
+    correct, overlap, assemble = sga_klen.split(",")[:3]
+    sga = Sga(sga_path, read1, read2, outdir, sample_name, correct, overlap, assemble, resources.threads) 
+    spades = Spades(spades_path, read1, read2, outdir, spades_klen, resources.threads, resources.memory)
+    ngopt = Ngopt(ngopt_path, read1, read2, outdir, sample_name, resources.threads)
+    panda = PandaSeq(panda_path, read1, read2, outdir, resources.threads)
+    assemblers = [('abyss', abyss, abyss.abyss, 0.25, abyss_klen, (abyss_path, None), abyss.result),
+        ('sga', sga, runSga, 0.25, sga_klen, sga_path, sga.results),
+        ('spades', spades, spades.spades, 0.5, spades_klen, spades_path, spades.result),
+        ('ngopt', ngopt, ngopt.ngopt, 0.25, None, (ngopt_path, None), ngopt.result),
+        ('pandaseq', panda, panda.pandaseq, 0.125, panda.params, (panda_path, None), panda.result)]
+    if pacbio:
+        hybrid = SpadesHybrid(spades_path, read1, read2, pacbio, outdir, spades_klen, resources.threads,
+            resources.memory)
+        sprai = Sprai(sprai_path, celera_path, blast_path, pacbio, outdir, resources.threads, egs, depth)
+        canu = Canu(canu_path, pacbio, outdir, resources.threads, egs, depth, sample_name, resources.memory)
+        assemblers += [('spadesHybrid', hybrid, hybrid.spades, 0.5, spades_klen, spades_path, hybrid.result),
+            ('sprai', sprai, runSprai, 0.25, [egs, depth], (sprai_path, None), None),
+            ('canu', canu, runCanu, 0.5, [egs, depth], (canu_path, ['-version']), canu.result)]
 
-    #Sprai call
-    logging.info("Sprai assembly started")
-    sprai = Sprai(sprai_path, celera_path, blast_path, pacbio, outdir, threads, egs, depth)
-    logging.info("Writing down specifications")
-    sprai.ecconfig
-    sprai.pacbio
-    logging.info("Starting assembly")
-    sret = sprai.sprai()
-    if sret != 0:
-        logging.error("Sprai assembly failed with returncode {0}; Check Sprai log for further details : {1}; Exiting pipeline".format(sret, sprai.log))
-        sys.exit() 
-    else:
-        logging.info("Sprai assembly completed sucessfully")
+    scheduler.add(prefix + 'cleaner', runCleaner, depends,
+        inputs=rawreads + [cleaner.reference] + cleaner.adapters.split(','), params=[trimmer, screen],
+        tools=[bowtie_path, bbduk_path] if trimmer == 'bbduk' else [bowtie_path], outputs=cleanreads,
+        group=sample_name)
+    if subsample:
+        scheduler.add(prefix + 'subsample', runSubsample, [prefix + 'cleaner'], 0.125, cleanreads,
+            [egs, subsample, seed], outputs=subreads, group=sample_name)
+    if normalize:
+        scheduler.add(prefix + 'normalize', runNormalize, [prefix + ('subsample' if subsample else 'cleaner')],
+            0.125, subreads, [normalize, normalize_memory], outputs=assemblyreads, group=sample_name)
+    if pacbio and pacbio_subsample:
+        scheduler.add(prefix + 'pacbio_subsample', runPacbioSubsample, depends, 0.125, longreads,
+            [egs, pacbio_subsample, seed, longest], outputs=[pacbio], group=sample_name)
+    for method, wrapper, function, share, params, tool, result in assemblers:
+        outputs = [result] if result else []
+        longread = method in ('spadesHybrid', 'sprai', 'canu')
+        inputs = assemblyreads + (longreads if longread else [])
+        scheduler.add(prefix + method, runTool(wrapper, function), longstages if longread else [upstream],
+            share, inputs, params, [tool], outputs, sample_name)
+        if result:
+            scheduler.add('{0}{1}_evaluate'.format(prefix, method), evaluateStage(method, result),
+                [prefix + method], 0.25, [result] + cleanreads, None, [bowtie_path, sam_path],
+                ['{0}/{1}/{1}{2}'.format(os.path.abspath(outdir), method, suffix)
+                for suffix in ('.bam', '_coverage.tsv', '_inserts.tsv', '_breakpoints.bed', '_misassembly.tsv')],
+                sample_name)
+    if batch:
+        return(None)
+    status = scheduler.run()
+    for stage, state in status.items():
+        logging.info('{0} : {1}'.format(stage, state))
+    return(status)
 
-    #Canu call
-    logging.info("Canu assembly started")
-    canu = Canu(canu_path, pacbio, outdir, threads, egs, depth, name)
-    canu.pbconfig()
-    cret = canu.canu()
-    if cret != 0:
-        logging.error("Canu assembly failed with returncode {0}; Check Canu log for further details : {1}; Exiting pipeline".format(cret, canu.log))
-        sys.exit() 
-    else:
-        logging.info("Canu assembly completed sucessfully")
-    
-    return
+def readSampleSheet(samplesheet):
+    '''Read a tab or comma separated sample sheet with sample, R1, R2, PacBio and genome size columns'''
+    Sample = collections.namedtuple('Sample', ['name', 'read1', 'read2', 'pacbio', 'egs'])
+    columns = {'sample' : 'name', 'r1' : 'read1', 'read1' : 'read1', 'r2' : 'read2', 'read2' : 'read2',
+        'pacbio' : 'pacbio', 'genomesize' : 'egs', 'gsize' : 'egs'}
+    sheetdir = os.path.dirname(os.path.abspath(samplesheet))
+    sheethandle = open(samplesheet)
+    head = sheethandle.readline()
+    sheethandle.seek(0)
+    delimiter = '\t' if '\t' in head else ','
+    samples = list()
+    for row in csv.DictReader(sheethandle, delimiter=delimiter):
+        values = dict()
+        for key, value in row.items():
+            key = re.sub('[ _-]', '', (key or '').lower())
+            if key in columns:
+                values[columns[key]] = (value or '').strip() or None
+        if not values.get('name'):
+            continue
+        #Relative read paths are taken from the sample sheet location
+        for key in ['read1', 'read2', 'pacbio']:
+            if values.get(key) and not os.path.isabs(values[key]):
+                values[key] = os.path.join(sheetdir, values[key])
+        if not values.get('read1') or not values.get('read2'):
+            raise ValueError('Sample {0} needs both R1 and R2 in {1}'.format(values['name'], samplesheet))
+        samples.append(Sample(values['name'], values['read1'], values['read2'], values.get('pacbio'),
+            values.get('egs')))
+    sheethandle.close()
+    if len(set([sample.name for sample in samples])) != len(samples):
+        raise ValueError('Sample names are not unique in {0}'.format(samplesheet))
+    return(samples)
+
+def batchRun(samplesheet, abyss_path, sga_path, spades_path, ngopt_path, panda_path,
+            blast_path, celera_path, sprai_path, canu_path, bowtie_path,
+            sam_path, bbduk_path, outdir, abyss_klen, sga_klen, spades_klen,
+            threads, egs, depth, reference, adapters, memory=None, force=False, trimmer='bbduk',
+            screen=None, indexcache=None, normalize=None, normalize_memory=1.0, subsample=None,
+            pacbio_subsample=None, longest=False, seed=0):
+    '''Run every sample in a sample sheet through one shared, fair share scheduler'''
+    samples = readSampleSheet(samplesheet)
+    resources = Resources(threads, memory)
+    checkpoint = Checkpoint('{0}/checkpoints.json'.format(os.path.abspath(outdir)))
+    if force:
+        checkpoint.stages = dict()
+    scheduler = Scheduler(resources, checkpoint)
+    if indexcache is None:
+        indexcache = IndexCache('{0}/index_cache'.format(os.path.abspath(outdir)))
+    #The contaminant index is shared by all samples and built once
+    indexer = Cleaner(bowtie_path, bbduk_path, sam_path, samples[0].read1, samples[0].read2, reference,
+        adapters, outdir, resources.threads, resources.memory, indexcache)
+
+    def buildContaminant(allocation):
+        #Only built here; each sample holds the entries while it reads them
+        cret = indexer.buildIndex()
+        if cret == 0 and screen:
+            KmerScreen(indexer.reference, indexcache).load()
+        return(cret)
+
+    scheduler.add('contaminant_index', buildContaminant, inputs=[indexer.reference], params=screen,
+        tools=[bowtie_path])
+    for sample in samples:
+        sampledir = '{0}/{1}'.format(os.path.abspath(outdir), sample.name)
+        if not os.path.exists(sampledir):
+            os.mkdir(sampledir)
+        unitTest(abyss_path, sga_path, spades_path, ngopt_path, panda_path, blast_path, celera_path,
+            sprai_path, canu_path, bowtie_path, sam_path, bbduk_path, sample.read1, sample.read2,
+            sampledir, abyss_klen, sga_klen, spades_klen, sample.name, threads, sample.egs or egs, depth,
+            reference, adapters, memory, sample.pacbio, force, scheduler, ['contaminant_index'], trimmer,
+            screen, indexcache, normalize, normalize_memory, subsample, pacbio_subsample, longest, seed)
+    status = scheduler.run()
+    for sample in samples:
+        stages = [state for stage, state in status.items() if stage.startswith('{0}_'.format(sample.name))]
+        logging.info('{0} : {1} of {2} stages completed'.format(sample.name, stages.count('done'), len(stages)))
+    return(status)
 
 if __name__ == '__main__':
     FORMAT = '%(asctime)-15s : %(levelname)-8s :  %(message)s'
@@ -300,6 +421,10 @@ if __name__ == '__main__':
         help='Assembly file')
     pbrazi.add_argument('-t', '--threads', type=str, dest='threads', default='2',
         help='Number of threads')
+    pbrazi.add_argument('--memory', type=int, dest='memory', default=None,
+        help='Memory limit in GB; defaults to most of the node memory')
+    pbrazi.add_argument('-s', '--samplesheet', type=str, dest='samplesheet', default=None,
+        help='Tab or comma separated sample sheet with sample, R1, R2, PacBio and genome size columns')
     pbrazi.add_argument('-x', '--xml', type=str, dest='xml', nargs='+',
         help='Sample PB Jelly xml file')
     pbrazi.add_argument('--spades', type=str, dest='spades_path',
@@ -328,6 +453,27 @@ if __name__ == '__main__':
         help='Path to PBJelly', default='Jelly.py')
     pbrazi.add_argument('--bbduk', type=str, dest='bbduk_path',
         help='Path to bbduk', default='bbduk')
+    pbrazi.add_argument('--trimmer', type=str, dest='trimmer', choices=['bbduk', 'native'], default='bbduk',
+        help='Trim adapters with BBDuk or with the in process native trimmer')
+    pbrazi.add_argument('--screen', type=int, nargs='?', const=1, dest='screen', default=None,
+        help='Align only read pairs sharing at least this many k-mers, 1 when not given, with the contaminant '
+        'reference; higher values align fewer clean pairs but may pass lightly contaminated pairs as clean')
+    pbrazi.add_argument('--index_cache', type=str, dest='index_cache', default=None,
+        help='Directory of bowtie indexes shared between runs; defaults to index_cache in the output directory')
+    pbrazi.add_argument('--index_cache_size', type=float, dest='index_cache_size', default=None,
+        help='Evict least recently used indexes above this many GB')
+    pbrazi.add_argument('--normalize', type=int, dest='normalize', default=None,
+        help='Cap read coverage at this median k-mer count with digital normalization before assembly')
+    pbrazi.add_argument('--normalize_memory', type=float, dest='normalize_memory', default=1.0,
+        help='Memory in GB for the digital normalization count-min sketch')
+    pbrazi.add_argument('--subsample', type=float, dest='subsample', default=None,
+        help='Downsample cleaned read pairs to this depth of the estimated genome size before assembly')
+    pbrazi.add_argument('--pacbio_subsample', type=float, dest='pacbio_subsample', default=None,
+        help='Downsample pacbio reads to this depth of the estimated genome size before assembly')
+    pbrazi.add_argument('--longest_first', action='store_true', dest='longest',
+        help='Keep the longest pacbio reads when subsampling instead of a random selection')
+    pbrazi.add_argument('--subsample_seed', type=int, dest='seed', default=0,
+        help='Seed of the read selection when subsampling; the same seed selects the same reads')
     pbrazi.add_argument('--abyss_kmers', type=str, dest='abyss_klen',
         help='Kmer length for AbySS assembly', default='63')
     pbrazi.add_argument('--sga_kmers', type=str, dest='sga_klen',
@@ -343,24 +489,64 @@ if __name__ == '__main__':
     pbrazi.add_argument('--adapters', type=str, dest='adapters', nargs='+',
         help='Path to adapter and overrepresented sequence fasta file')
     pbrazi.add_argument('-m', '--mode', type=str, dest='mode',
-        choices=['test', 'cleanup', 'realign', 'evaluate'], help='Sample name')
+        choices=['test', 'batch', 'cleanup', 'realign', 'evaluate', 'qc'], help='Sample name')
+    pbrazi.add_argument('--sample_interval', type=float, dest='interval', default=None,
+        help='Record CPU, memory, open files and io of running tools every N seconds')
+    pbrazi.add_argument('--memory_ceiling', type=float, dest='memlimit', default=None,
+        help='Kill any tool whose resident memory exceeds this many GB')
+    pbrazi.add_argument('--force', action='store_true', dest='force',
+        help='Rerun all stages, ignoring checkpoints from earlier runs')
     pbrazi.add_argument('-v', '--version', action='version', version='%(prog)s 0.9.6')
     opts = pbrazi.parse_args()
+    if opts.outdir is None:
+        pbrazi.error('-o/--outdir is required')
+    if opts.mode == 'test' and not (opts.name and opts.read1 and opts.read2):
+        pbrazi.error('test mode requires -n/--sample, -f/--read1 and -r/--read2')
+    if opts.mode in ('cleanup', 'realign') and not (opts.read1 and opts.read2 and opts.confile and opts.adapters):
+        pbrazi.error('{0} mode requires -f/--read1, -r/--read2, --contaminant and --adapters'.format(opts.mode))
+    if opts.mode == 'batch' and not opts.samplesheet:
+        pbrazi.error('batch mode requires -s/--samplesheet')
     if not os.path.exists(opts.outdir):
         os.mkdir(opts.outdir)
-    if opts.mod=`=jedi=3, e == 'test':=`= (abyss_path, sga_path, spades_path, ngopt_path, panda_path, blast_path, celera_path, sprai_path, canu_path, bowtie_path, sam_path, bbduk_path, read1, read2, outdir, abyss_klen, sga_klen, spades_klen, sample_name, threads, egs, depth, *_*reference*_*, adapters) =`=jedi=`=' '
+    #Cap requested threads and memory at what the node provides
+    resources = Resources(opts.threads, opts.memory)
+    logging.info('Running with {0} threads and {1}GB memory'.format(resources.threads, resources.memory))
+    opts.threads = resources.threads
+    configureSampler(opts.interval, opts.memlimit)
+    indexcache = IndexCache(opts.index_cache or '{0}/index_cache'.format(os.path.abspath(opts.outdir)),
+        opts.index_cache_size)
+    if opts.mode == 'test':
         unitTest(opts.abyss_path, opts.sga_path, opts.spades_path, opts.ngopt_path, opts.panda_path,
                 opts.blast_path, opts.celera_path, opts.sprai_path, opts.canu_path, 
-                opts.bowtie_path, opts.sam_path, opts.bbduk_path
+                opts.bowtie_path, opts.sam_path, opts.bbduk_path,
                 opts.read1[0], opts.read2[0], opts.outdir, opts.abyss_klen, 
-                opts.sga_klen, opts.spades_klen, opts.name, opts.threads, opts.egs,
-                opts.depth, opts.confile, opts.adapters)
+                opts.sga_klen, opts.spades_klen, opts.name[0], opts.threads, opts.egs,
+                opts.depth, opts.confile, opts.adapters, resources.memory,
+                opts.pacbio[0] if opts.pacbio else None, opts.force, trimmer=opts.trimmer,
+                screen=opts.screen, indexcache=indexcache, normalize=opts.normalize,
+                normalize_memory=opts.normalize_memory, subsample=opts.subsample,
+                pacbio_subsample=opts.pacbio_subsample, longest=opts.longest, seed=opts.seed)
+
+    if opts.mode == 'batch':
+        batchRun(opts.samplesheet, opts.abyss_path, opts.sga_path, opts.spades_path, opts.ngopt_path,
+                opts.panda_path, opts.blast_path, opts.celera_path, opts.sprai_path, opts.canu_path,
+                opts.bowtie_path, opts.sam_path, opts.bbduk_path, opts.outdir, opts.abyss_klen,
+                opts.sga_klen, opts.spades_klen, opts.threads, opts.egs, opts.depth, opts.confile,
+                opts.adapters, resources.memory, opts.force, opts.trimmer, opts.screen, indexcache,
+                opts.normalize, opts.normalize_memory, opts.subsample, opts.pacbio_subsample, opts.longest,
+                opts.seed)
 
     if opts.mode == 'cleanup':
-        cleanup(opts.bowtie_path, opts.bbduk_path, opts.read1[0], opts.read2[0], opts.pacbio[0], opts.confile, opts.outdir, opts.threads)
+        cleanup(opts.bowtie_path, opts.bbduk_path, opts.sam_path, opts.read1[0], opts.read2[0], opts.confile,
+            opts.adapters, opts.outdir, opts.threads, resources.memory, opts.trimmer, opts.screen, indexcache)
     
     if opts.mode == 'realign':
-        realign(opts.bowtie_path, opts.bbduk_path, opts.read1[0], opts.read2[0], opts.confile, opts.outdir, opts.threads)
+        realign(opts.bowtie_path, opts.bbduk_path, opts.sam_path, opts.read1[0], opts.read2[0], opts.confile,
+            opts.adapters, opts.outdir, opts.threads, resources.memory, opts.trimmer, opts.screen, indexcache)
+
+    if opts.mode == 'qc':
+        readStats(opts.read1[0], opts.read2[0], opts.outdir, opts.threads)
 
     if opts.mode == 'evaluate':
-        alignAssembly(opts.bowtie_path, opts.sam_path, opts.jelly_path, opts.read1[0], opts.read2[0], None, opts.assembly, opts.outdir, opts.threads, opts.name, None)
+        alignAssembly(opts.bowtie_path, opts.sam_path, opts.jelly_path, opts.read1[0], opts.read2[0], None, opts.assembly, opts.outdir, opts.threads, opts.name, None,
+            resources.memory, indexcache)
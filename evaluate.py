@@ -2,6 +2,8 @@ import os
 import sys
 import Bio
 import glob
+import timeit
+import logging
 import argparse
 import itertools
 import subprocess
@@ -9,59 +11,171 @@ import numpy as np
 import pandas as pd
 from Bio import SeqIO
 from collections import namedtuple
+from collections import OrderedDict
 from operator import attrgetter
 from itertools import repeat
 from multiprocessing import Pool
+from assemble.fasta import IndexedFasta
 
 def FastaParser(fasta):
     '''Parse fasta and return iterator with header and sequence'''
-    fasta_handle = open(fasta)
-    fasta_content = fasta_handle.read().split('>')[1:]
-    reference = list()
-    transcriptid = 0
+    fasta_index = IndexedFasta(fasta)
     Fasta = namedtuple('Fasta',['header','seq','tid','length'])
-    for lines in fasta_content:
-        header = lines.split('\n')[0]
-        sequence = ''.join(lines.split('\n')[1:]).upper()
-        length = len(sequence)
+    for transcriptid in range(len(fasta_index)):
+        header = fasta_index.header(transcriptid)
+        sequence = fasta_index.fetch(transcriptid).upper()
+        length = int(fasta_index.lengths[transcriptid])
         record = Fasta(header, sequence, transcriptid, length)
-        transcriptid += 1
         yield record
+    fasta_index.close()
 
-def ScafoldMetric(assemblies, assemblers, gsize):
-    outfile = open('AssemblyMetrics.csv','w')
-    outfile.write('Assembler\tScaffoldLength\tNG\n')
-    for assembly, assembler in zip(assemblies, assemblers):
-        tlen = 0
-        for contigs in sorted(FastaParser(assembly), key=attrgetter('length'), reverse=True):
-            if contigs.length >= 1000:
-                tlen += contigs.length
-                ngval = (tlen * 100)/float(gsize)
-                outfile.write('{0}\t{1}\t{2:.2f}\n'.format(assembler, contigs.length, ngval))
-    outfile.close()
-    return
-def ScafoldCounter(assemblies, assemblers, bsize):
-    metric_matrix = list()
-    metric_colnames = assemblers
-    metric_rownames = np.linspace(0, 230000, bsize)
-    contig_dict = dict()
-    for assembly, assembler in zip(assemblies, assemblers):
-        contig_list = list()
-        for contigs in FastaParser(assembly):
-            contig_list.append(contigs.length)
-        contig_dict[assembler] = contig_list  #list(np.histogram(contig_list, metric_rownames)[0]) + [0]
-    contig_table = pd.DataFrame(contig_dict, index=metric_rownames)
-    return(contig_table)
+def assemblyMetrics(lengths, gsize, composition=None):
+    '''Compute contiguity metrics from an array of contig lengths'''
+    metrics = OrderedDict()
+    lengths = np.sort(np.asarray(lengths, dtype=np.int64))[::-1]
+    cumlen = np.cumsum(lengths)
+    total = int(cumlen[-1]) if len(cumlen) else 0
+    metrics['Contigs'] = len(lengths)
+    metrics['TotalLength'] = total
+    metrics['Largest'] = int(lengths[0]) if len(lengths) else 0
+    #Nx is the length of the contig at which the cumulative length reaches x% of the total
+    for name, target in (('50', total / 2.0), ('G50', gsize / 2.0)):
+        index = int(np.searchsorted(cumlen, target))
+        if total > 0 and index < len(lengths):
+            metrics['N{0}'.format(name)] = int(lengths[index])
+            metrics['L{0}'.format(name)] = index + 1
+        else:
+            metrics['N{0}'.format(name)] = 0
+            metrics['L{0}'.format(name)] = 0
+    metrics['auN'] = float((lengths.astype(np.float64) ** 2).sum() / total) if total else 0.0
+    if composition is not None:
+        counts = composition.sum(axis=0)
+        acgt = counts[:4].sum()
+        metrics['GC'] = float(counts[1] + counts[2]) / acgt if acgt else 0.0
+        metrics['NContent'] = float(counts[4]) / counts.sum() if counts.sum() else 0.0
+    return(metrics)
+
+def assemblyWorker(args):
+    '''Read contig lengths, and composition when asked for, of one assembly in a worker process'''
+    assembly, minlen, composition = args
+    start = timeit.default_timer()
+    fasta_index = IndexedFasta(assembly)
+    keep = fasta_index.lengths >= minlen
+    lengths = fasta_index.lengths[keep]
+    #Lengths come from the index; only composition scans the sequence
+    if composition:
+        composition = fasta_index.composition()[keep]
+    else:
+        composition = None
+    fasta_index.close()
+    return(lengths, composition, timeit.default_timer() - start)
+
+def assemblyLengths(assemblies, minlen=0, jobs=1, composition=True):
+    '''Fan assemblies out over a process pool; results keep the input order'''
+    args = list(zip(assemblies, repeat(minlen), repeat(composition)))
+    if jobs > 1 and len(args) > 1:
+        pool = Pool(min(jobs, len(args)))
+        results = pool.map(assemblyWorker, args, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        results = [assemblyWorker(arg) for arg in args]
+    return(results)
+
+def ScafoldMetric(assemblies, assemblers, gsize, minlen=1000, summary='AssemblySummary.csv', jobs=1,
+    results=None):
+    '''Write the per contig NG curve and a summary table of assembly metrics
+
+    results of assemblyLengths are used when given instead of reading the
+    assemblies again.
+    '''
+    if results is None:
+        results = assemblyLengths(assemblies, minlen, jobs)
+    curves = list()
+    rows = list()
+    for assembler, (lengths, composition, elapsed) in zip(assemblers, results):
+        metrics = assemblyMetrics(lengths, gsize, composition)
+        rows.append(metrics)
+        logging.info('{0} : {1} contigs; Runtime : {2:.2f}'.format(assembler, len(lengths), elapsed))
+        lengths = np.sort(lengths)[::-1]
+        curves.append(pd.DataFrame({'Assembler' : assembler, 'ScaffoldLength' : lengths,
+            'NG' : np.cumsum(lengths) * 100 / float(gsize)}))
+    if curves:
+        curve = pd.concat(curves, ignore_index=True)
+    else:
+        curve = pd.DataFrame(columns=['Assembler', 'ScaffoldLength', 'NG'])
+    curve.to_csv('AssemblyMetrics.csv', sep='\t', index=False, float_format='%.2f')
+    summary_table = pd.DataFrame(rows, index=assemblers[:len(rows)])
+    summary_table.index.name = 'Assembler'
+    summary_table.to_csv(summary, sep='\t')
+    return(summary_table)
+
+def binEdges(lengths, bsize, scale='linear'):
+    '''Return bsize + 1 bin edges spanning the observed contig lengths'''
+    if len(lengths) == 0:
+        return(np.linspace(0, 1, bsize + 1))
+    low = max(int(lengths.min()), 1)
+    high = max(int(lengths.max()), low + 1)
+    if scale == 'log':
+        return(np.geomspace(low, high, bsize + 1))
+    return(np.linspace(low, high, bsize + 1))
+
+def lengthHistogram(lengths, assemblers, bsize=50, scale='linear'):
+    '''Bin contig lengths of all assemblies on shared edges into a long format table'''
+    codes = np.repeat(np.arange(len(lengths)), [len(values) for values in lengths])
+    if len(codes):
+        values = np.concatenate(lengths).astype(np.int64)
+    else:
+        values = np.zeros(0, dtype=np.int64)
+    edges = binEdges(values, bsize, scale)
+    #Right most edge is closed, as in np.histogram
+    bins = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, bsize - 1)
+    keys = codes * bsize + bins
+    shape = (len(lengths), bsize)
+    counts = np.bincount(keys, minlength=shape[0] * shape[1]).reshape(shape)
+    bases = np.bincount(keys, weights=values, minlength=shape[0] * shape[1]).reshape(shape).astype(np.int64)
+    cumbases = np.cumsum(bases, axis=1)
+    totals = np.maximum(cumbases[:, -1:], 1)
+    histogram = pd.DataFrame({'Assembler' : np.repeat(assemblers[:shape[0]], bsize),
+        'BinStart' : np.tile(edges[:-1], shape[0]), 'BinEnd' : np.tile(edges[1:], shape[0]),
+        'Count' : counts.ravel(), 'Bases' : bases.ravel(),
+        'CumCount' : np.cumsum(counts, axis=1).ravel(), 'CumBases' : cumbases.ravel(),
+        'CumFraction' : (cumbases / totals).ravel()})
+    return(histogram)
+
+def ScafoldCounter(assemblies, assemblers, bsize=50, scale='linear', minlen=0, jobs=1, results=None):
+    '''Return a long format contig length histogram for a list of assemblies'''
+    if results is None:
+        results = assemblyLengths(assemblies, minlen, jobs, composition=False)
+    lengths = [result[0] for result in results]
+    return(lengthHistogram(lengths, assemblers, bsize, scale))
 
 if __name__ == '__main__':
+    FORMAT = '%(asctime)-15s : %(levelname)-8s :  %(message)s'
+    logging.basicConfig(format=FORMAT, level=logging.DEBUG)
     troch =  argparse.ArgumentParser(prog='Hummingbird')
     troch.add_argument('-f', '--assemblies', type=str, dest='assemblies', nargs='+',
         help='Assembly file list')
     troch.add_argument('-a', '--assemblers', type=str, dest='assemblers', nargs='+',
         help='Assembler name list')
-    troch.add_argument('-b', '--bsize', type=int, dest='bsize', help='Number of bins to create')
+    troch.add_argument('-b', '--bsize', type=int, dest='bsize', default=50,
+        help='Number of bins to create')
+    troch.add_argument('-l', '--scale', type=str, dest='scale', default='linear',
+        choices=['linear', 'log'], help='Contig length bin spacing')
+    troch.add_argument('-o', '--histogram', type=str, dest='histogram', default='AssemblyStats.csv',
+        help='Contig length histogram table')
     troch.add_argument('-g', '--gsize', type=int, dest='gsize', help='Estimated genome size')
+    troch.add_argument('-m', '--minlen', type=int, dest='minlen', default=1000,
+        help='Minimum contig length to include in metrics')
+    troch.add_argument('-s', '--summary', type=str, dest='summary', default='AssemblySummary.csv',
+        help='Assembly summary table')
+    troch.add_argument('-j', '--jobs', type=int, dest='jobs', default=1,
+        help='Number of assemblies to evaluate in parallel')
     opts = troch.parse_args()
-    #contig_table = ScafoldCounter(opts.assemblies, opts.assemblers, opts.bsize)
-    #contig_table.to_csv('AssemblyStats.csv',header=True, sep=',')
-    ScafoldMetric(opts.assemblies, opts.assemblers, opts.gsize)
+    #Every assembly is read once for both tables
+    results = assemblyLengths(opts.assemblies, opts.minlen, opts.jobs)
+    contig_table = ScafoldCounter(opts.assemblies, opts.assemblers, opts.bsize, opts.scale,
+        opts.minlen, opts.jobs, results)
+    contig_table.to_csv(opts.histogram, header=True, sep='\t', index=False)
+    ScafoldMetric(opts.assemblies, opts.assemblers, opts.gsize, opts.minlen, opts.summary,
+        opts.jobs, results)